@@ -0,0 +1,132 @@
+"""
+Compare the cache codec against plain JSON for a few kinds of cached objects.
+
+Reports encode/decode time and the encoded size for each kind. When a redis url is
+given the objects are also written to redis to report MEMORY USAGE.
+
+    python benchmarks/cache_codec.py [--redis-url redis://localhost:6379] [--iterations 2000]
+"""
+import argparse
+import json
+import timeit
+import uuid
+
+import redis
+
+from deli.cache.codec import CacheCodec
+
+
+def base_raw(kind, name, namespace=None):
+    raw = {
+        "apiVersion": "sandwichcloud.com/v1alpha1",
+        "kind": kind,
+        "metadata": {
+            "name": name,
+            "resourceVersion": "123456",
+            "uid": str(uuid.uuid4()),
+            "creationTimestamp": "2018-06-01T00:00:00Z",
+            "labels": {
+                "sandwichcloud.com/name": name,
+            },
+            "annotations": {
+                "sandwichcloud.com/updatedAt": "2018-06-01T00:00:00+00:00",
+            },
+            "finalizers": ["delete.sandwichcloud.com"]
+        },
+        "spec": {},
+        "status": {
+            "state": "Created",
+            "errorMessage": ""
+        }
+    }
+    if namespace is not None:
+        raw['metadata']['namespace'] = namespace
+    return raw
+
+
+def instance(user_data_lines):
+    raw = base_raw("Instance", "instance-1", "sandwich-project")
+    for label in ["region", "zone", "image", "network", "network-port", "service-account", "vm-id"]:
+        raw['metadata']['labels']["sandwichcloud.com/" + label] = str(uuid.uuid4())
+    raw['spec'] = {
+        "flavor": {"name": "m1.small", "vcpus": 2, "ram": 4096, "disk": 40},
+        "keypairs": ["keypair-1", "keypair-2"],
+        "userData": "#cloud-config\n" + "\n".join(
+            "runcmd: echo 'configuring step " + str(i) + "' >> /var/log/setup.log" for i in range(user_data_lines)),
+        "initialVolumes": [{"size": 10, "auto_delete": True}],
+    }
+    raw['status']['initialVolumes'] = ["volume-1"]
+    raw['status']['task'] = {"name": None, "kwargs": {}}
+    raw['status']['powerState'] = "POWERED_ON"
+    return raw
+
+
+def policy(bindings):
+    raw = base_raw("IAMPolicy", "project")
+    raw['spec'] = {
+        "bindings": [
+            {
+                "role": "role-" + str(i),
+                "members": ["user:user" + str(j) + "@example.com" for j in range(10)]
+            } for i in range(bindings)
+        ]
+    }
+    return raw
+
+
+def volume():
+    raw = base_raw("Volume", "volume-1", "sandwich-project")
+    raw['metadata']['labels']["sandwichcloud.com/zone"] = str(uuid.uuid4())
+    raw['spec'] = {"size": 10, "cloned_from": None}
+    raw['status']['attachedTo'] = "instance-1"
+    raw['status']['backingId'] = "[datastore1] sandwich/volume-1.vmdk"
+    return raw
+
+
+SAMPLES = {
+    "volume": volume(),
+    "instance": instance(5),
+    "instance (large userData)": instance(500),
+    "policy (10 bindings)": policy(10),
+    "policy (500 bindings)": policy(500),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cache codec")
+    parser.add_argument("--redis-url", help="Measure memory usage in this redis")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    redis_client = None
+    if args.redis_url is not None:
+        redis_client = redis.StrictRedis.from_url(args.redis_url)
+
+    codecs = [
+        ("json", lambda data: json.dumps(data).encode(), lambda data: json.loads(data.decode())),
+        ("msgpack", CacheCodec(compress_threshold=-1).encode, CacheCodec().decode),
+        ("msgpack+zlib", CacheCodec().encode, CacheCodec().decode),
+    ]
+
+    print("%-28s %-14s %10s %10s %10s %10s" % ("kind", "codec", "encode us", "decode us", "bytes", "redis"))
+    for kind, raw in SAMPLES.items():
+        for codec_name, encode, decode in codecs:
+            encoded = encode(raw)
+            assert decode(encoded) == raw
+
+            encode_us = timeit.timeit(lambda: encode(raw), number=args.iterations) / args.iterations * 1e6
+            decode_us = timeit.timeit(lambda: decode(encoded), number=args.iterations) / args.iterations * 1e6
+
+            memory = "-"
+            if redis_client is not None:
+                key = "benchmark_cache_codec_" + str(uuid.uuid4())
+                redis_client.set(key, encoded)
+                memory = str(redis_client.execute_command("MEMORY", "USAGE", key))
+                redis_client.delete(key)
+
+            print("%-28s %-14s %10.1f %10.1f %10d %10s" % (kind, codec_name, encode_us, decode_us, len(encoded),
+                                                           memory))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,464 @@
 import json
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
 
 import redis
+from go_defer import with_defer, defer
+
+from deli.cache.codec import CacheCodec
+
+# Returned by get(key, allow_missing=True) for keys that are known not to exist
+MISSING = object()
+
+# Sets the first clear bit below ARGV[1], -1 if they are all set and -2 if the bitmap doesn't exist
+BITMAP_ALLOCATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -2
+end
+local position = redis.call('BITPOS', KEYS[1], 0)
+if position < 0 or position >= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('SETBIT', KEYS[1], position, 1)
+return position
+"""
+
+# Clears bit ARGV[1] without creating the bitmap if it doesn't exist
+BITMAP_RELEASE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('SETBIT', KEYS[1], ARGV[1], 0)
+return 1
+"""
+
+# Makes ARGV[1] a member of exactly the index sets KEYS[2..n]
+# KEYS[1] is the record of the index sets the member is in so it can be removed from stale ones
+UPDATE_INDEX_SCRIPT = """
+local index_keys = {}
+for i = 2, #KEYS do
+    index_keys[KEYS[i]] = true
+end
+for _, index_key in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if not index_keys[index_key] then
+        redis.call('SREM', index_key, ARGV[1])
+    end
+end
+redis.call('DEL', KEYS[1])
+for i = 2, #KEYS do
+    redis.call('SADD', KEYS[i], ARGV[1])
+    redis.call('SADD', KEYS[1], KEYS[i])
+end
+return 1
+"""
+
+# Checks the requested amounts against the limits and reserves them in one step
+# KEYS: usage hash, reservations hash, reservation expirations
+# ARGV: now, ttl, reservation id, used vcpu, ram, disk, limit vcpu, ram, disk, requested vcpu, ram, disk
+# Returns {0, 0} if reserved otherwise {index of the resource over its limit, amount used}
+QUOTA_RESERVE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)
+for _, id in ipairs(expired) do
+    redis.call('HDEL', KEYS[2], id)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now)
+
+local used = {tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])}
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    local values = redis.call('HMGET', KEYS[1], 'vcpu', 'ram', 'disk')
+    for i = 1, 3 do
+        used[i] = tonumber(values[i]) or 0
+    end
+end
+for _, reserved in ipairs(redis.call('HVALS', KEYS[2])) do
+    local i = 1
+    for amount in string.gmatch(reserved, '[^:]+') do
+        used[i] = used[i] + tonumber(amount)
+        i = i + 1
+    end
+end
+
+for i = 1, 3 do
+    local limit = tonumber(ARGV[6 + i])
+    local requested = tonumber(ARGV[9 + i])
+    if requested > 0 and limit ~= -1 and used[i] + requested > limit then
+        return {i, used[i]}
+    end
+end
+
+redis.call('HSET', KEYS[2], ARGV[3], ARGV[10] .. ':' .. ARGV[11] .. ':' .. ARGV[12])
+redis.call('ZADD', KEYS[3], now + tonumber(ARGV[2]), ARGV[3])
+return {0, 0}
+"""
 
 
 class CacheClient(object):
 
     def __init__(self):
+        self.logger = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
         self.redis_client: redis.StrictRedis = None
         self.default_cache_time = 600
+        self.codec = CacheCodec()
 
-    def connect(self, url):
+        # Keys that are known not to exist are cached for a short time so repeated lookups don't
+        # go back to the source of truth
+        self.missing_cache_time = 5
+        self.missing_data = b"__missing__"
+
+        # Per process cache that sits in front of redis
+        # entries are dropped when any process publishes an invalidation for the key
+        self.local_cache = OrderedDict()
+        self.local_cache_size = 1000
+        self.local_cache_time = 5
+        self.local_cache_lock = threading.RLock()
+        self.invalidation_channel = "cache_invalidations"
+        self.invalidation_count = 0
+        self.client_id = str(uuid.uuid4())
+        self.listener = None
+
+        self.bitmap_allocate_script = None
+        self.bitmap_release_script = None
+        self.update_index_script = None
+        self.quota_reserve_script = None
+
+    def connect(self, url, local_cache_size=None, local_cache_time=None, missing_cache_time=None,
+                compress_threshold=None):
         self.redis_client = redis.StrictRedis.from_url(url)
+        self.bitmap_allocate_script = self.redis_client.register_script(BITMAP_ALLOCATE_SCRIPT)
+        self.bitmap_release_script = self.redis_client.register_script(BITMAP_RELEASE_SCRIPT)
+        self.update_index_script = self.redis_client.register_script(UPDATE_INDEX_SCRIPT)
+        self.quota_reserve_script = self.redis_client.register_script(QUOTA_RESERVE_SCRIPT)
+        if compress_threshold is not None:
+            self.codec.compress_threshold = compress_threshold
+        if missing_cache_time is not None:
+            self.missing_cache_time = missing_cache_time
+        if local_cache_size is not None:
+            self.local_cache_size = local_cache_size
+        if local_cache_time is not None:
+            self.local_cache_time = local_cache_time
+
+        if self.listener is None:
+            self.listener = threading.Thread(target=self._listen_invalidations, daemon=True)
+            self.listener.start()
+
+    def _listen_invalidations(self):
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.invalidation_channel)
+                for message in pubsub.listen():
+                    self._on_invalidation(message)
+            except redis.RedisError:
+                self.logger.warning("Lost connection to the cache invalidation channel. Trying again in 1 second.")
+            # We may have missed invalidations while disconnected
+            self.clear_local()
+            time.sleep(1)
+
+    @with_defer
+    def _on_invalidation(self, message):
+        data = json.loads(message['data'])
+        if data['client'] == self.client_id:
+            # We already updated our own cache
+            return
+
+        self.local_cache_lock.acquire()
+        defer(self.local_cache_lock.release)
+        self.invalidation_count += 1
+        for key in data['keys']:
+            self.local_cache.pop(key, None)
+
+    def _publish_invalidation(self, *keys):
+        self.redis_client.publish(self.invalidation_channel, json.dumps({
+            'client': self.client_id,
+            'keys': keys
+        }))
 
-    def get(self, key):
-        data = self.redis_client.get(key)
+    @staticmethod
+    def _local_key(key):
+        if isinstance(key, bytes):
+            return key.decode()
+        return key
+
+    @with_defer
+    def _local_get(self, key):
+        self.local_cache_lock.acquire()
+        defer(self.local_cache_lock.release)
+        entry = self.local_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at <= time.monotonic():
+            del self.local_cache[key]
+            return None
+        self.local_cache.move_to_end(key)
+        return data
+
+    @with_defer
+    def _local_set(self, key, data, invalidation_count=None):
+        if self.local_cache_size <= 0:
+            return
+        self.local_cache_lock.acquire()
+        defer(self.local_cache_lock.release)
+        if invalidation_count is not None and invalidation_count != self.invalidation_count:
+            # Something was invalidated while we were reading so what we have may be stale
+            return
+        self.local_cache[key] = (time.monotonic() + self.local_cache_time, data)
+        self.local_cache.move_to_end(key)
+        while len(self.local_cache) > self.local_cache_size:
+            self.local_cache.popitem(last=False)
+
+    @with_defer
+    def _local_delete(self, key):
+        self.local_cache_lock.acquire()
+        defer(self.local_cache_lock.release)
+        self.local_cache.pop(key, None)
+
+    @with_defer
+    def clear_local(self):
+        self.local_cache_lock.acquire()
+        defer(self.local_cache_lock.release)
+        self.invalidation_count += 1
+        self.local_cache.clear()
+
+    def _decode(self, data, allow_missing=False):
         if data is None:
             return None
-        return json.loads(data)
+        if data == self.missing_data:
+            return MISSING if allow_missing else None
+        return self.codec.decode(data)
 
-    def scan(self, match):
-        cursor = '0'
-        while cursor != 0:
-            cursor, keys = self.redis_client.scan(cursor=cursor, match=match,
-                                                  count=1000)  # Do we keep count hardcoded to 1000?
-            for key in keys:
-                item = self.get(key)
+    def get(self, key, allow_missing=False):
+        key = self._local_key(key)
+        data = self._local_get(key)
+        if data is None:
+            invalidation_count = self.invalidation_count
+            data = self.redis_client.get(key)
+            if data is None:
+                return None
+            self._local_set(key, data, invalidation_count=invalidation_count)
+        return self._decode(data, allow_missing=allow_missing)
+
+    def get_many(self, keys):
+        """
+        Returns the values of the given keys in order, None for any that are missing
+        """
+        keys = [self._local_key(key) for key in keys]
+        values = [self._local_get(key) for key in keys]
+
+        missing = [i for i, data in enumerate(values) if data is None]
+        if len(missing) > 0:
+            invalidation_count = self.invalidation_count
+            for i, data in zip(missing, self.redis_client.mget([keys[i] for i in missing])):
+                if data is None:
+                    continue
+                values[i] = data
+                self._local_set(keys[i], data, invalidation_count=invalidation_count)
+
+        return [self._decode(data) for data in values]
+
+    def scan(self, match, count=1000):
+        for keys in self._scan_chunks(match, count):
+            for key, item in zip(keys, self.get_many(keys)):
                 if item is None:
                     continue
                 yield key, item
 
+    def _scan_chunks(self, match, count):
+        cursor = '0'
+        while cursor != 0:
+            cursor, keys = self.redis_client.scan(cursor=cursor, match=match, count=count)
+            if len(keys) > 0:
+                yield keys
+
     def pipeline(self):
         return self.redis_client.pipeline()
 
     def set(self, key, data, ex=None):
         if ex is None:
             ex = self.default_cache_time
-        return self.redis_client.set(key, json.dumps(data), ex=ex)
+        key = self._local_key(key)
+        data = self.codec.encode(data)
+        resp = self.redis_client.set(key, data, ex=ex)
+        self._local_set(key, data)
+        self._publish_invalidation(key)
+        return resp
 
     def delete(self, key):
-        return self.redis_client.delete(key)
+        key = self._local_key(key)
+        self._local_delete(key)
+        resp = self.redis_client.delete(key)
+        self._publish_invalidation(key)
+        return resp
+
+    def set_missing(self, key, ex=None):
+        """
+        Remember that key doesn't exist, setting the key again replaces this
+        """
+        if ex is None:
+            ex = self.missing_cache_time
+        if ex <= 0:
+            return self.delete(key)
+        key = self._local_key(key)
+        resp = self.redis_client.set(key, self.missing_data, ex=ex)
+        self._local_set(key, self.missing_data)
+        self._publish_invalidation(key)
+        return resp
+
+    def set_many(self, mapping, ex=None):
+        """
+        Set every key in mapping with one round trip
+        """
+        if len(mapping) == 0:
+            return
+        if ex is None:
+            ex = self.default_cache_time
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        encoded = {}
+        for key, data in mapping.items():
+            key = self._local_key(key)
+            encoded[key] = self.codec.encode(data)
+            pipe.set(key, encoded[key], ex=ex)
+        pipe.execute()
+
+        for key, data in encoded.items():
+            self._local_set(key, data)
+        self._publish_invalidation(*encoded.keys())
+
+    def delete_many(self, *keys):
+        if len(keys) == 0:
+            return 0
+        keys = [self._local_key(key) for key in keys]
+        for key in keys:
+            self._local_delete(key)
+        # UNLINK frees the memory in the background so large values don't block redis
+        resp = self.redis_client.execute_command('UNLINK', *keys)
+        self._publish_invalidation(*keys)
+        return resp
+
+    def set_tagged(self, key, data, tags, ex=None):
+        """
+        Set key and remember it under each of the tags so everything with a tag can be deleted at once
+        """
+        if ex is None:
+            ex = self.default_cache_time
+        key = self._local_key(key)
+        data = self.codec.encode(data)
+        now = time.time()
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.set(key, data, ex=ex)
+        for tag in tags:
+            # Tags are scored by when their keys expire so the expired ones can be dropped
+            # as new ones are added, otherwise a busy tag would grow forever
+            pipe.zremrangebyscore(tag, '-inf', now)
+            pipe.zadd(tag, now + ex, key)
+            # The tag only needs to live as long as the longest key in it
+            pipe.ttl(tag)
+        resp, *tag_resps = pipe.execute()
+        for tag, tag_ttl in zip(tags, tag_resps[2::3]):
+            if tag_ttl < ex:
+                self.redis_client.expire(tag, ex)
+
+        self._local_set(key, data)
+        self._publish_invalidation(key)
+        return resp
+
+    def delete_tagged(self, tag):
+        keys = [key.decode() for key in self.redis_client.zrange(tag, 0, -1)]
+        return self.delete_many(tag, *keys)
+
+    def delete_match(self, match, count=1000):
+        deleted = 0
+        for keys in self._scan_chunks(match, count):
+            deleted += self.delete_many(*keys)
+        return deleted
+
+    def exists(self, key):
+        return self.redis_client.exists(key)
+
+    def update_index(self, member, record_key, index_keys):
+        """
+        Make member part of exactly the given index sets
+
+        record_key holds the index keys the member is currently in so stale ones can be removed.
+        It is done in a script so concurrent updates for the same member can't interleave.
+        """
+        self.update_index_script(keys=[record_key] + sorted(set(index_keys)), args=[member])
+
+    def remove_index(self, member, record_key):
+        self.update_index(member, record_key, [])
+
+    def index_members(self, *index_keys):
+        return set([member.decode() for member in self.redis_client.sinter(*index_keys)])
+
+    def index_union(self, *index_keys):
+        return set([member.decode() for member in self.redis_client.sunion(*index_keys)])
+
+    def rebuild_index(self, index_prefix, record_prefix, memberships, ready_key):
+        """
+        Replace every index set and record under the given prefixes
+
+        memberships maps each member to the index keys it should be in
+        """
+        indexes = {}
+        for member, index_keys in memberships.items():
+            for index_key in index_keys:
+                indexes.setdefault(index_key, set()).add(member)
+
+        old_keys = list(self.redis_client.scan_iter(match=index_prefix + "*", count=1000))
+        old_keys.extend(self.redis_client.scan_iter(match=record_prefix + "*", count=1000))
+
+        # Done in a transaction so readers never see a half built index
+        pipe = self.redis_client.pipeline(transaction=True)
+        if len(old_keys) > 0:
+            pipe.delete(*old_keys)
+        for index_key, members in indexes.items():
+            pipe.sadd(index_key, *members)
+        for member, index_keys in memberships.items():
+            if len(index_keys) > 0:
+                pipe.sadd(record_prefix + member, *index_keys)
+        pipe.set(ready_key, "1")
+        pipe.execute()
+
+    def bitmap_allocate(self, key, size):
+        """
+        Atomically set the first clear bit below size and return its position
+
+        Returns -1 if every bit is set and None if the bitmap doesn't exist
+        """
+        position = self.bitmap_allocate_script(keys=[key], args=[size])
+        if position == -2:
+            return None
+        return position
+
+    def bitmap_release(self, key, position):
+        return self.bitmap_release_script(keys=[key], args=[position])
+
+    def bitmap_rebuild(self, key, size, positions):
+        """
+        Replace the bitmap with one that only has the given positions set
+        """
+        # Always keep one byte so an empty bitmap still exists
+        bitmap = bytearray(max(math.ceil(size / 8), 1))
+        for position in positions:
+            if 0 <= position < size:
+                # Redis counts bits from the most significant bit of the first byte
+                bitmap[position // 8] |= 0x80 >> (position % 8)
+        self.redis_client.set(key, bytes(bitmap))
+
+    def quota_reserve(self, usage_key, reservations_key, expires_key, reservation_id, ttl, used, limits, requested):
+        """
+        Atomically check the requested amounts against the limits and hold them for ttl seconds
+
+        used is only counted if the usage hash doesn't exist yet. Returns (0, 0) if they were reserved
+        otherwise the 1-based index of the amount over its limit and how much of it is used
+        """
+        return self.quota_reserve_script(keys=[usage_key, reservations_key, expires_key],
+                                         args=[time.time(), ttl, reservation_id] + list(used) + list(limits) +
+                                         list(requested))
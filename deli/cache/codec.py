@@ -0,0 +1,54 @@
+import json
+import struct
+import zlib
+
+import msgpack
+
+# Every encoded value starts with this so it can't be mistaken for a JSON document
+MAGIC = b"\x00dc"
+
+VERSION_MSGPACK = 1
+
+FLAG_ZLIB = 0x01
+
+HEADER = struct.Struct("!3sBB")
+
+
+class CacheCodec(object):
+    """
+    Encodes values stored in the cache.
+
+    Values are packed with msgpack and compressed with zlib once they are larger than
+    compress_threshold bytes. A small header records the version and flags so the format
+    can change later, anything without the header is decoded as plain JSON.
+    """
+
+    def __init__(self, compress_threshold=1024, compress_level=6):
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def encode(self, data):
+        payload = msgpack.packb(data, use_bin_type=True)
+        flags = 0
+        if 0 <= self.compress_threshold < len(payload):
+            compressed = zlib.compress(payload, self.compress_level)
+            # Not everything gets smaller
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= FLAG_ZLIB
+        return HEADER.pack(MAGIC, VERSION_MSGPACK, flags) + payload
+
+    def decode(self, data):
+        if isinstance(data, str):
+            # JSON text from before this codec existed
+            return json.loads(data)
+        if not data.startswith(MAGIC):
+            return json.loads(data.decode())
+
+        _, version, flags = HEADER.unpack_from(data)
+        payload = data[HEADER.size:]
+        if version != VERSION_MSGPACK:
+            raise ValueError("Unknown cache codec version " + str(version))
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return msgpack.unpackb(payload, raw=False)
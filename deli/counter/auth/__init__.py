@@ -0,0 +1,3 @@
+from deli.counter.auth.openid import OpenIDClient
+
+openid_client = OpenIDClient()
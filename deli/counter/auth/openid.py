@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+
+import cherrypy
+import requests
+from go_defer import with_defer, defer
+
+
+class OpenIDClient(object):
+    """
+    Caches the OpenID Provider's discovery document and signing keys so validating a
+    token doesn't need to talk to the provider.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
+        self.issuer_url = None
+        self.cache_time = 3600
+        # Don't refetch the keys for unknown kids more often than this
+        self.min_refresh_time = 30
+
+        self.session = requests.Session()
+        self.lock = threading.RLock()
+        self.configuration = None
+        self.configuration_expires_at = 0
+        self.keys = {}
+        self.keys_expires_at = 0
+        self.keys_fetched_at = 0
+
+    def setup(self, issuer_url, cache_time=None):
+        self.issuer_url = issuer_url
+        if cache_time is not None:
+            self.cache_time = cache_time
+
+    def _get(self, url, description):
+        try:
+            r = self.session.get(url, timeout=10)
+            r.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            self.logger.exception("Backend error while discovering OAuth " + description + " from provider")
+            error_text = e.response.text if e.response is not None else str(e)
+            raise cherrypy.HTTPError(424, "Backend error while discovering OAuth " + description + " from provider: "
+                                     + error_text)
+        return r.json()
+
+    @with_defer
+    def get_configuration(self):
+        self.lock.acquire()
+        defer(self.lock.release)
+        if self.configuration is None or self.configuration_expires_at <= time.monotonic():
+            self.configuration = self._get(self.issuer_url + ".well-known/openid-configuration", "configuration")
+            self.configuration_expires_at = time.monotonic() + self.cache_time
+        return self.configuration
+
+    def _refresh_keys(self):
+        # Must be called while holding the lock so only one thread fetches the keys
+        configuration = self.get_configuration()
+        jwks = self._get(configuration['jwks_uri'], "keys")
+        self.keys = dict((key['kid'], key) for key in jwks['keys'] if 'kid' in key)
+        self.keys_fetched_at = time.monotonic()
+        self.keys_expires_at = self.keys_fetched_at + self.cache_time
+
+    @with_defer
+    def get_key(self, kid):
+        """
+        Returns the signing key with the kid or None if the provider doesn't have it
+        """
+        if self.keys_expires_at > time.monotonic() and kid in self.keys:
+            return self.keys[kid]
+
+        self.lock.acquire()
+        defer(self.lock.release)
+        now = time.monotonic()
+        if self.keys_expires_at <= now:
+            self._refresh_keys()
+        elif kid not in self.keys and self.keys_fetched_at + self.min_refresh_time <= now:
+            # The provider may have rotated its keys
+            self._refresh_keys()
+        return self.keys.get(kid)
@@ -1,23 +1,27 @@
+import hashlib
 import json
 import logging
-from typing import List
+from typing import List, Optional, Tuple
 
 import arrow
 import cherrypy
 import jose
-import requests
 from cryptography.fernet import InvalidToken
 from jose import jwt
 from simple_settings import settings
 
+from deli.cache import cache_client
+from deli.counter.auth import openid_client
 from deli.counter.auth.permission import SYSTEM_PERMISSIONS
 from deli.kubernetes.resources.project import Project
 from deli.kubernetes.resources.v1alpha1.iam_group.model import IAMSystemGroup
 from deli.kubernetes.resources.v1alpha1.iam_policy.model import IAMPolicy
-from deli.kubernetes.resources.v1alpha1.iam_role.model import IAMSystemRole, IAMProjectRole
+from deli.kubernetes.resources.v1alpha1.iam_policy.permission_index import PolicyPermissionIndex
 from deli.kubernetes.resources.v1alpha1.iam_service_account.model import SystemServiceAccount, ProjectServiceAccount
 from deli.kubernetes.resources.v1alpha1.instance.model import Instance
 
+SYSTEM_PERMISSION_NAMES = set([p['name'] for p in SYSTEM_PERMISSIONS])
+
 
 class Token(object):
 
@@ -33,46 +37,112 @@ class Token(object):
         self.logger = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
 
     def get_oauth_rsa_key(self, unverified_header):
-        r = requests.get(settings.OPENID_ISSUER_URL + ".well-known/openid-configuration")
-        if r.status_code != 200:
-            try:
-                r.raise_for_status()
-            except requests.exceptions.RequestException as e:
-                self.logger.exception("Backend error while discovering OAuth configuration from provider")
-                raise cherrypy.HTTPError(424,
-                                         "Backend error while discovering OAuth configuration from provider: "
-                                         + e.response.text)
-
-        well_known_data = r.json()
-        r = requests.get(well_known_data['jwks_uri'])
-        if r.status_code != 200:
-            try:
-                r.raise_for_status()
-            except requests.exceptions.RequestException as e:
-                self.logger.exception("Backend error while discovering OAuth keys")
-                raise cherrypy.HTTPError(424,
-                                         "Backend error while discovering OAuth keys from provider: " + e.response.text)
-
-        rsa_key = {}
-        for key in r.json()["keys"]:
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"]
-                }
-                break
-
-        if len(rsa_key) == 0:
+        key = openid_client.get_key(unverified_header.get("kid"))
+        if key is None:
             # Header has a invalid kid
             raise cherrypy.HTTPError(401, 'Invalid Authorization Token.')
 
-        return rsa_key
+        return {
+            "kty": key["kty"],
+            "kid": key["kid"],
+            "use": key["use"],
+            "n": key["n"],
+            "e": key["e"]
+        }
+
+    @staticmethod
+    def cache_key(token_string):
+        # Never store the token itself
+        return "token_cache_" + hashlib.sha256(token_string.encode()).hexdigest()
+
+    # Every cached token is tagged with this so they can all be dropped without scanning for them
+    all_tag = "token_tags_all"
+
+    @staticmethod
+    def cache_tag(email):
+        return "token_tags_" + email
+
+    @staticmethod
+    def instance_tag(project_name, instance_name):
+        return "token_tags_instance_" + str(project_name) + "/" + str(instance_name)
+
+    @classmethod
+    def invalidate_service_account(cls, service_account):
+        cache_client.delete_tagged(cls.cache_tag(service_account.email))
+
+    @classmethod
+    def invalidate_instance(cls, instance):
+        cache_client.delete_tagged(cls.instance_tag(instance.project_name, instance.name))
+
+    @classmethod
+    def invalidate_all(cls):
+        cache_client.delete_tagged(cls.all_tag)
+
+    def to_cache(self):
+        service_account = None
+        if self.service_account is not None:
+            service_account = {
+                'system': isinstance(self.service_account, SystemServiceAccount),
+                'raw': self.service_account._raw
+            }
+
+        return {
+            'email': self.email,
+            'metadata': self.metadata,
+            'expires_at': self.expires_at.isoformat() if self.expires_at is not None else None,
+            'oauth_groups': self.oauth_groups,
+            'system_roles': self.system_roles,
+            'service_account': service_account
+        }
+
+    @classmethod
+    def from_cache(cls, data):
+        token = cls()
+        token.email = data['email']
+        token.metadata = data['metadata']
+        token.expires_at = arrow.get(data['expires_at']) if data['expires_at'] is not None else None
+        token.oauth_groups = data['oauth_groups']
+        token.system_roles = data['system_roles']
+        if data['service_account'] is not None:
+            if data['service_account']['system']:
+                token.service_account = SystemServiceAccount(data['service_account']['raw'])
+            else:
+                token.service_account = ProjectServiceAccount(data['service_account']['raw'])
+        return token
+
+    def cache(self, cache_key):
+        now = arrow.now('UTC')
+        ex = settings.AUTH_TOKEN_CACHE_TIME
+        if self.expires_at is not None:
+            ex = min(ex, int((self.expires_at - now).total_seconds()))
+        if self.service_account is not None and self.metadata.get('key') in self.service_account.keys:
+            ex = min(ex, int((self.service_account.keys[self.metadata['key']] - now).total_seconds()))
+        if ex <= 0:
+            return
+
+        tags = [self.all_tag]
+        if self.service_account is not None:
+            tags.append(self.cache_tag(self.email))
+            if 'instance' in self.metadata:
+                # Instance tokens stop working as soon as their instance is deleted
+                tags.append(self.instance_tag(self.service_account.project_name, self.metadata['instance']))
+        cache_client.set_tagged(cache_key, self.to_cache(), tags, ex=ex)
 
     @classmethod
     def unmarshal(cls, token_string, fernet):
+        cache_key = cls.cache_key(token_string)
+        data = cache_client.get(cache_key)
+        if data is not None:
+            token = cls.from_cache(data)
+            if token.expires_at is None or token.expires_at > arrow.now('UTC'):
+                return token
+
+        token = cls._unmarshal(token_string, fernet)
+        token.cache(cache_key)
+        return token
+
+    @classmethod
+    def _unmarshal(cls, token_string, fernet):
         token = cls()
 
         try:
@@ -135,8 +205,9 @@ class Token(object):
                 # Invalid email type
                 raise cherrypy.HTTPError(401, 'Invalid Authorization Token.')
 
-        system_policy = IAMPolicy.get("system")
-        token.system_roles = token.find_roles(system_policy)
+        system_index = PolicyPermissionIndex.get("system")
+        if system_index is not None:
+            token.system_roles = sorted(system_index.find_roles(token.identity, token.oauth_groups))
 
         return token
 
@@ -183,38 +254,69 @@ class Token(object):
 
         return roles
 
-    def get_projects(self) -> List[Project]:
-        projects = []
-        policies = IAMPolicy.list()
-        for policy in policies:
+    @property
+    def principals(self) -> List[str]:
+        principals = [self.identity]
+        if len(self.oauth_groups) > 0:
+            oauth_link_groups = IAMSystemGroup.oauth_link_groups()
+            for oauth_group in self.oauth_groups:
+                for group_email in oauth_link_groups.get(oauth_group, []):
+                    principals.append("group:" + group_email)
+        return principals
+
+    def get_project_names(self) -> List[str]:
+        project_names = IAMPolicy.principal_projects(self.principals)
+        if project_names is not None:
+            return project_names
+
+        # The index hasn't been built yet so check every policy
+        project_names = []
+        for policy in IAMPolicy.list():
             if policy.name == "system":
                 continue
             if len(self.find_roles(policy)) > 0:
-                project = Project.get(policy.name)
-                if project is not None:
-                    projects.append(project)
+                project_names.append(policy.name)
+
+        return sorted(project_names)
+
+    def get_projects(self, limit=None, marker=None) -> Tuple[List[Project], Optional[str]]:
+        """
+        Returns a page of projects sorted by name and the marker for the next page
+        """
+        project_names = self.get_project_names()
+        if marker is not None:
+            project_names = [name for name in project_names if name > marker]
+
+        projects = []
+        next_marker = None
+        for project_name in project_names:
+            project = Project.get(project_name)
+            if project is None:
+                continue
+            if limit is not None and len(projects) >= limit:
+                # Only point to another page if there is a project to put on it
+                next_marker = projects[-1].name
+                break
+            projects.append(project)
 
-        return projects
+        return projects, next_marker
 
     def enforce_permission(self, permission, project=None):
         if len(self.system_roles) > 0:
-            if permission in [p['name'] for p in SYSTEM_PERMISSIONS]:
-                for role_name in self.system_roles:
-                    role = IAMSystemRole.get(role_name)
-                    if role is not None and permission in role.permissions:
-                        return
+            if permission in SYSTEM_PERMISSION_NAMES:
+                system_index = PolicyPermissionIndex.get("system")
+                if system_index is not None and permission in system_index.permissions(self.system_roles):
+                    return
                 raise cherrypy.HTTPError(403,
                                          "Insufficient permissions (%s) to perform the requested action." % permission)
 
         if project is not None:
-            project_policy = IAMPolicy.get(project.name)
-            if project_policy is None:
+            project_index = PolicyPermissionIndex.get(project.name)
+            if project_index is None:
                 raise cherrypy.HTTPError(500, "Could not find iam policy document for project %s" % project.name)
-            project_roles = self.find_roles(project_policy)
-            for role_name in project_roles:
-                role = IAMProjectRole.get(project, role_name)
-                if role is not None and permission in role.permissions:
-                    return
+            project_roles = project_index.find_roles(self.identity, self.oauth_groups)
+            if permission in project_index.permissions(project_roles):
+                return
 
             raise cherrypy.HTTPError(403, "Insufficient permissions (%s) to perform the "
                                           "requested action in the project %s." % (permission, project.name))
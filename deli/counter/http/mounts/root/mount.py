@@ -1,22 +1,49 @@
+import json
+import logging
+import threading
+from urllib.parse import urlencode
+
 import cherrypy
 from apispec import APISpec
+from cherrypy._cpcompat import json_encode
 from cryptography.fernet import Fernet, MultiFernet
 from ingredients_http.app import HTTPApplication
 from ingredients_http.app_mount import ApplicationMount
+from ingredients_http.errors.validation import ResponseValidationError
 from kubernetes import config
 from kubernetes.client import Configuration
 from pbr.version import VersionInfo
+from schematics import Model
+from schematics.exceptions import DataError
 from simple_settings import settings
 
 from deli.cache import cache_client
+from deli.counter.auth import openid_client
 from deli.counter.auth.token import Token
 from deli.kubernetes.resources.model import ProjectResourceModel
 from deli.kubernetes.resources.project import Project
+from deli.kubernetes.resources.v1alpha1.flavor.model import Flavor
+from deli.kubernetes.resources.v1alpha1.iam_group.model import IAMSystemGroup
+from deli.kubernetes.resources.v1alpha1.iam_policy.model import IAMPolicy
+from deli.kubernetes.resources.v1alpha1.iam_role.model import IAMSystemRole, IAMProjectRole
+from deli.kubernetes.resources.v1alpha1.iam_service_account.model import SystemServiceAccount, ProjectServiceAccount
+from deli.kubernetes.resources.v1alpha1.image.model import Image
+from deli.kubernetes.resources.v1alpha1.instance.model import Instance
+from deli.kubernetes.resources.v1alpha1.keypair.keypair import Keypair
+from deli.kubernetes.resources.v1alpha1.network.model import Network, NetworkPort
+from deli.kubernetes.resources.v1alpha1.project_quota.model import ProjectQuota
+from deli.kubernetes.resources.v1alpha1.region.model import Region
+from deli.kubernetes.resources.v1alpha1.volume.model import Volume
+from deli.kubernetes.resources.v1alpha1.zone.model import Zone
+from deli.kubernetes.store import resource_store
+from deli.metrics import metrics
 
 
 class RootMount(ApplicationMount):
     def __init__(self, app: HTTPApplication):
         super().__init__(app=app, mount_point='/')
+        self.logger = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
+        self.metrics_stop = threading.Event()
         self.fernet = MultiFernet([Fernet(key) for key in settings.AUTH_FERNET_KEYS])
         self.api_spec = APISpec(
             title='Sandwich Cloud API',
@@ -77,6 +104,55 @@ class RootMount(ApplicationMount):
 
         cherrypy.request.resource_object = resource
 
+    def model_out_pagination(self, cls=None):
+        # Same as the ingredients_http tool but the handler returns the marker for the next page
+        # instead of us using the id of the last item
+        def model_handler(*args, **kwargs):
+            list_name = cherrypy.serving.request.path_info.split("/")[-1]
+            data = {
+                list_name: []
+            }
+
+            values, next_marker = cherrypy.serving.request._model_inner_handler(*args, **kwargs)
+            for value in values:
+                if issubclass(value.__class__, Model) is False:
+                    raise cherrypy.HTTPError(500, "Output Model class (" + value.__class__.__name__ +
+                                             ") is not a subclass of  " + Model.__module__ + "." + Model.__name__)
+                if cls is not None and value.__class__ != cls:
+                    raise cherrypy.HTTPError(500, "Output Model class (" + value.__class__.__name__ +
+                                             ") does not match given class " + cls.__name__)
+                try:
+                    value.validate()
+                except DataError as e:
+                    raise ResponseValidationError(e)
+
+                data[list_name].append(value.to_native())
+
+            data[list_name + "_links"] = []
+            if next_marker:
+                req_params = cherrypy.serving.request.params
+
+                for k, v in dict(req_params).items():
+                    if v is None:
+                        del req_params[k]
+
+                req_params['marker'] = next_marker
+                data[list_name + "_links"] = [
+                    {
+                        "href": cherrypy.url(qs=urlencode(req_params)),
+                        "rel": "next"
+                    }
+                ]
+
+            return json_encode(data)
+
+        request = cherrypy.serving.request
+        if request.handler is None:  # pragma: no cover
+            return
+        request._model_inner_handler = request.handler
+        request.handler = model_handler
+        cherrypy.serving.response.headers['Content-Type'] = 'application/json'
+
     def __setup_tools(self):
         cherrypy.tools.authentication = cherrypy.Tool('on_start_resource', self.validate_token, priority=20)
         cherrypy.tools.project_scope = cherrypy.Tool('on_start_resource', self.validate_project_scope, priority=30)
@@ -84,6 +160,8 @@ class RootMount(ApplicationMount):
         cherrypy.tools.resource_object = cherrypy.Tool('before_request_body', self.resource_object, priority=40)
         cherrypy.tools.enforce_permission = cherrypy.Tool('before_request_body', self.enforce_permission, priority=50)
 
+        cherrypy.tools.model_out_pagination = cherrypy.Tool('before_handler', self.model_out_pagination)
+
     def __setup_kubernetes(self):
         if settings.KUBE_CONFIG is not None or settings.KUBE_MASTER is not None:
             Configuration.set_default(Configuration())
@@ -95,12 +173,34 @@ class RootMount(ApplicationMount):
             config.load_incluster_config()
 
     def __setup_redis(self):
-        cache_client.connect(url=settings.REDIS_URL)
+        cache_client.connect(url=settings.REDIS_URL, local_cache_size=settings.CACHE_LOCAL_SIZE,
+                             local_cache_time=settings.CACHE_LOCAL_TIME, missing_cache_time=settings.CACHE_MISSING_TIME,
+                             compress_threshold=settings.CACHE_COMPRESS_THRESHOLD)
+
+    def __setup_openid(self):
+        openid_client.setup(settings.OPENID_ISSUER_URL, cache_time=settings.OPENID_CACHE_TIME)
+
+    def __setup_store(self):
+        for model_cls in [IAMSystemRole, IAMProjectRole, IAMPolicy, IAMSystemGroup, SystemServiceAccount,
+                          ProjectServiceAccount, ProjectQuota, Region, Zone, Network, NetworkPort, Image, Flavor,
+                          Volume, Instance, Keypair]:
+            resource_store.start(model_cls, settings.STORE_RESYNC_SECONDS)
+
+    def __setup_metrics(self):
+        cherrypy.engine.subscribe('stop', self.metrics_stop.set)
+        threading.Thread(target=self.log_metrics, daemon=True).start()
+
+    def log_metrics(self):
+        while self.metrics_stop.wait(settings.METRICS_LOG_SECONDS) is False:
+            self.logger.info("Metrics: " + json.dumps(metrics.snapshot(), sort_keys=True))
 
     def setup(self):
         self.__setup_tools()
         self.__setup_kubernetes()
         self.__setup_redis()
+        self.__setup_openid()
+        self.__setup_store()
+        self.__setup_metrics()
         super().setup()
 
     def mount_config(self):
@@ -5,6 +5,7 @@ from ingredients_http.request_methods import RequestMethods
 from ingredients_http.route import Route
 from simple_settings import settings
 
+from deli.counter.auth import openid_client
 from deli.counter.http.mounts.root.routes.auth.v1.validation_models.oauth import ResponseOAuthToken, RequestOAuthToken
 from deli.counter.http.router import SandwichRouter
 
@@ -14,18 +15,7 @@ class AuthRouter(SandwichRouter):
         super().__init__(uri_base='oauth')
 
     def get_token_url(self):
-        r = requests.get(settings.OPENID_ISSUER_URL + ".well-known/openid-configuration")
-        if r.status_code != 200:
-            try:
-                r.raise_for_status()
-            except requests.exceptions.RequestException as e:
-                self.logger.exception("Backend error while discovering OAuth configuration from provider")
-                raise cherrypy.HTTPError(424,
-                                         "Backend error while discovering OAuth configuration from provider: "
-                                         + e.response.text)
-
-        well_known_data = r.json()
-        return well_known_data['token_endpoint']
+        return openid_client.get_configuration()['token_endpoint']
 
     @Route(route='token', methods=[RequestMethods.POST])
     @cherrypy.config(**{'tools.authentication.on': False})
@@ -46,7 +36,7 @@ class AuthRouter(SandwichRouter):
         """
         request: RequestOAuthToken = cherrypy.request.model
 
-        r = requests.post(self.get_token_url(), json={
+        r = openid_client.session.post(self.get_token_url(), json={
             'grant_type': 'password',
             'username': request.email,
             'password': request.password,
@@ -1,5 +1,3 @@
-import uuid
-
 import cherrypy
 from ingredients_http.request_methods import RequestMethods
 from ingredients_http.route import Route
@@ -87,7 +85,7 @@ class ImageRouter(SandwichProjectRouter):
     @cherrypy.tools.model_params(cls=ParamsListImage)
     @cherrypy.tools.model_out_pagination(cls=ResponseImage)
     @cherrypy.tools.enforce_permission(permission_name="images:list")
-    def list(self, region_name, limit: int, marker: uuid.UUID):
+    def list(self, region_name, limit: int, marker: str):
         """List images
         ---
         get:
@@ -4,6 +4,7 @@ import cherrypy
 from ingredients_http.request_methods import RequestMethods
 from ingredients_http.route import Route
 
+from deli.counter.auth.token import Token
 from deli.counter.http.mounts.root.errors.quota import QuotaError
 from deli.counter.http.mounts.root.routes.compute.v1.validation_models.images import ResponseImage
 from deli.counter.http.mounts.root.routes.compute.v1.validation_models.instances import RequestCreateInstance, \
@@ -118,63 +119,60 @@ class InstanceRouter(SandwichProjectRouter):
             if service_account is None:
                 raise cherrypy.HTTPError(500, 'Could not find a default service account to attach to the instance.')
 
-        quota: ProjectQuota = ProjectQuota.get(project.name)
-        used_vcpu = quota.used_vcpu + flavor.vcpus
-        used_ram = quota.used_ram + flavor.ram
         requested_disk = flavor.disk
         if request.disk is not None:
             requested_disk = request.disk
-        used_disk = quota.used_disk + requested_disk
-
-        if quota.vcpu != -1:
-            if used_vcpu > quota.vcpu:
-                raise QuotaError("VCPU", flavor.vcpus, quota.used_vcpu, quota.vcpu)
-
-        if quota.ram != -1:
-            if used_ram > quota.ram:
-                raise QuotaError("Ram", flavor.ram, quota.used_ram, quota.ram)
-
-        if quota.disk != -1:
-            if used_disk > quota.disk:
-                raise QuotaError("Disk", requested_disk, quota.used_disk, quota.disk)
-
-        quota.used_vcpu = used_vcpu
-        quota.used_ram = used_ram
-        quota.used_disk = used_disk
-        quota.save()
-
-        network_port = NetworkPort()
-        network_port.name = str(uuid.uuid4())  # We don't care about the network port's name, just that it's unique
-        network_port.project = project
-        network_port.network = network
-        network_port.create()
-
-        instance = Instance()
-        instance.name = request.name
-        instance.project = project
-        instance.region = region
-        if zone is not None:
-            instance.zone = zone
-        instance.image = image
-        instance.service_account = service_account
-        instance.network_port = network_port
-        instance.keypairs = keypairs
-        if request.user_data is not None:
-            if len(request.user_data) > 0:
-                instance.user_data = request.user_data
-        for k, v in request.tags.items():
-            instance.add_tag(k, v)
-
-        instance.flavor = flavor
-        if request.disk is not None:
-            instance.disk = request.disk
-        if request.initial_volumes is not None:
-            initial_volumes = []
-            for initial_volume in request.initial_volumes:
-                initial_volumes.append(initial_volume.to_native())
-            instance.initial_volumes = initial_volumes
 
-        instance.create()
+        quota: ProjectQuota = ProjectQuota.get(project.name)
+        reservation_id = ProjectQuota.new_reservation_id()
+        over_quota = quota.reserve(reservation_id, vcpu=flavor.vcpus, ram=flavor.ram, disk=requested_disk)
+        if over_quota is not None:
+            resource_name, used = over_quota
+            requested, allowed = {
+                "VCPU": (flavor.vcpus, quota.vcpu),
+                "Ram": (flavor.ram, quota.ram),
+                "Disk": (requested_disk, quota.disk)
+            }[resource_name]
+            raise QuotaError(resource_name, requested, used, allowed)
+
+        try:
+            network_port = NetworkPort()
+            network_port.name = str(uuid.uuid4())  # We don't care about the network port's name, just that it's unique
+            network_port.project = project
+            network_port.network = network
+            network_port.create()
+
+            instance = Instance()
+            instance.name = request.name
+            instance.project = project
+            instance.region = region
+            if zone is not None:
+                instance.zone = zone
+            instance.image = image
+            instance.service_account = service_account
+            instance.network_port = network_port
+            instance.keypairs = keypairs
+            if request.user_data is not None:
+                if len(request.user_data) > 0:
+                    instance.user_data = request.user_data
+            for k, v in request.tags.items():
+                instance.add_tag(k, v)
+
+            instance.flavor = flavor
+            instance.quota_reservation = reservation_id
+            if request.disk is not None:
+                instance.disk = request.disk
+            if request.initial_volumes is not None:
+                initial_volumes = []
+                for initial_volume in request.initial_volumes:
+                    initial_volumes.append(initial_volume.to_native())
+                instance.initial_volumes = initial_volumes
+
+            instance.create()
+        except Exception:
+            # Give back the quota if we couldn't create the instance
+            ProjectQuota.release(project.name, reservation_id)
+            raise
 
         return ResponseInstance.from_database(instance)
 
@@ -201,7 +199,7 @@ class InstanceRouter(SandwichProjectRouter):
     @cherrypy.tools.model_params(cls=ParamsListInstance)
     @cherrypy.tools.model_out_pagination(cls=ResponseInstance)
     @cherrypy.tools.enforce_permission(permission_name="instances:list")
-    def list(self, image_name, region_name, zone_name, limit: int, marker: uuid.UUID):
+    def list(self, image_name, region_name, zone_name, limit: int, marker: str):
         """List instances
         ---
         get:
@@ -270,6 +268,7 @@ class InstanceRouter(SandwichProjectRouter):
             raise cherrypy.HTTPError(400, "Instance has already been deleted")
 
         instance.delete()
+        Token.invalidate_instance(instance)
 
     @Route(route='{instance_name}/action/start', methods=[RequestMethods.PUT])
     @cherrypy.tools.model_params(cls=ParamsInstance)
@@ -1,5 +1,3 @@
-import uuid
-
 import cherrypy
 from ingredients_http.request_methods import RequestMethods
 from ingredients_http.route import Route
@@ -71,7 +69,7 @@ class KeypairsRouter(SandwichProjectRouter):
     @cherrypy.tools.model_params(cls=ParamsListKeypair)
     @cherrypy.tools.model_out_pagination(cls=ResponseKeypair)
     @cherrypy.tools.enforce_permission(permission_name="keypairs:list")
-    def list(self, limit: int, marker: uuid.UUID):
+    def list(self, limit: int, marker: str):
         """List keypairs
         ---
         get:
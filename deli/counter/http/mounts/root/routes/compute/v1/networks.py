@@ -1,5 +1,3 @@
-import uuid
-
 import cherrypy
 from ingredients_http.request_methods import RequestMethods
 from ingredients_http.route import Route
@@ -84,7 +82,7 @@ class NetworkRouter(SandwichRouter):
     @Route()
     @cherrypy.tools.model_params(cls=ParamsListNetwork)
     @cherrypy.tools.model_out_pagination(cls=ResponseNetwork)
-    def list(self, region, limit: int, marker: uuid.UUID):
+    def list(self, region, limit: int, marker: str):
         """List networks
         ---
         get:
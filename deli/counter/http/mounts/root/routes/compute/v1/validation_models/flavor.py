@@ -1,6 +1,6 @@
 from ingredients_http.schematics.types import KubeName, ArrowType
 from schematics import Model
-from schematics.types import UUIDType, IntType
+from schematics.types import IntType, StringType
 
 from deli.kubernetes.resources.v1alpha1.flavor.model import Flavor
 
@@ -11,7 +11,7 @@ class ParamsFlavor(Model):
 
 class ParamsListFlavor(Model):
     limit = IntType(default=100, max_value=100, min_value=1)
-    marker = UUIDType()
+    marker = StringType()
 
 
 class RequestCreateFlavor(Model):
@@ -1,6 +1,6 @@
 from ingredients_http.schematics.types import EnumType, KubeName, ArrowType
 from schematics import Model
-from schematics.types import UUIDType, StringType, IntType
+from schematics.types import StringType, IntType
 
 from deli.kubernetes.resources.model import ResourceState
 from deli.kubernetes.resources.v1alpha1.image.model import Image
@@ -13,7 +13,7 @@ class ParamsImage(Model):
 class ParamsListImage(Model):
     region_name = StringType()
     limit = IntType(default=100, max_value=100, min_value=1)
-    marker = UUIDType()
+    marker = StringType()
 
 
 class RequestCreateImage(Model):
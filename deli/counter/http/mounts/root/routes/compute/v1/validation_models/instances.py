@@ -1,6 +1,6 @@
 from ingredients_http.schematics.types import KubeName, KubeString, EnumType, ArrowType
 from schematics import Model
-from schematics.types import UUIDType, IntType, DictType, ListType, BooleanType, StringType, ModelType
+from schematics.types import IntType, DictType, ListType, BooleanType, StringType, ModelType
 
 from deli.kubernetes.resources.model import ResourceState
 from deli.kubernetes.resources.v1alpha1.instance.model import Instance, VMPowerState, VMTask
@@ -101,7 +101,7 @@ class ParamsListInstance(Model):
     zone_name = KubeName()
     region_name = KubeName()
     limit = IntType(default=100, max_value=100, min_value=1)
-    marker = UUIDType()
+    marker = StringType()
 
 
 class RequestInstanceImage(Model):
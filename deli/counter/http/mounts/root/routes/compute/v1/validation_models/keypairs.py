@@ -4,7 +4,7 @@ from cryptography.hazmat.primitives.serialization import load_ssh_public_key
 from ingredients_http.schematics.types import ArrowType, KubeName
 from schematics import Model
 from schematics.exceptions import ValidationError
-from schematics.types import UUIDType, IntType, StringType
+from schematics.types import IntType, StringType
 
 from deli.kubernetes.resources.v1alpha1.keypair.keypair import Keypair
 
@@ -15,7 +15,7 @@ class ParamsKeypair(Model):
 
 class ParamsListKeypair(Model):
     limit = IntType(default=100, max_value=100, min_value=1)
-    marker = UUIDType()
+    marker = StringType()
 
 
 class RequestCreateKeypair(Model):
@@ -1,6 +1,6 @@
 from ingredients_http.schematics.types import IPv4AddressType, EnumType, ArrowType, KubeName
 from schematics import Model
-from schematics.types import UUIDType, IntType
+from schematics.types import UUIDType, IntType, StringType
 
 from deli.kubernetes.resources.model import ResourceState
 from deli.kubernetes.resources.v1alpha1.network.model import NetworkPort
@@ -12,7 +12,7 @@ class ParamsNetworkPort(Model):
 
 class ParamsListNetworkPort(Model):
     limit = IntType(default=100, max_value=100, min_value=1)
-    marker = UUIDType()
+    marker = StringType()
 
 
 class ResponseNetworkPort(Model):
@@ -3,7 +3,7 @@ import ipaddress
 from ingredients_http.schematics.types import KubeName, IPv4NetworkType, IPv4AddressType, EnumType, ArrowType
 from schematics import Model
 from schematics.exceptions import ValidationError
-from schematics.types import UUIDType, IntType, StringType, ListType
+from schematics.types import IntType, StringType, ListType
 
 from deli.kubernetes.resources.model import ResourceState
 from deli.kubernetes.resources.v1alpha1.network.model import Network
@@ -91,4 +91,4 @@ class ParamsListNetwork(Model):
     name = KubeName()
     region = KubeName()
     limit = IntType(default=100, max_value=100, min_value=1)
-    marker = UUIDType()
+    marker = StringType()
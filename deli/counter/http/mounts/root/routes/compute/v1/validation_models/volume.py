@@ -12,7 +12,7 @@ class ParamsVolume(Model):
 
 class ParamsListVolume(Model):
     limit = IntType(default=100, max_value=100, min_value=1)
-    marker = UUIDType()
+    marker = StringType()
 
 
 class RequestCreateVolume(Model):
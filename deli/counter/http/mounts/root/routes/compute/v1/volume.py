@@ -1,5 +1,3 @@
-import uuid
-
 import cherrypy
 from ingredients_http.request_methods import RequestMethods
 from ingredients_http.route import Route
@@ -54,20 +52,23 @@ class VolumeRouter(SandwichProjectRouter):
                                          ResourceState.Created.value))
 
         quota: ProjectQuota = ProjectQuota.get(project.name)
-        used_disk = quota.used_disk + request.size
-        if quota.disk != -1:
-            if used_disk > quota.disk:
-                raise QuotaError("Disk", request.size, quota.used_disk, quota.disk)
-
-        quota.used_disk = used_disk
-        quota.save()
-
-        volume = Volume()
-        volume.project = project
-        volume.name = request.name
-        volume.zone = zone
-        volume.size = request.size
-        volume.create()
+        reservation_id = ProjectQuota.new_reservation_id()
+        over_quota = quota.reserve(reservation_id, disk=request.size)
+        if over_quota is not None:
+            raise QuotaError("Disk", request.size, over_quota[1], quota.disk)
+
+        try:
+            volume = Volume()
+            volume.project = project
+            volume.name = request.name
+            volume.zone = zone
+            volume.size = request.size
+            volume.quota_reservation = reservation_id
+            volume.create()
+        except Exception:
+            # Give back the quota if we couldn't create the volume
+            ProjectQuota.release(project.name, reservation_id)
+            raise
 
         return ResponseVolume.from_database(volume)
 
@@ -94,7 +95,7 @@ class VolumeRouter(SandwichProjectRouter):
     @cherrypy.tools.model_params(cls=ParamsListVolume)
     @cherrypy.tools.model_out_pagination(cls=ResponseVolume)
     @cherrypy.tools.enforce_permission(permission_name="volumes:list")
-    def list(self, limit: int, marker: uuid.UUID):
+    def list(self, limit: int, marker: str):
         """List volumes
         ---
         get:
@@ -261,17 +262,19 @@ class VolumeRouter(SandwichProjectRouter):
             raise cherrypy.HTTPError(400, 'Size must be bigger than the current volume size.')
 
         quota: ProjectQuota = ProjectQuota.get(project.name)
-        used_disk = quota.used_disk + request.size
-        if quota.disk != -1:
-            if used_disk > quota.disk:
-                raise QuotaError("Disk", request.size, quota.used_disk, quota.disk)
-
-        quota.used_disk = used_disk
-        quota.save()
-
-        volume.task = VolumeTask.GROWING
-        volume.task_kwargs = {"size": request.size}
-        volume.save()
+        reservation_id = ProjectQuota.new_reservation_id()
+        over_quota = quota.reserve(reservation_id, disk=request.size - volume.size)
+        if over_quota is not None:
+            raise QuotaError("Disk", request.size - volume.size, over_quota[1], quota.disk)
+
+        try:
+            volume.task = VolumeTask.GROWING
+            volume.task_kwargs = {"size": request.size}
+            volume.quota_reservation = reservation_id
+            volume.save()
+        except Exception:
+            ProjectQuota.release(project.name, reservation_id)
+            raise
 
     @Route(route='{volume_name}/action/clone', methods=[RequestMethods.POST])
     @cherrypy.tools.model_params(cls=ParamsVolume)
@@ -306,21 +309,23 @@ class VolumeRouter(SandwichProjectRouter):
             raise cherrypy.HTTPError(409, 'A volume with the requested name already exists.')
 
         quota: ProjectQuota = ProjectQuota.get(project.name)
-        used_disk = quota.used_disk + volume.size
-        if quota.disk != -1:
-            if used_disk > quota.disk:
-                raise QuotaError("Disk", volume.size, quota.used_disk, quota.disk)
-
-        quota.used_disk = used_disk
-        quota.save()
-
-        new_volume = Volume()
-        new_volume.project = volume.project
-        new_volume.name = request.name
-        new_volume.zone = volume.zone
-        new_volume.size = volume.size
-        new_volume.cloned_from = volume
-        new_volume.create()
+        reservation_id = ProjectQuota.new_reservation_id()
+        over_quota = quota.reserve(reservation_id, disk=volume.size)
+        if over_quota is not None:
+            raise QuotaError("Disk", volume.size, over_quota[1], quota.disk)
+
+        try:
+            new_volume = Volume()
+            new_volume.project = volume.project
+            new_volume.name = request.name
+            new_volume.zone = volume.zone
+            new_volume.size = volume.size
+            new_volume.cloned_from = volume
+            new_volume.quota_reservation = reservation_id
+            new_volume.create()
+        except Exception:
+            ProjectQuota.release(project.name, reservation_id)
+            raise
 
         volume.task = VolumeTask.CLONING
         volume.task_kwargs = {'volume_name': str(new_volume.name)}
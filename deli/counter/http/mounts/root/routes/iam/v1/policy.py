@@ -2,6 +2,7 @@ import cherrypy
 from ingredients_http.request_methods import RequestMethods
 from ingredients_http.route import Route
 
+from deli.counter.auth.token import Token
 from deli.counter.http.mounts.root.routes.iam.v1.validation_models.policy import ResponsePolicy, RequestSetPolicy
 from deli.counter.http.router import SandwichSystemRouter, SandwichProjectRouter
 from deli.kubernetes.resources.project import Project
@@ -93,6 +94,8 @@ class IAMSystemPolicyRouter(SandwichSystemRouter):
 
         policy.bindings = bindings
         policy.save()
+        # Cached tokens hold the system roles
+        Token.invalidate_all()
 
 
 class IAMProjectPolicyRouter(SandwichProjectRouter):
@@ -1,5 +1,3 @@
-import uuid
-
 import cherrypy
 from ingredients_http.request_methods import RequestMethods
 from ingredients_http.route import Route
@@ -86,7 +84,7 @@ class ProjectRouter(SandwichRouter):
     @Route()
     @cherrypy.tools.model_params(cls=ParamsListProject)
     @cherrypy.tools.model_out_pagination(cls=ResponseProject)
-    def list(self, limit: int, marker: uuid.UUID):
+    def list(self, limit: int, marker: str):
         """List projects
         ---
         get:
@@ -100,10 +98,15 @@ class ProjectRouter(SandwichRouter):
         """
         token: Token = cherrypy.request.token
 
+        projects, next_marker = token.get_projects(limit=limit, marker=marker)
+
         resp_models = []
-        for project in token.get_projects():
+        for project in projects:
             resp_models.append(ResponseProject.from_database(project))
-        return resp_models, False
+
+        if next_marker is None:
+            return resp_models, False
+        return resp_models, next_marker
 
     @Route(route='{project_name}', methods=[RequestMethods.DELETE])
     @cherrypy.tools.model_params(cls=ParamsProject)
@@ -71,6 +71,7 @@ class ServiceAccountHelper(object):
                 raise cherrypy.HTTPError(409, 'Cannot delete a service account while it is in use by an instance')
 
         service_account.delete()
+        Token.invalidate_service_account(service_account)
 
     def helper_create_key(self, project: Optional[Project]):
         request: RequestCreateServiceAccountKey = cherrypy.request.model
@@ -118,6 +119,7 @@ class ServiceAccountHelper(object):
         del keys[name]
         service_account.keys = keys
         service_account.save()
+        Token.invalidate_service_account(service_account)
 
 
 class SystemServiceAccountsRouter(SandwichSystemRouter, ServiceAccountHelper):
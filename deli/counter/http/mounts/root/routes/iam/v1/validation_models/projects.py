@@ -3,7 +3,7 @@ import re
 from ingredients_http.schematics.types import ArrowType
 from schematics import Model
 from schematics.exceptions import ValidationError
-from schematics.types import UUIDType, IntType, StringType
+from schematics.types import IntType, StringType
 
 from deli.kubernetes.resources.project import Project
 from deli.kubernetes.resources.v1alpha1.project_quota.model import ProjectQuota
@@ -33,7 +33,7 @@ class ParamsProject(Model):
 
 class ParamsListProject(Model):
     limit = IntType(default=100, max_value=100, min_value=1)
-    marker = UUIDType()
+    marker = ProjectName()
 
 
 class ResponseProject(Model):
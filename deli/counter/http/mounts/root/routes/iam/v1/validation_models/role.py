@@ -16,7 +16,7 @@ class ParamsRole(Model):
 
 class ParamsListRoles(Model):
     limit = IntType(default=100, max_value=100, min_value=1)
-    marker = UUIDType()
+    marker = StringType()
 
 
 class RequestRoleUpdate(Model):
@@ -1,6 +1,6 @@
 from ingredients_http.schematics.types import KubeName, ArrowType, EnumType
 from schematics import Model
-from schematics.types import UUIDType, StringType, IntType, EmailType, DictType
+from schematics.types import StringType, IntType, EmailType, DictType
 
 from deli.kubernetes.resources.model import ResourceState
 
@@ -15,7 +15,7 @@ class ParamsServiceAccount(Model):
 
 class ParamsListServiceAccount(Model):
     limit = IntType(default=100, max_value=100, min_value=1)
-    marker = UUIDType()
+    marker = StringType()
 
 
 class ResponseServiceAccount(Model):
@@ -1,6 +1,6 @@
 from ingredients_http.schematics.types import KubeName, EnumType, ArrowType
 from schematics import Model
-from schematics.types import IntType, UUIDType, StringType, BooleanType
+from schematics.types import IntType, StringType, BooleanType
 
 from deli.kubernetes.resources.model import ResourceState
 from deli.kubernetes.resources.v1alpha1.region.model import Region
@@ -20,7 +20,7 @@ class ParamsRegion(Model):
 class ParamsListRegion(Model):
     region_name = KubeName()
     limit = IntType(default=100, max_value=100, min_value=1)
-    marker = UUIDType()
+    marker = StringType()
 
 
 class RequestRegionSchedule(Model):
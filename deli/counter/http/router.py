@@ -4,16 +4,28 @@ from typing import Callable, List
 import cherrypy
 from ingredients_http.request_methods import RequestMethods
 from ingredients_http.router import Router
+from kubernetes.client.rest import ApiException
 
 
 class SandwichRouter(Router):
     def paginate(self, db_cls, response_cls, limit, marker, **kwargs):
         resp_models = []
 
-        for obj in db_cls.list(**kwargs):
+        try:
+            objs, next_marker = db_cls.list_page(limit=limit, marker=marker, **kwargs)
+        except ValueError:
+            raise cherrypy.HTTPError(400, "Invalid marker.")
+        except ApiException as e:
+            if e.status == 410:
+                raise cherrypy.HTTPError(410, "The marker has expired, please start listing from the beginning.")
+            raise
+
+        for obj in objs:
             resp_models.append(response_cls.from_database(obj))
 
-        return resp_models, False
+        if next_marker is None:
+            return resp_models, False
+        return resp_models, next_marker
 
     def on_register(self, uri: str, action: Callable, methods: List[RequestMethods]):
         self.mount.api_spec.add_path(path=uri, router=self, func=action)
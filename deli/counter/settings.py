@@ -70,6 +70,30 @@ KUBE_MASTER = os.environ.get("KUBEMASTER")
 
 REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
 
+# Max number of entries and seconds to keep them in each process's local cache
+CACHE_LOCAL_SIZE = int(os.environ.get("CACHE_LOCAL_SIZE", 1000))
+CACHE_LOCAL_TIME = int(os.environ.get("CACHE_LOCAL_TIME", 5))
+
+# Seconds to remember that something doesn't exist
+CACHE_MISSING_TIME = int(os.environ.get("CACHE_MISSING_TIME", 5))
+
+# Cached values larger than this many bytes are compressed, -1 to never compress
+CACHE_COMPRESS_THRESHOLD = int(os.environ.get("CACHE_COMPRESS_THRESHOLD", 1024))
+
+####################
+# Resource Store   #
+####################
+
+# How often the in-memory resource store does a full relist of every kind
+STORE_RESYNC_SECONDS = int(os.environ.get("STORE_RESYNC_SECONDS", 300))
+
+####################
+# Metrics          #
+####################
+
+# How often the process logs its counters
+METRICS_LOG_SECONDS = int(os.environ.get("METRICS_LOG_SECONDS", 300))
+
 ####################
 # Auth             #
 ####################
@@ -77,6 +101,9 @@ REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
 AUTH_DRIVERS = os.environ.get('AUTH_DRIVERS', "").split(",")
 AUTH_FERNET_KEYS = os.environ['AUTH_FERNET_KEYS'].split(",")
 
+# Max seconds to cache a verified token, tokens are never cached past their expiry
+AUTH_TOKEN_CACHE_TIME = int(os.environ.get('AUTH_TOKEN_CACHE_TIME', 60))
+
 # URL of the OpenID Provider
 OPENID_ISSUER_URL = os.environ['OPENID_ISSUER_URL']
 
@@ -89,3 +116,6 @@ OPENID_EMAIL_CLAIM = os.environ.get('OPENID_EMAIL_CLAIM', 'email')
 
 # JWT claim to use as the user's groups
 OPENID_GROUPS_CLAIM = os.environ.get('OPENID_GROUPS_CLAIM', 'groups')
+
+# Seconds to cache the OpenID Provider's configuration and signing keys
+OPENID_CACHE_TIME = int(os.environ.get('OPENID_CACHE_TIME', 3600))
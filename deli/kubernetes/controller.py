@@ -1,13 +1,18 @@
+import copy
+import threading
 from abc import abstractmethod
 
+from go_defer import with_defer, defer
 from k8scontroller.controller import Controller
 from kubernetes import client
+from redis import RedisError
 
 from deli.kubernetes.resources.model import ResourceState
+from deli.kubernetes.store.store import informer_key
 
 
 class ModelController(Controller):
-    def __init__(self, worker_count, resync_seconds, model_cls, vmware=None):
+    def __init__(self, worker_count, resync_seconds, model_cls, vmware=None, index_resync_seconds=600):
         self.model_cls = model_cls
         self.vmware = vmware
 
@@ -19,17 +24,147 @@ class ModelController(Controller):
 
         super().__init__(self.model_cls.__name__, worker_count, resync_seconds, list_func, *list_args, **list_kwargs)
 
+        # Keep the redis label indexes in sync with what we see from the watch
+        self.index_resync_seconds = index_resync_seconds
+        self.indexed_versions = {}
+        # The informer keeps deleted objects in its cache so remember them to leave them out of rebuilds
+        self.deleted_versions = {}
+        self.indexed_versions_lock = threading.Lock()
+        self.index_stop = threading.Event()
+        self.index_thread = None
+        self.informer.add_event_funcs(self.__index_add_func, self.__index_update_func, self.__index_delete_func)
+
+        # vCenter task key -> key of the model waiting on it
+        self.watched_tasks = {}
+        self.watched_tasks_lock = threading.Lock()
+
+    def start(self):
+        super().start()
+        if self.index_thread is None:
+            self.index_thread = threading.Thread(target=self.run_index_reconcile, daemon=True)
+            self.index_thread.start()
+
+    def stop(self):
+        self.index_stop.set()
+        super().stop()
+
+    @with_defer
+    def __index_add_func(self, obj):
+        model = self.model_cls(obj)
+        self.indexed_versions_lock.acquire()
+        defer(self.indexed_versions_lock.release)
+        self.deleted_versions.pop(model.index_member, None)
+        if self.indexed_versions.get(model.index_member) == model.resource_version:
+            # Resyncs send every object again, skip the ones that haven't changed
+            return
+        try:
+            self.update_indexes(model)
+        except RedisError:
+            self.logger.exception("Error updating index for " + model.index_member)
+            return
+        self.indexed_versions[model.index_member] = model.resource_version
+
+    def __index_update_func(self, _, obj):
+        return self.__index_add_func(obj)
+
+    @with_defer
+    def __index_delete_func(self, obj):
+        model = self.model_cls(obj)
+        self.indexed_versions_lock.acquire()
+        defer(self.indexed_versions_lock.release)
+        self.indexed_versions.pop(model.index_member, None)
+        self.deleted_versions[model.index_member] = model.resource_version
+        try:
+            self.remove_indexes(model)
+        except RedisError:
+            self.logger.exception("Error removing index for " + model.index_member)
+
+    def update_indexes(self, model):
+        model.update_index()
+
+    def remove_indexes(self, model):
+        model.remove_index()
+
+    def rebuild_indexes(self, raw_items):
+        self.model_cls.rebuild_index(raw_items)
+
+    def run_index_reconcile(self):
+        # Rebuild the indexes from scratch every so often to fix any drift from missed events
+        while self.index_stop.is_set() is False:
+            # noinspection PyBroadException
+            try:
+                self.reconcile_index()
+            except Exception:
+                self.logger.exception("Error reconciling " + self.model_cls.name_plural() + " index")
+            self.index_stop.wait(self.index_resync_seconds)
+
+    @with_defer
+    def reconcile_index(self):
+        self.indexed_versions_lock.acquire()
+        defer(self.indexed_versions_lock.release)
+
+        with self.informer.cache.lock:
+            objs = list(self.informer.cache.cache.values())
+
+        raw_items = []
+        members = set()
+        for obj in objs:
+            model = self.model_cls(obj)
+            members.add(model.index_member)
+            if self.deleted_versions.get(model.index_member) == model.resource_version:
+                continue
+            raw_items.append(obj)
+
+        # Anything deleted that the informer no longer has was dropped by a relist
+        self.deleted_versions = dict([(member, resource_version)
+                                      for member, resource_version in self.deleted_versions.items()
+                                      if member in members])
+
+        self.rebuild_indexes(raw_items)
+        self.indexed_versions = dict((self.model_cls(raw).index_member, raw['metadata']['resourceVersion'])
+                                     for raw in raw_items)
+
+    @staticmethod
+    def model_key(model):
+        return informer_key(model._raw)
+
+    def watch_task(self, model, task_key):
+        """
+        Sync the model as soon as the vCenter task finishes instead of waiting for the next resync
+        """
+        if self.vmware is None:
+            return
+        with self.watched_tasks_lock:
+            self.watched_tasks[task_key] = self.model_key(model)
+        self.vmware.watch_task(task_key, self.__on_task_done)
+
+    def __on_task_done(self, task_key, _):
+        with self.watched_tasks_lock:
+            key = self.watched_tasks.pop(task_key, None)
+        if key is not None and self.shutdown is False:
+            self.workqueue.add(key)
+
     def sync_handler(self, key):
         obj = self.informer.cache.get(key)
-        model = self.model_cls(obj)
+        # The informer's copy is shared so changes must not show up there until they are saved
+        model = self.model_cls(copy.deepcopy(obj))
+        model._track()
 
         # If the model has deletionTimestamp and it's not already deleting change the state to 'ToDelete'
         if model._raw['metadata'].get('deletionTimestamp', None) is not None:
+            if 'status' not in model._raw:
+                # Its create never finished so nothing was done for it yet
+                model.delete(force=True)
+                return
             if model.state not in [ResourceState.ToDelete, ResourceState.Deleting, ResourceState.Deleted]:
                 model.state = ResourceState.ToDelete
                 model.save()
                 return
 
+        if 'status' not in model._raw:
+            # Just created, the status is written right after so wait for that event
+            return
+
         return self.sync_model_handler(model)
 
     @abstractmethod
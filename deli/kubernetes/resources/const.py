@@ -16,3 +16,4 @@ MEMBER_DOMAIN_LABEL = GROUP + '/member_domain'
 VM_ID_LABEL = GROUP + '/vm_id'
 # Annotations
 UPDATED_AT_ANNOTATION = GROUP + '/updated_at'
+QUOTA_RESERVATION_ANNOTATION = GROUP + '/quota_reservation'
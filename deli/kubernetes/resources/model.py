@@ -1,5 +1,8 @@
+import base64
+import binascii
 import enum
 import json
+import random
 import re
 import time
 
@@ -9,8 +12,12 @@ from kubernetes.client import V1DeleteOptions, V1beta1CustomResourceDefinitionSt
 from kubernetes.client.rest import ApiException
 
 from deli.cache import cache_client
-from deli.kubernetes.resources.const import GROUP, UPDATED_AT_ANNOTATION, NAME_LABEL
+from deli.cache.client import MISSING
+from deli.kubernetes.resources.const import GROUP, UPDATED_AT_ANNOTATION, NAME_LABEL, PROJECT_LABEL, \
+    QUOTA_RESERVATION_ANNOTATION
 from deli.kubernetes.resources.project import Project
+from deli.kubernetes.store import resource_store
+from deli.metrics import metrics
 
 
 class ResourceState(enum.Enum):
@@ -23,7 +30,13 @@ class ResourceState(enum.Enum):
     Error = 'Error'
 
 
+_UNSET = object()
+
+
 class ResourceModel(object):
+    save_retry_attempts = 5
+    save_retry_backoff_seconds = 0.1
+
     def __init__(self, raw=None):
         if raw is None:
             raw = {
@@ -47,8 +60,45 @@ class ResourceModel(object):
                     "errorMessage": ""
                 }
             }
+            self._loaded = None
+        else:
+            # Most models built from raw objects are only read so what they looked like when we got
+            # them is only taken by the callers that save them, see _track
+            self._loaded = _UNSET
         self._raw = raw
 
+    @staticmethod
+    def _snapshot(raw):
+        return json.dumps(raw, sort_keys=True, default=str)
+
+    def _track(self):
+        """
+        Remember what the object looks like now so saves can send only what changed
+        and be skipped if nothing did
+        """
+        self._loaded = self._snapshot(self._raw)
+
+    @property
+    def changed(self):
+        if self._loaded is _UNSET:
+            # We don't know, the save compares against what is stored
+            return True
+        return self._loaded is None or self._snapshot(self._raw) != self._loaded
+
+    def _saved(self):
+        self._loaded = self._snapshot(self._raw)
+
+    def _base(self):
+        """
+        Returns what the object looked like when it was loaded
+        """
+        if self._loaded is _UNSET:
+            # Not tracked when it was built so compare against what is stored now
+            self._loaded = self._snapshot(self._call_api(self._object_path(), 'GET'))
+        if self._loaded is None:
+            return {}
+        return json.loads(self._loaded)
+
     @property
     def name(self):
         return self._raw['metadata']['name']
@@ -131,6 +181,10 @@ class ResourceModel(object):
                     "singular": cls.name_singular(),
                     "kind": cls.kind(),
                     "listKind": cls.list_kind(),
+                },
+                # Status is written separately from spec so the api and controllers don't overwrite each other
+                "subresources": {
+                    "status": {}
                 }
             }
         }
@@ -161,6 +215,326 @@ class ResourceModel(object):
             # If it already exists don't error
             if e.status != 409:
                 raise
+            # It may have been created before it had the status subresource
+            api_extensions_api.patch_custom_resource_definition(crd['metadata']['name'], {
+                "spec": {
+                    "subresources": crd['spec']['subresources']
+                }
+            })
+
+    @classmethod
+    def _call_api(cls, path, method, query_params=None, body=None, content_type='application/json'):
+        # The kubernetes client we use doesn't expose everything the custom object api supports
+        # (i.e pagination) so some calls are made directly
+        api_client = client.ApiClient()
+        header_params = {
+            'Accept': 'application/json',
+            'Content-Type': content_type
+        }
+        return api_client.call_api(path, method, {}, query_params or [], header_params, body=body,
+                                   response_type='object', auth_settings=['BearerToken'],
+                                   _return_http_data_only=True)
+
+    def _object_path(self):
+        raise NotImplementedError
+
+    @classmethod
+    def _escape_pointer(cls, key):
+        return str(key).replace("~", "~0").replace("/", "~1")
+
+    @classmethod
+    def _json_patch(cls, old, new, path):
+        """
+        Returns the json patch operations that turn old into new
+
+        Dicts are compared key by key, anything else is replaced as a whole. Every value
+        that is changed or removed is tested first so the patch fails if someone else
+        changed it since we read it.
+        """
+        ops = []
+        for key in old.keys() - new.keys():
+            key_path = path + "/" + cls._escape_pointer(key)
+            ops.append({"op": "test", "path": key_path, "value": old[key]})
+            ops.append({"op": "remove", "path": key_path})
+        for key, value in new.items():
+            key_path = path + "/" + cls._escape_pointer(key)
+            if key in old and isinstance(old[key], dict) and isinstance(value, dict):
+                ops.extend(cls._json_patch(old[key], value, key_path))
+            elif key not in old:
+                ops.append({"op": "add", "path": key_path, "value": value})
+            elif old[key] != value:
+                ops.append({"op": "test", "path": key_path, "value": old[key]})
+                ops.append({"op": "add", "path": key_path, "value": value})
+        return ops
+
+    @classmethod
+    def _is_conflict(cls, e: ApiException):
+        # A failed test op comes back as unprocessable, as does a patch removing something
+        # that is already gone. A patch that carries a stale resourceVersion, i.e from a
+        # model that wasn't tracked, is refused as a conflict.
+        return e.status in [409, 422]
+
+    def _patch_status(self, ops):
+        self._raw = self._call_api(self._object_path() + "/status", 'PATCH', body=ops,
+                                   content_type='application/json-patch+json')
+
+    def _patch(self):
+        """
+        Send only what changed since the object was loaded
+
+        Metadata and spec are patched on the object and status on the status subresource.
+        A json patch is used instead of a merge patch because a merge patch treats None as
+        a delete and our specs and statuses keep explicit Nones.
+
+        Returns False if there was nothing to send
+        """
+        loaded = self._base()
+        raw = json.loads(self._snapshot(self._raw))
+
+        if 'status' in loaded:
+            status_ops = self._json_patch(loaded['status'], raw.get('status', {}), "/status")
+        else:
+            status_ops = [{"op": "add", "path": "/status", "value": raw.get('status', {})}]
+
+        loaded_status = loaded.pop('status', None)
+        status = raw.pop('status', None)
+        ops = self._json_patch(loaded, raw, "")
+        if len(ops) == 0 and len(status_ops) == 0:
+            return False
+
+        # Status only saves still move updated_at so the object itself is patched on every save
+        self.updated_at = arrow.now('UTC')
+        ops.append({"op": "add", "path": "/metadata/annotations/" + self._escape_pointer(UPDATED_AT_ANNOTATION),
+                    "value": self._raw['metadata']['annotations'][UPDATED_AT_ANNOTATION]})
+        latest = self._call_api(self._object_path(), 'PATCH', body=ops, content_type='application/json-patch+json')
+        if len(status_ops) > 0:
+            # Only the status is left to save, remember that in case patching it fails and the save is retried
+            latest.pop('status', None)
+            if loaded_status is not None:
+                latest['status'] = loaded_status
+            self._loaded = self._snapshot(latest)
+            latest['status'] = status
+        self._raw = latest
+
+        if len(status_ops) > 0:
+            self._patch_status(status_ops)
+
+        return True
+
+    @classmethod
+    def _three_way_merge(cls, base, mine, theirs):
+        """
+        Apply what changed in mine since base on top of theirs
+        """
+        if isinstance(mine, dict) and isinstance(theirs, dict):
+            if not isinstance(base, dict):
+                base = {}
+            merged = {}
+            for key in mine.keys() | theirs.keys():
+                if key not in mine:
+                    # Keep what they added but not what we removed
+                    if key not in base:
+                        merged[key] = theirs[key]
+                elif key not in theirs:
+                    # Keep what we added or changed but not what they removed
+                    if key not in base or mine[key] != base[key]:
+                        merged[key] = mine[key]
+                else:
+                    merged[key] = cls._three_way_merge(base.get(key, _UNSET), mine[key], theirs[key])
+            return merged
+        return mine if mine != base else theirs
+
+    def _rebase(self):
+        """
+        Move our changes on top of the latest version of the object
+        """
+        base = self._base()
+        latest = self._call_api(self._object_path(), 'GET')
+        self._raw = self._three_way_merge(base, json.loads(self._snapshot(self._raw)), latest)
+        self._loaded = self._snapshot(latest)
+
+    def save_with_retry(self, attempts=None):
+        """
+        Save and when the save conflicts re-read the object, reapply our changes and try again
+
+        Only the fields changed since the object was loaded are reapplied so changes others
+        made to the rest of the object are kept.
+        """
+        if attempts is None:
+            attempts = self.save_retry_attempts
+        for attempt in range(attempts):
+            try:
+                self.save()
+                return
+            except ApiException as e:
+                if self._is_conflict(e) is False or attempt + 1 >= attempts:
+                    raise
+            metrics.increment("model_save_retries", self.kind())
+            time.sleep(random.uniform(0, self.save_retry_backoff_seconds * (2 ** attempt)))
+            self._rebase()
+
+    def _create_status(self, status):
+        """
+        Objects are created without their status when the status subresource is enabled
+        so write it afterwards
+        """
+        if self._raw.get('status') != status:
+            self._patch_status([{"op": "add", "path": "/status", "value": status}])
+
+    def _discard(self):
+        """
+        Remove an object whose create didn't finish
+
+        It has our finalizer but no status so the controllers would never let it go
+        """
+        try:
+            self._call_api(self._object_path(), 'PATCH', body=[{"op": "remove", "path": "/metadata/finalizers"}],
+                           content_type='application/json-patch+json')
+            self._call_api(self._object_path(), 'DELETE')
+        except ApiException:
+            # If this fails too the controller finishes it off once it is deleted
+            pass
+
+    @classmethod
+    def _encode_marker(cls, position):
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    @classmethod
+    def _decode_marker(cls, marker):
+        if marker is None:
+            return {}
+        try:
+            position = json.loads(base64.urlsafe_b64decode(marker.encode()).decode())
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise ValueError("Invalid marker")
+        if not isinstance(position, dict):
+            raise ValueError("Invalid marker")
+        return position
+
+    @classmethod
+    def _list_page(cls, path, namespace, limit, marker, label_selector=None):
+        """
+        Returns a single page of raw objects and the marker for the next page (None if there are no more pages)
+
+        The store is used when it is synced, otherwise the page is fetched from Kubernetes
+        using limit and continue
+        """
+        position = cls._decode_marker(marker)
+
+        if 'continue' not in position:
+            raw_items = resource_store.list(cls, namespace=namespace, label_selector=label_selector)
+            if raw_items is None and 'after' in position:
+                # The marker came from a store this process can't use yet and kubernetes
+                # can't resume from a name so list everything and skip ahead
+                query_params = []
+                if label_selector is not None:
+                    query_params.append(('labelSelector', label_selector))
+                raw_items = sorted(cls._call_api(path, 'GET', query_params=query_params)['items'],
+                                   key=lambda item: item['metadata']['name'])
+            if raw_items is not None:
+                if 'after' in position:
+                    raw_items = [item for item in raw_items if item['metadata']['name'] > position['after']]
+                if len(raw_items) > limit:
+                    raw_items = raw_items[:limit]
+                    return raw_items, cls._encode_marker({'after': raw_items[-1]['metadata']['name']})
+                return raw_items, None
+
+        query_params = [('limit', limit)]
+        if label_selector is not None:
+            query_params.append(('labelSelector', label_selector))
+        if 'continue' in position:
+            query_params.append(('continue', position['continue']))
+        raw_list = cls._call_api(path, 'GET', query_params=query_params)
+
+        next_marker = None
+        continue_token = raw_list['metadata'].get('continue')
+        if continue_token:
+            next_marker = cls._encode_marker({'continue': continue_token})
+
+        return raw_list['items'], next_marker
+
+    @classmethod
+    def index_prefix(cls):
+        return "index_" + cls.name_plural() + "_"
+
+    @classmethod
+    def index_record_prefix(cls):
+        return "indexed_" + cls.name_plural() + "_"
+
+    @classmethod
+    def index_ready_key(cls):
+        return "index_ready_" + cls.name_plural()
+
+    @classmethod
+    def index_key(cls, label, value):
+        return cls.index_prefix() + label + "=" + str(value)
+
+    @classmethod
+    def member_cache_key(cls, member):
+        raise NotImplementedError
+
+    @property
+    def index_member(self):
+        raise NotImplementedError
+
+    @property
+    def index_keys(self):
+        index_keys = []
+        for label, value in self._raw['metadata'].get('labels', {}).items():
+            if label == NAME_LABEL or value is None:
+                continue
+            index_keys.append(self.index_key(label, value))
+        return index_keys
+
+    def update_index(self):
+        cache_client.update_index(self.index_member, self.index_record_prefix() + self.index_member, self.index_keys)
+
+    def remove_index(self):
+        cache_client.remove_index(self.index_member, self.index_record_prefix() + self.index_member)
+
+    @classmethod
+    def rebuild_index(cls, raw_items):
+        memberships = {}
+        for raw in raw_items:
+            o = cls(raw)
+            memberships[o.index_member] = o.index_keys
+        cache_client.rebuild_index(cls.index_prefix(), cls.index_record_prefix(), memberships, cls.index_ready_key())
+
+    @classmethod
+    def _list_from_index(cls, index_keys, label_selector=None, **kwargs):
+        """
+        Answer an equality only label selector from the redis label indexes
+
+        Returns None when the indexes can't answer so the caller can ask the api server
+        """
+        if len(kwargs) > 0:
+            return None
+
+        index_keys = list(index_keys)
+        if label_selector is not None:
+            for requirement in label_selector.split(","):
+                requirement = requirement.strip()
+                if requirement == "":
+                    continue
+                if "=" not in requirement or "!=" in requirement:
+                    return None
+                label, value = requirement.replace("==", "=").split("=", 1)
+                index_keys.append(cls.index_key(label.strip(), value.strip()))
+
+        if len(index_keys) == 0:
+            return None
+        if not cache_client.exists(cls.index_ready_key()):
+            return None
+
+        members = sorted(cache_client.index_members(*index_keys))
+        items = []
+        for raw in cache_client.get_many([cls.member_cache_key(member) for member in members]):
+            if raw is None:
+                # The object fell out of the cache, let the api server answer and refill it
+                return None
+            items.append(cls(raw))
+
+        return items
 
     @classmethod
     def wait_for_crd(cls):
@@ -185,17 +559,49 @@ class ResourceModel(object):
 
 class SystemResourceModel(ResourceModel):
 
+    def _object_path(self):
+        return "/apis/" + GROUP + "/" + self.version() + "/" + self.name_plural() + "/" + self.name
+
     def create(self):
         crd_api = client.CustomObjectsApi()
 
-        self._raw = crd_api.create_cluster_custom_object(GROUP, self.version(), self.name_plural(), self._raw)
+        status = self._raw['status']
+        try:
+            self._raw = crd_api.create_cluster_custom_object(GROUP, self.version(), self.name_plural(), self._raw)
+        except ApiException:
+            # Don't leave a missing entry around if the object already exists
+            cache_client.delete(self.name_plural() + "_" + self.name)
+            raise
+        try:
+            self._create_status(status)
+        except ApiException:
+            self._discard()
+            raise
+        self._saved()
+        resource_store.update(self.__class__, self._raw)
         cache_client.set(self.name_plural() + "_" + self.name, self._raw)
+        self.update_index()
+
+    @classmethod
+    def member_cache_key(cls, member):
+        return cls.name_plural() + "_" + member
+
+    @property
+    def index_member(self):
+        return self.name
 
     @classmethod
     def get(cls, name, safe=True, from_cache=True):
         resp = None
         if from_cache:
-            resp = cache_client.get(cls.name_plural() + "_" + name)
+            resp = resource_store.get(cls, name)
+            if resp is None:
+                resp = cache_client.get(cls.name_plural() + "_" + name, allow_missing=True)
+                if resp is MISSING:
+                    if safe:
+                        return None
+                    # Let the api server raise the 404
+                    resp = None
         if resp is None:
             crd_api = client.CustomObjectsApi()
             try:
@@ -206,25 +612,35 @@ class SystemResourceModel(ResourceModel):
                 cache_client.set(cls.name_plural() + "_" + o.name, o._raw)
             except ApiException as e:
                 if e.status == 404:
-                    cache_client.delete(cls.name_plural() + "_" + name)
+                    cache_client.set_missing(cls.name_plural() + "_" + name)
                     if safe:
                         return None
                 raise
         else:
             o = cls(resp)
 
+        # Whatever is fetched on its own is usually about to be changed
+        o._track()
         return o
 
     def save(self, ignore=False):
-        crd_api = client.CustomObjectsApi()
+        if self.changed is False:
+            # Writing the same thing again would only cause another watch event
+            metrics.increment("model_saves_skipped", self.kind())
+            return
         try:
-            self.updated_at = arrow.now('UTC')
-            self._raw = crd_api.replace_cluster_custom_object(GROUP, self.version(), self.name_plural(), self.name,
-                                                              self._raw)
+            if self._patch() is False:
+                metrics.increment("model_saves_skipped", self.kind())
+                return
+            self._saved()
+            metrics.increment("model_saves", self.kind())
+            resource_store.update(self.__class__, self._raw)
             cache_client.set(self.name_plural() + "_" + self.name, self._raw)
+            self.update_index()
         except ApiException as e:
             cache_client.delete(self.name_plural() + "_" + self.name)
-            if e.status == 409:
+            if self._is_conflict(e):
+                metrics.increment("model_save_conflicts", self.kind())
                 if ignore:
                     return
             raise e
@@ -233,19 +649,42 @@ class SystemResourceModel(ResourceModel):
     def list_sig(cls):
         return [GROUP, cls.version(), cls.name_plural()], {}
 
+    @classmethod
+    def list_page(cls, limit, marker=None, label_selector=None):
+        path = "/apis/" + GROUP + "/" + cls.version() + "/" + cls.name_plural()
+        raw_items, next_marker = cls._list_page(path, None, limit, marker, label_selector=label_selector)
+
+        items = []
+        to_cache = {}
+        for item in raw_items:
+            o = cls(item)
+            items.append(o)
+            to_cache[cls.name_plural() + "_" + o.name] = item
+        cache_client.set_many(to_cache)
+
+        return items, next_marker
+
     @classmethod
     def list(cls, **kwargs):
+        raw_items = resource_store.list(cls, **kwargs)
+        if raw_items is not None:
+            return [cls(item) for item in raw_items]
+
+        items = cls._list_from_index([], **kwargs)
+        if items is not None:
+            return items
+
         items = []
 
         crd_api = client.CustomObjectsApi()
         args, sig_kwargs = cls.list_sig()
         raw_list = crd_api.list_cluster_custom_object(*args, **{**sig_kwargs, **kwargs})
-        pipe = cache_client.pipeline()
+        to_cache = {}
         for item in raw_list['items']:
             o = cls(item)
             items.append(o)
-            pipe.set(cls.name_plural() + "_" + o.name, json.dumps(item), ex=cache_client.default_cache_time)
-        pipe.execute()
+            to_cache[cls.name_plural() + "_" + o.name] = item
+        cache_client.set_many(to_cache)
 
         return items
 
@@ -260,6 +699,7 @@ class SystemResourceModel(ResourceModel):
                 crd_api.delete_cluster_custom_object(GROUP, self.version(), self.name_plural(), self.name,
                                                      V1DeleteOptions())
                 cache_client.delete(self.name_plural() + "_" + self.name)
+                self.remove_index()
             except ApiException as e:
                 if e.status != 404:
                     raise
@@ -293,20 +733,68 @@ class ProjectResourceModel(ResourceModel):
     def project(self, value):
         self._raw['metadata']['namespace'] = "sandwich-" + value.name
 
+    @property
+    def quota_reservation(self):
+        return self._raw['metadata'].get('annotations', {}).get(QUOTA_RESERVATION_ANNOTATION)
+
+    @quota_reservation.setter
+    def quota_reservation(self, value):
+        self._raw['metadata']['annotations'][QUOTA_RESERVATION_ANNOTATION] = value
+
+    def _object_path(self):
+        return "/apis/" + GROUP + "/" + self.version() + "/namespaces/sandwich-" + self.project_name + "/" + \
+               self.name_plural() + "/" + self.name
+
     def create(self):
         if self.project_name is None:
             raise ValueError("Project must be set to create {0}".format(self.__class__.__name__))
 
         crd_api = client.CustomObjectsApi()
-        self._raw = crd_api.create_namespaced_custom_object(GROUP, self.version(), "sandwich-" + self.project_name,
-                                                            self.name_plural(), self._raw)
+        status = self._raw['status']
+        try:
+            self._raw = crd_api.create_namespaced_custom_object(GROUP, self.version(),
+                                                                "sandwich-" + self.project_name,
+                                                                self.name_plural(), self._raw)
+        except ApiException:
+            # Don't leave a missing entry around if the object already exists
+            cache_client.delete(self.name_plural() + "_" + self.project_name + "_" + self.name)
+            raise
+        try:
+            self._create_status(status)
+        except ApiException:
+            self._discard()
+            raise
+        self._saved()
+        resource_store.update(self.__class__, self._raw)
         cache_client.set(self.name_plural() + "_" + self.project_name + "_" + self.name, self._raw)
+        self.update_index()
+
+    @classmethod
+    def member_cache_key(cls, member):
+        project_name, name = member.split("/", 1)
+        return cls.name_plural() + "_" + project_name + "_" + name
+
+    @property
+    def index_member(self):
+        return self.project_name + "/" + self.name
+
+    @property
+    def index_keys(self):
+        # Index the project as well so we can list everything in a project
+        return super().index_keys + [self.index_key(PROJECT_LABEL, self.project_name)]
 
     @classmethod
     def get(cls, project, name, safe=True, from_cache=True):
         resp = None
         if from_cache:
-            resp = cache_client.get(cls.name_plural() + "_" + project.name + "_" + name)
+            resp = resource_store.get(cls, name, namespace="sandwich-" + project.name)
+            if resp is None:
+                resp = cache_client.get(cls.name_plural() + "_" + project.name + "_" + name, allow_missing=True)
+                if resp is MISSING:
+                    if safe:
+                        return None
+                    # Let the api server raise the 404
+                    resp = None
         if resp is None:
             crd_api = client.CustomObjectsApi()
             try:
@@ -318,25 +806,35 @@ class ProjectResourceModel(ResourceModel):
                 cache_client.set(cls.name_plural() + "_" + o.project_name + "_" + o.name, o._raw)
             except ApiException as e:
                 if e.status == 404:
-                    cache_client.delete(cls.name_plural() + "_" + project.name + "_" + name)
+                    cache_client.set_missing(cls.name_plural() + "_" + project.name + "_" + name)
                     if safe:
                         return None
                 raise
         else:
             o = cls(resp)
 
+        # Whatever is fetched on its own is usually about to be changed
+        o._track()
         return o
 
     def save(self, ignore=False):
-        crd_api = client.CustomObjectsApi()
+        if self.changed is False:
+            # Writing the same thing again would only cause another watch event
+            metrics.increment("model_saves_skipped", self.kind())
+            return
         try:
-            self.updated_at = arrow.now('UTC')
-            self._raw = crd_api.replace_namespaced_custom_object(GROUP, self.version(), "sandwich-" + self.project_name,
-                                                                 self.name_plural(), self.name, self._raw)
+            if self._patch() is False:
+                metrics.increment("model_saves_skipped", self.kind())
+                return
+            self._saved()
+            metrics.increment("model_saves", self.kind())
+            resource_store.update(self.__class__, self._raw)
             cache_client.set(self.name_plural() + "_" + self.project_name + "_" + self.name, self._raw)
+            self.update_index()
         except ApiException as e:
             cache_client.delete(self.name_plural() + "_" + self.project.name + "_" + self.name)
-            if e.status == 409:
+            if self._is_conflict(e):
+                metrics.increment("model_save_conflicts", self.kind())
                 if ignore:
                     return
             raise e
@@ -345,39 +843,69 @@ class ProjectResourceModel(ResourceModel):
     def list_sig(cls):
         return [GROUP, cls.version()], {"plural": cls.name_plural()}
 
+    @classmethod
+    def list_page(cls, project, limit, marker=None, label_selector=None):
+        namespace = "sandwich-" + project.name
+        path = "/apis/" + GROUP + "/" + cls.version() + "/namespaces/" + namespace + "/" + cls.name_plural()
+        raw_items, next_marker = cls._list_page(path, namespace, limit, marker, label_selector=label_selector)
+
+        items = []
+        to_cache = {}
+        for item in raw_items:
+            o = cls(item)
+            items.append(o)
+            to_cache[cls.name_plural() + "_" + project.name + "_" + o.name] = item
+        cache_client.set_many(to_cache)
+
+        return items, next_marker
+
     @classmethod
     def list_all(cls, **kwargs):
+        raw_items = resource_store.list(cls, **kwargs)
+        if raw_items is not None:
+            return [cls(item) for item in raw_items]
+
+        items = cls._list_from_index([], **kwargs)
+        if items is not None:
+            return items
+
         items = []
 
         crd_api = client.CustomObjectsApi()
         args, sig_kwargs = cls.list_sig()
         # We use this to query all namespaces
         raw_list = crd_api.list_cluster_custom_object(*args, **{**sig_kwargs, **kwargs})
-        pipe = cache_client.pipeline()
+        to_cache = {}
         for item in raw_list['items']:
             o = cls(item)
             items.append(o)
-            pipe.set(cls.name_plural() + "_" + o.project_name + "_" + o.name, json.dumps(item),
-                     ex=cache_client.default_cache_time)
-        pipe.execute()
+            to_cache[cls.name_plural() + "_" + o.project_name + "_" + o.name] = item
+        cache_client.set_many(to_cache)
 
         return items
 
     @classmethod
     def list(cls, project, **kwargs):
+        raw_items = resource_store.list(cls, namespace="sandwich-" + project.name, **kwargs)
+        if raw_items is not None:
+            return [cls(item) for item in raw_items]
+
+        items = cls._list_from_index([cls.index_key(PROJECT_LABEL, project.name)], **kwargs)
+        if items is not None:
+            return items
+
         items = []
 
         crd_api = client.CustomObjectsApi()
         args, sig_kwargs = cls.list_sig()
         args.append("sandwich-" + project.name)
         raw_list = crd_api.list_namespaced_custom_object(*args, **{**sig_kwargs, **kwargs})
-        pipe = cache_client.pipeline()
+        to_cache = {}
         for item in raw_list['items']:
             o = cls(item)
             items.append(o)
-            pipe.set(cls.name_plural() + "_" + project.name + "_" + o.name, json.dumps(item),
-                     ex=cache_client.default_cache_time)
-        pipe.execute()
+            to_cache[cls.name_plural() + "_" + project.name + "_" + o.name] = item
+        cache_client.set_many(to_cache)
 
         return items
 
@@ -392,6 +920,7 @@ class ProjectResourceModel(ResourceModel):
                 crd_api.delete_namespaced_custom_object(GROUP, self.version(), "sandwich-" + self.project.name,
                                                         self.name_plural(), self.name, V1DeleteOptions())
                 cache_client.delete(self.name_plural() + "_" + self.project.name + "_" + self.name)
+                self.remove_index()
             except ApiException as e:
                 cache_client.delete(self.name_plural() + "_" + self.project.name + "_" + self.name)
                 if e.status != 404:
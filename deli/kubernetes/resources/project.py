@@ -1,11 +1,10 @@
-import json
-
 import arrow
 from kubernetes import client
 from kubernetes.client import V1DeleteOptions, V1Namespace
 from kubernetes.client.rest import ApiException
 
 from deli.cache import cache_client
+from deli.cache.client import MISSING
 from deli.kubernetes.resources.const import PROJECT_LABEL
 
 
@@ -38,7 +37,12 @@ class Project(object):
 
     def create(self):
         core_api = client.CoreV1Api()
-        self._raw = core_api.create_namespace(self._raw).to_dict()
+        try:
+            self._raw = core_api.create_namespace(self._raw).to_dict()
+        except ApiException:
+            # Don't leave a missing entry around if the project already exists
+            cache_client.delete('project_' + self.name)
+            raise
         cache_client.set('project_' + self.name, self._raw)
 
     @property
@@ -49,7 +53,12 @@ class Project(object):
     def get(cls, name, safe=True, from_cache=True):
         resp = None
         if from_cache:
-            resp = cache_client.get("project_" + name)
+            resp = cache_client.get("project_" + name, allow_missing=True)
+            if resp is MISSING:
+                if safe:
+                    return None
+                # Let the api server raise the 404
+                resp = None
         if resp is None:
             core_api = client.CoreV1Api()
             try:
@@ -65,7 +74,7 @@ class Project(object):
                     cache_client.set('project_' + o.name, o._raw)
             except ApiException as e:
                 if e.status == 404:
-                    cache_client.delete('project_' + name)
+                    cache_client.set_missing('project_' + name)
                     if safe:
                         return None
                 raise
@@ -89,13 +98,13 @@ class Project(object):
 
         core_api = client.CoreV1Api()
         raw_list = core_api.list_namespace(**kwargs)
-        pipe = cache_client.pipeline()
+        to_cache = {}
         for item in raw_list.items:
             o = cls(item)
             items.append(o)
             if o.state != 'Terminating':  # Only cache if not terminating
-                pipe.set("project_" + o.name, json.dumps(o._raw), ex=cache_client.default_cache_time)
-        pipe.execute()
+                to_cache["project_" + o.name] = o._raw
+        cache_client.set_many(to_cache)
         return items
 
     @property
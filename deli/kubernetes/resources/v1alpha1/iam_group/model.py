@@ -1,4 +1,6 @@
+from deli.cache import cache_client
 from deli.kubernetes.resources.model import SystemResourceModel
+from deli.kubernetes.resources.v1alpha1.iam_policy.model import IAMPolicy
 
 
 class IAMSystemGroup(SystemResourceModel):
@@ -19,3 +21,38 @@ class IAMSystemGroup(SystemResourceModel):
     @oauth_link.setter
     def oauth_link(self, value):
         self._raw['spec']['oauth_link'] = value
+
+    @staticmethod
+    def oauth_links_key():
+        return "iam_group_oauth_links"
+
+    @classmethod
+    def oauth_link_groups(cls):
+        """
+        Returns the emails of the groups linked to each oauth group
+
+        Kept in the cache so finding a token's groups doesn't list every group each time
+        """
+        links = cache_client.get(cls.oauth_links_key())
+        if links is None:
+            links = {}
+            for group in cls.list():
+                links.setdefault(group.oauth_link, []).append(group.email)
+            # Short lived in case it was built from a listing that missed a change
+            cache_client.set(cls.oauth_links_key(), links, ex=60)
+        return links
+
+    def create(self):
+        super().create()
+        cache_client.delete(self.oauth_links_key())
+
+    def save(self, ignore=False):
+        super().save(ignore=ignore)
+        # Groups can be in any policy
+        IAMPolicy.invalidate_permission_index(None)
+        cache_client.delete(self.oauth_links_key())
+
+    def delete(self, force=False):
+        super().delete(force=force)
+        IAMPolicy.invalidate_permission_index(None)
+        cache_client.delete(self.oauth_links_key())
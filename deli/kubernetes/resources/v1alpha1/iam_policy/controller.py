@@ -2,6 +2,7 @@ from deli.kubernetes.controller import ModelController
 from deli.kubernetes.resources.model import ResourceState
 from deli.kubernetes.resources.project import Project
 from deli.kubernetes.resources.v1alpha1.iam_policy.model import IAMPolicy
+from deli.kubernetes.resources.v1alpha1.iam_policy.permission_index import PolicyPermissionIndex
 from deli.kubernetes.resources.v1alpha1.iam_role.model import IAMProjectRole, IAMSystemRole
 
 
@@ -9,6 +10,18 @@ class IAMPolicyController(ModelController):
     def __init__(self, worker_count, resync_seconds):
         super().__init__(worker_count, resync_seconds, IAMPolicy, None)
 
+    def update_indexes(self, model: IAMPolicy):
+        super().update_indexes(model)
+        model.update_principal_index()
+
+    def remove_indexes(self, model: IAMPolicy):
+        super().remove_indexes(model)
+        model.remove_principal_index()
+
+    def rebuild_indexes(self, raw_items):
+        super().rebuild_indexes(raw_items)
+        IAMPolicy.rebuild_principal_index(raw_items)
+
     def sync_model_handler(self, model):
         state_funcs = {
             ResourceState.ToCreate: self.to_create,
@@ -33,6 +46,8 @@ class IAMPolicyController(ModelController):
         model.save()
 
     def created(self, model: IAMPolicy):
+        PolicyPermissionIndex.refresh(model.name)
+
         if model.name == "system":
             return
 
@@ -1,3 +1,4 @@
+from deli.cache import cache_client
 from deli.kubernetes.resources.model import SystemResourceModel
 
 
@@ -18,6 +19,83 @@ class IAMPolicy(SystemResourceModel):
     def bindings(self, value):
         self._raw['spec']['bindings'] = value
 
+    @staticmethod
+    def permission_index_key(policy_name):
+        return "iam_permissions_" + policy_name
+
+    @classmethod
+    def invalidate_permission_index(cls, policy_name):
+        if policy_name is None:
+            cache_client.delete_match(cls.permission_index_key("*"))
+        else:
+            cache_client.delete(cls.permission_index_key(policy_name))
+
+    @staticmethod
+    def principal_projects_key(principal):
+        return "principal_projects_" + principal
+
+    @staticmethod
+    def principal_record_prefix():
+        return "policy_principals_"
+
+    @staticmethod
+    def principal_ready_key():
+        return "principal_index_ready"
+
+    @property
+    def principal_keys(self):
+        principal_keys = set()
+        for binding in self.bindings:
+            for member in binding['members']:
+                principal_keys.add(self.principal_projects_key(member))
+        return principal_keys
+
+    def update_principal_index(self):
+        if self.name == "system":
+            return
+        cache_client.update_index(self.name, self.principal_record_prefix() + self.name, self.principal_keys)
+
+    def remove_principal_index(self):
+        cache_client.remove_index(self.name, self.principal_record_prefix() + self.name)
+
+    @classmethod
+    def rebuild_principal_index(cls, raw_items):
+        memberships = {}
+        for raw in raw_items:
+            policy = cls(raw)
+            if policy.name == "system":
+                continue
+            memberships[policy.name] = policy.principal_keys
+        cache_client.rebuild_index(cls.principal_projects_key(""), cls.principal_record_prefix(), memberships,
+                                   cls.principal_ready_key())
+
+    @classmethod
+    def principal_projects(cls, principals):
+        """
+        Returns the sorted names of the projects the principals are bound in
+
+        Returns None if the index hasn't been built yet
+        """
+        if not cache_client.exists(cls.principal_ready_key()):
+            return None
+        if len(principals) == 0:
+            return []
+        return sorted(cache_client.index_union(*[cls.principal_projects_key(p) for p in principals]))
+
+    def create(self):
+        super().create()
+        self.update_principal_index()
+
+    def save(self, ignore=False):
+        super().save(ignore=ignore)
+        self.invalidate_permission_index(self.name)
+        self.update_principal_index()
+
+    def delete(self, force=False):
+        super().delete(force=force)
+        self.invalidate_permission_index(self.name)
+        self.remove_principal_index()
+
     @classmethod
     def create_system_policy(cls):
         policy = cls()
@@ -0,0 +1,126 @@
+from deli.cache import cache_client
+from deli.kubernetes.resources.project import Project
+from deli.kubernetes.resources.v1alpha1.iam_group.model import IAMSystemGroup
+from deli.kubernetes.resources.v1alpha1.iam_policy.model import IAMPolicy
+from deli.kubernetes.resources.v1alpha1.iam_role.model import IAMSystemRole, IAMProjectRole
+
+
+class PolicyPermissionIndex(object):
+    """
+    A policy compiled down to member -> roles -> permissions so checking a permission
+    doesn't need to load the policy, its groups and its roles.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def policy_name(self):
+        return self.data['policy']
+
+    @property
+    def policy_version(self):
+        return self.data['policyVersion']
+
+    @property
+    def role_versions(self):
+        return self.data['roleVersions']
+
+    @classmethod
+    def compile(cls, policy: IAMPolicy):
+        project = None
+        if policy.name != "system":
+            project = Project.get(policy.name)
+            if project is None:
+                return None
+
+        members = {}
+        groups = {}
+        roles = {}
+        role_versions = {}
+        for binding in policy.bindings:
+            role_name = binding['role']
+            if role_name not in roles:
+                if project is None:
+                    role = IAMSystemRole.get(role_name)
+                else:
+                    role = IAMProjectRole.get(project, role_name)
+                if role is None:
+                    continue
+                roles[role_name] = role.permissions
+                role_versions[role_name] = role.resource_version
+
+            for member in binding['members']:
+                if member.endswith("group.system.sandwich.local"):
+                    iam_group = IAMSystemGroup.get(member.split(":")[-1].split("@")[0])
+                    if iam_group is None:
+                        continue
+                    groups.setdefault(iam_group.oauth_link, []).append(role_name)
+                else:
+                    members.setdefault(member, []).append(role_name)
+
+        return cls({
+            'policy': policy.name,
+            'policyVersion': policy.resource_version,
+            'roleVersions': role_versions,
+            'members': members,
+            'groups': groups,
+            'roles': roles
+        })
+
+    @staticmethod
+    def cache_key(policy_name):
+        return IAMPolicy.permission_index_key(policy_name)
+
+    @classmethod
+    def get(cls, policy_name):
+        data = cache_client.get(cls.cache_key(policy_name))
+        if data is not None:
+            return cls(data)
+
+        # Nothing has published it yet so build it ourselves
+        policy = IAMPolicy.get(policy_name)
+        if policy is None:
+            return None
+        index = cls.compile(policy)
+        if index is not None:
+            index.publish()
+        return index
+
+    @classmethod
+    def refresh(cls, policy_name, role=None):
+        """
+        Rebuild and publish the index if it's missing or was built from an older policy or role
+        """
+        policy = IAMPolicy.get(policy_name)
+        if policy is None:
+            IAMPolicy.invalidate_permission_index(policy_name)
+            return
+
+        data = cache_client.get(cls.cache_key(policy_name))
+        if data is not None:
+            index = cls(data)
+            up_to_date = index.policy_version == policy.resource_version
+            if role is not None and role.name in [binding['role'] for binding in policy.bindings]:
+                up_to_date = up_to_date and index.role_versions.get(role.name) == role.resource_version
+            if up_to_date:
+                return
+
+        index = cls.compile(policy)
+        if index is not None:
+            index.publish()
+
+    def publish(self):
+        cache_client.set(self.cache_key(self.policy_name), self.data)
+
+    def find_roles(self, identity, oauth_groups):
+        roles = set(self.data['members'].get(identity, []))
+        for oauth_group in oauth_groups:
+            roles.update(self.data['groups'].get(oauth_group, []))
+        return roles
+
+    def permissions(self, roles):
+        permissions = set()
+        for role_name in roles:
+            permissions.update(self.data['roles'].get(role_name, []))
+        return permissions
@@ -1,6 +1,7 @@
 from deli.counter.auth.permission import SYSTEM_PERMISSIONS, PROJECT_PERMISSIONS
 from deli.kubernetes.controller import ModelController
 from deli.kubernetes.resources.model import ResourceState
+from deli.kubernetes.resources.v1alpha1.iam_policy.permission_index import PolicyPermissionIndex
 from deli.kubernetes.resources.v1alpha1.iam_role.model import IAMProjectRole, IAMSystemRole
 
 
@@ -32,6 +33,8 @@ class IAMSystemRoleController(ModelController):
         model.save()
 
     def created(self, model: IAMSystemRole):
+        PolicyPermissionIndex.refresh("system", role=model)
+
         if model.name != 'admin':
             return
 
@@ -41,7 +44,7 @@ class IAMSystemRoleController(ModelController):
             return
 
         model.permissions = permission_names
-        model.save(ignore=True)
+        model.save_with_retry()
 
     def to_delete(self, model):
         model.state = ResourceState.Deleting
@@ -83,6 +86,8 @@ class IAMProjectRoleController(ModelController):
         model.save()
 
     def created(self, model: IAMProjectRole):
+        PolicyPermissionIndex.refresh(model.project_name, role=model)
+
         permissions = {
             'viewer': [permission['name'] for permission in PROJECT_PERMISSIONS if
                        'viewer' in permission.get('tag', [])],
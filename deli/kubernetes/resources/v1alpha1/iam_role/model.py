@@ -1,6 +1,7 @@
 from deli.counter.auth.permission import SYSTEM_PERMISSIONS, PROJECT_PERMISSIONS
 from deli.kubernetes.resources.model import SystemResourceModel, ProjectResourceModel
 from deli.kubernetes.resources.project import Project
+from deli.kubernetes.resources.v1alpha1.iam_policy.model import IAMPolicy
 
 
 class IAMSystemRole(SystemResourceModel):
@@ -20,6 +21,14 @@ class IAMSystemRole(SystemResourceModel):
     def permissions(self, value):
         self._raw['spec']['permissions'] = value
 
+    def save(self, ignore=False):
+        super().save(ignore=ignore)
+        IAMPolicy.invalidate_permission_index("system")
+
+    def delete(self, force=False):
+        super().delete(force=force)
+        IAMPolicy.invalidate_permission_index("system")
+
     @classmethod
     def create_default_roles(cls):
         admin_role = cls()
@@ -46,6 +55,14 @@ class IAMProjectRole(ProjectResourceModel):
     def permissions(self, value):
         self._raw['spec']['permissions'] = value
 
+    def save(self, ignore=False):
+        super().save(ignore=ignore)
+        IAMPolicy.invalidate_permission_index(self.project_name)
+
+    def delete(self, force=False):
+        super().delete(force=force)
+        IAMPolicy.invalidate_permission_index(self.project_name)
+
     @classmethod
     def create_default_roles(cls, project: Project):
         viewer_role = cls()
@@ -1,25 +1,208 @@
 import math
+import threading
 import uuid
 
 import arrow
 from go_defer import with_defer, defer
 
 from deli.kubernetes.controller import ModelController
-from deli.kubernetes.resources.const import REGION_LABEL, ZONE_LABEL, ATTACHED_TO_LABEL
+from deli.kubernetes.resources.const import REGION_LABEL, ATTACHED_TO_LABEL
 from deli.kubernetes.resources.model import ResourceState
+from deli.kubernetes.resources.v1alpha1.iam_service_account.model import ProjectServiceAccount
 from deli.kubernetes.resources.v1alpha1.image.model import Image
 from deli.kubernetes.resources.v1alpha1.instance.model import Instance, VMTask, VMPowerState
 from deli.kubernetes.resources.v1alpha1.network.model import NetworkPort
 from deli.kubernetes.resources.v1alpha1.region.model import Region
 from deli.kubernetes.resources.v1alpha1.volume.model import Volume, VolumeTask
 from deli.kubernetes.resources.v1alpha1.zone.model import Zone
+from deli.manager.scheduler import Scheduler, PlacementStrategy
 
 
 class InstanceController(ModelController):
-    def __init__(self, worker_count, resync_seconds, vmware, vspc_url):
+    def __init__(self, worker_count, resync_seconds, vmware, vspc_url, scheduler_strategy=PlacementStrategy.SPREAD,
+                 power_resync_seconds=60):
         super().__init__(worker_count, resync_seconds, Instance, vmware)
         self.vspc_url = vspc_url
 
+        # Created instances without a task have their power state followed by the vCenter power watcher
+        # and checked in batches per datacenter instead of one at a time in every sync, the same
+        # goes for the resources they depend on
+        self.power_resync_seconds = power_resync_seconds
+        # model key -> power state seen in vCenter or None if vCenter needs checking
+        self.power_drifted = {}
+        # model keys whose dependencies are being deleted or are gone
+        self.dependencies_drifted = set()
+        self.power_drifted_lock = threading.Lock()
+        self.power_stop = threading.Event()
+        # Set to reconcile right away instead of waiting for the next resync
+        self.power_reconcile_now = threading.Event()
+        self.power_thread = None
+        # vm id -> model key
+        self.vm_keys = {}
+        self.vm_keys_lock = threading.Lock()
+        self.informer.add_event_funcs(self.__vm_add_func, self.__vm_update_func, self.__vm_delete_func)
+
+        # Shared by all the workers so they see each other's reservations
+        self.scheduler = Scheduler(vmware, strategy=scheduler_strategy)
+        self.informer.add_event_funcs(self.__scheduler_add_func, self.__scheduler_update_func,
+                                      self.__scheduler_delete_func)
+
+    def __scheduler_add_func(self, obj):
+        self.scheduler.instance_updated(Instance(obj))
+
+    def __scheduler_update_func(self, _, obj):
+        self.scheduler.instance_updated(Instance(obj))
+
+    def __scheduler_delete_func(self, obj):
+        self.scheduler.instance_deleted(Instance(obj))
+
+    def __vm_add_func(self, obj):
+        instance = Instance(obj)
+        if instance.vm_id is not None:
+            with self.vm_keys_lock:
+                self.vm_keys[str(instance.vm_id)] = self.model_key(instance)
+
+    def __vm_update_func(self, _, obj):
+        return self.__vm_add_func(obj)
+
+    def __vm_delete_func(self, obj):
+        instance = Instance(obj)
+        if instance.vm_id is not None:
+            with self.vm_keys_lock:
+                self.vm_keys.pop(str(instance.vm_id), None)
+
+    def start(self):
+        super().start()
+        self.vmware.watch_power(self.__on_power_change, self.__on_power_synced)
+        # The watcher may have synced before we were listening
+        self.power_reconcile_now.set()
+        if self.power_thread is None:
+            self.power_thread = threading.Thread(target=self.run_power_reconcile, daemon=True)
+            self.power_thread.start()
+
+    def stop(self):
+        self.vmware.unwatch_power(self.__on_power_change, self.__on_power_synced)
+        self.power_stop.set()
+        self.power_reconcile_now.set()
+        super().stop()
+
+    def __on_power_change(self, vm_uuid, power_state):
+        with self.vm_keys_lock:
+            key = self.vm_keys.get(vm_uuid)
+        if key is None:
+            return
+        obj = self.informer.cache.get(key)
+        if obj is None:
+            return
+        if self.power_state_drifted(Instance(obj), power_state, vm_missing=power_state is None):
+            self.power_drift(key, power_state)
+
+    def __on_power_synced(self):
+        # Anything missed while the watcher was disconnected or before it knew about
+        # our instances is only caught by comparing everything
+        self.power_reconcile_now.set()
+
+    @staticmethod
+    def power_state_drifted(instance, power_state, vm_missing=False):
+        if instance.state != ResourceState.Created or instance.task is not None:
+            # Anything else is already being synced
+            return False
+        if vm_missing:
+            return True
+        if power_state == "poweredOn":
+            return instance.power_state != VMPowerState.POWERED_ON
+        if power_state == "poweredOff":
+            return instance.power_state != VMPowerState.POWERED_OFF
+        return False
+
+    def power_drift(self, key, power_state=None):
+        if self.shutdown:
+            return
+        with self.power_drifted_lock:
+            self.power_drifted[key] = power_state
+        self.workqueue.add(key)
+
+    def dependency_drift(self, key):
+        if self.shutdown:
+            return
+        with self.power_drifted_lock:
+            self.dependencies_drifted.add(key)
+        self.workqueue.add(key)
+
+    @staticmethod
+    def dependencies_drifted_for(instance, region, zones, network_ports, service_accounts, images):
+        if region.state == ResourceState.Deleting:
+            return True
+        zone = zones.get(instance.zone_name)
+        if zone is None or zone.state == ResourceState.Deleting:
+            return True
+        network_port = network_ports.get((instance.project_name, instance.network_port_id))
+        if network_port is None or network_port.state == ResourceState.Deleting:
+            return True
+        if (instance.project_name, instance.service_account_name) not in service_accounts:
+            return True
+        if instance.image_name is not None and (instance.project_name, instance.image_name) not in images:
+            return True
+        return False
+
+    def run_power_reconcile(self):
+        while self.power_stop.is_set() is False:
+            self.power_reconcile_now.wait(self.power_resync_seconds)
+            self.power_reconcile_now.clear()
+            if self.power_stop.is_set():
+                break
+            # noinspection PyBroadException
+            try:
+                self.reconcile_power_states()
+            except Exception:
+                self.logger.exception("Error reconciling instance power states")
+
+    def reconcile_power_states(self):
+        """
+        Compare the power state of every created instance with its VM and check the resources it depends on,
+        queue the ones that need a sync
+        """
+        with self.informer.cache.lock:
+            objs = list(self.informer.cache.cache.values())
+
+        instances_by_region = {}
+        for obj in objs:
+            instance = Instance(obj)
+            if self.deleted_versions.get(instance.index_member) == instance.resource_version:
+                continue
+            if instance.state != ResourceState.Created or instance.task is not None:
+                # Anything else is already being synced
+                continue
+            instances_by_region.setdefault(instance.region_name, []).append(instance)
+
+        # One list of each is much cheaper than fetching them for every instance
+        zones = dict((zone.name, zone) for zone in Zone.list())
+        network_ports = dict(((network_port.project_name, network_port.name), network_port)
+                             for network_port in NetworkPort.list_all())
+        service_accounts = set((service_account.project_name, service_account.name)
+                               for service_account in ProjectServiceAccount.list_all())
+        images = set((image.project_name, image.name) for image in Image.list_all())
+
+        with self.vmware.client_session() as vmware_client:
+            for region_name, instances in instances_by_region.items():
+                region = Region.get(region_name)
+                if region is None:
+                    continue
+                datacenter = self.vmware.get_datacenter(vmware_client, region.datacenter)
+                if datacenter is None:
+                    continue
+                vm_runtimes = self.vmware.get_vm_runtimes(vmware_client, datacenter)
+
+                for instance in instances:
+                    if self.dependencies_drifted_for(instance, region, zones, network_ports, service_accounts,
+                                                     images):
+                        self.dependency_drift(self.model_key(instance))
+                    vm_runtime = vm_runtimes.get(str(instance.vm_id))
+                    if vm_runtime is None:
+                        self.power_drift(self.model_key(instance))
+                    elif self.power_state_drifted(instance, vm_runtime['power_state']):
+                        self.power_drift(self.model_key(instance), vm_runtime['power_state'])
+
     def sync_model_handler(self, model):
         state_funcs = {
             ResourceState.ToCreate: self.to_create,
@@ -68,7 +251,9 @@ class InstanceController(ModelController):
 
                 zone: Zone = model.zone
                 if zone is None:
-                    zone = self.find_best_zone(vmware_client, datacenter, region, model)
+                    zones = Zone.list(label_selector=REGION_LABEL + '=' + str(region.name))
+                    zones = [z for z in zones if z.schedulable]
+                    zone, host = self.scheduler.schedule(vmware_client, datacenter, zones, model)
 
                     # If we cannot find a free zone error
                     if zone is None:
@@ -80,7 +265,8 @@ class InstanceController(ModelController):
                     if zone.schedulable is False:
                         model.error_message = "Zone is not currently schedulable"
                         return
-                    if self.can_zone_host(vmware_client, datacenter, zone, model) is False:
+                    zone, host = self.scheduler.schedule(vmware_client, datacenter, [zone], model)
+                    if zone is None:
                         model.error_message = "Requested zone does not have enough resources available."
                         return
 
@@ -114,6 +300,7 @@ class InstanceController(ModelController):
                                                                   datastore=datastore,
                                                                   folder=folder,
                                                                   port_group=port_group,
+                                                                  host=host,
                                                                   vcpus=model.vcpus,
                                                                   ram=model.ram)
                 model.task = VMTask.BUILDING
@@ -122,6 +309,8 @@ class InstanceController(ModelController):
             with self.vmware.client_session() as vmware_client:
                 task = self.vmware.get_task(vmware_client, model.task_kwargs['task_key'])
                 done, error = self.vmware.is_task_done(task)
+                if done is False:
+                    self.watch_task(model, model.task_kwargs['task_key'])
                 if done:
                     if error is not None:
                         model.error_message = error
@@ -183,6 +372,17 @@ class InstanceController(ModelController):
                     model.state = ResourceState.Created
 
     def created(self, model: Instance):
+        if model.task is None:
+            key = self.model_key(model)
+            with self.power_drifted_lock:
+                dependencies_drifted = key in self.dependencies_drifted
+                self.dependencies_drifted.discard(key)
+                power_drifted = key in self.power_drifted
+                power_state = self.power_drifted.pop(key, None)
+            if dependencies_drifted is False and power_drifted is False:
+                # Nothing to do, the power state and dependencies are checked in reconcile_power_states
+                return
+
         region = model.region
         # Check our region, if it is not created we should be deleted
         if region.state == ResourceState.Deleting:
@@ -210,6 +410,22 @@ class InstanceController(ModelController):
                 model.save()
                 return
 
+        if model.task is None:
+            if power_drifted is False:
+                return
+
+            # We already know what vCenter says so there is no need to ask again
+            if power_state == "poweredOn" and model.power_state != VMPowerState.POWERED_ON:
+                model.power_state = VMPowerState.POWERED_ON
+                model.save()
+                return
+            if power_state == "poweredOff" and model.power_state != VMPowerState.POWERED_OFF:
+                model.power_state = VMPowerState.POWERED_OFF
+                model.save()
+                return
+            if power_state is not None:
+                return
+
         with self.vmware.client_session() as vmware_client:
             datacenter = self.vmware.get_datacenter(vmware_client, region.datacenter)
             vmware_vm = self.vmware.get_vm(vmware_client, str(model.vm_id), datacenter)
@@ -247,6 +463,8 @@ class InstanceController(ModelController):
                 else:
                     task = self.vmware.get_task(vmware_client, model.task_kwargs['task_key'])
                     done, error = self.vmware.is_task_done(task)
+                    if done is False:
+                        self.watch_task(model, model.task_kwargs['task_key'])
                     if done:
                         if error is not None:
                             model.error_message = error
@@ -350,61 +568,3 @@ class InstanceController(ModelController):
 
     def deleted(self, model):
         model.delete(force=True)
-
-    def find_best_zone(self, vmware_client, datacenter, region, model):
-        """
-        Currently this just finds a zone that can host the instances and returns that.
-        We may want a better way to balance instances across zones in the future
-        """
-        zones = Zone.list(label_selector=REGION_LABEL + '=' + str(region.name))
-
-        for zone in zones:
-            if zone.schedulable is False:
-                continue
-            if self.can_zone_host(vmware_client, datacenter, zone, model):
-                return zone
-
-        return None
-
-    def can_zone_host(self, vmware_client, datacenter, zone, model):
-        cluster = self.vmware.get_cluster(vmware_client, zone.vm_cluster, datacenter)
-        instances = Instance.list_all(label_selector=ZONE_LABEL + '=' + str(zone.name))
-        used_resources = {}
-        for instance in instances:
-            if instance.name == model.name:
-                # Skip own instance
-                continue
-            vm = self.vmware.get_vm(vmware_client, str(instance.vm_id), datacenter)
-            if vm is None:
-                continue
-            # If the  VM doesn't have a host we should reserve it on all hosts
-            host = vm.runtime.host.name if vm.runtime.host is not None else None
-
-            if host not in used_resources:
-                used_resources[host] = (instance.vcpus, instance.ram)
-            else:
-                used_cores, used_ram = used_resources[host]
-                used_cores += instance.vcpus
-                used_ram += instance.ram
-                used_resources[host] = (used_cores, used_ram)
-
-        for host in cluster.host:
-            total_cores = math.floor(host.hardware.cpuInfo.numCpuThreads * (zone.core_provision_percent / 100))
-            total_ram = math.floor(host.hardware.memorySize * (zone.ram_provision_percent / 100))
-            if host.name in used_resources:
-                used_cores, used_ram = used_resources[host.name]
-                available_cores = total_cores - used_cores
-                available_ram = total_ram - used_ram
-            else:
-                available_cores = total_cores
-                available_ram = total_ram
-
-            if None in used_resources:
-                used_cores, used_ram = used_resources[None]
-                available_cores = available_cores - used_cores
-                available_ram = available_ram - used_ram
-
-            if available_cores >= model.vcpus and available_ram >= model.ram:
-                return True
-
-        return False
@@ -1,11 +1,11 @@
-from threading import RLock
-
 from go_defer import with_defer, defer
+from redis import RedisError
 
 from deli.kubernetes.controller import ModelController
 from deli.kubernetes.resources.const import NETWORK_LABEL, NETWORK_PORT_LABEL
 from deli.kubernetes.resources.model import ResourceState
 from deli.kubernetes.resources.v1alpha1.instance.model import Instance
+from deli.kubernetes.resources.v1alpha1.network.ipam import NetworkIPAM
 from deli.kubernetes.resources.v1alpha1.network.model import Network, NetworkPort
 
 
@@ -71,6 +71,7 @@ class NetworkController(ModelController):
         model.save()
 
     def deleted(self, model):
+        NetworkIPAM.delete(model)
         model.delete(force=True)
 
 
@@ -78,7 +79,7 @@ class NetworkPortController(ModelController):
 
     def __init__(self, worker_count, resync_seconds):
         super().__init__(worker_count, resync_seconds, NetworkPort, None)
-        self.lock = RLock()
+        self.ipam = NetworkIPAM()
 
     def sync_model_handler(self, model):
         state_funcs = {
@@ -106,40 +107,44 @@ class NetworkPortController(ModelController):
             model.delete()
             return
 
-        defer(model.save)
-
-        usable_addresses = []
-        start_host = network.pool_start
-        end_host = network.pool_end
-        for host in network.cidr:
+        lock = self.ipam.lock(network.name)
+        lock.acquire()
+        defer(lock.release)
 
-            if host == network.gateway:
-                # Skip gateway
-                continue
-
-            if host in network.dns_servers:
-                # Skip dns servers if in range
-                continue
+        ip_address = model.ip_address
+        if ip_address is None:
+            ip_address = self.ipam.allocate(network, lambda: self.list_network_ports(network))
+            if ip_address is None:
+                model.error_message = "No usable ip addresses found."
+                model.save()
+                return
+        # Otherwise an earlier save stored the address but not the state so keep using it
 
-            if start_host <= host <= end_host:
-                usable_addresses.append(host)
+        model.ip_address = ip_address
+        model.state = ResourceState.Created
+        # We need to save before the lock is released. If the save fails the address stays
+        # pending instead of being released since the port may already have it stored,
+        # the next sync reuses it or the pending reservation runs out.
+        model.save()
 
-        self.lock.acquire()
-        defer(self.lock.release)
+    @staticmethod
+    def list_network_ports(network: Network):
+        return NetworkPort.list_all(label_selector=NETWORK_LABEL + "=" + str(network.name))
 
-        network_ports = NetworkPort.list_all(label_selector=NETWORK_LABEL + "=" + str(network.name))
-        for network_port in network_ports:
-            if network_port.ip_address is not None:
-                usable_addresses.remove(network_port.ip_address)
+    def rebuild_indexes(self, raw_items):
+        super().rebuild_indexes(raw_items)
 
-        if len(usable_addresses) == 0:
-            model.error_message = "No usable ip addresses found."
-            return
+        # Rebuild the ip bitmaps from the ports we know about to fix any drift
+        network_ports = {}
+        for raw in raw_items:
+            network_port = NetworkPort(raw)
+            network_ports.setdefault(network_port.network_name, []).append(network_port)
 
-        model.ip_address = usable_addresses[0]
-        model.state = ResourceState.Created
-        # We need to save before the lock is released
-        model.save()
+        for network in Network.list():
+            try:
+                self.ipam.rebuild(network, network_ports.get(network.name, []))
+            except RedisError:
+                self.logger.exception("Error rebuilding ip bitmap for network " + str(network.name))
 
     def created(self, model: NetworkPort):
         # Check our network, if it is gone we should be deleted
@@ -163,3 +168,7 @@ class NetworkPortController(ModelController):
 
     def deleted(self, model):
         model.delete(force=True)
+
+        network = model.network
+        if network is not None and model.ip_address is not None:
+            self.ipam.release(network, model.ip_address)
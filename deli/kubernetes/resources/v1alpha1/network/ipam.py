@@ -0,0 +1,120 @@
+import ipaddress
+import threading
+import time
+
+from go_defer import with_defer, defer
+
+from deli.cache import cache_client
+from deli.kubernetes.resources.v1alpha1.network.model import Network
+
+
+class NetworkIPAM(object):
+    """
+    Hands out addresses from a network's pool using a bitmap in redis.
+
+    Bit n is the n-th address from the start of the pool. Allocations for a network
+    are serialized with a lock per network so ports on different networks don't wait
+    on each other, and the bitmap can be rebuilt from the ports at any time.
+    """
+
+    def __init__(self, pending_seconds=300):
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+        # Addresses we handed out that might not show up in port listings yet
+        # network name -> {position: time allocated}
+        self.pending_seconds = pending_seconds
+        self.pending = {}
+
+    @staticmethod
+    def key(network_name):
+        return "network_ipam_" + str(network_name)
+
+    @staticmethod
+    def delete(network: Network):
+        cache_client.delete(NetworkIPAM.key(network.name))
+
+    def lock(self, network_name):
+        with self.locks_lock:
+            lock = self.locks.get(network_name)
+            if lock is None:
+                lock = threading.RLock()
+                self.locks[network_name] = lock
+            return lock
+
+    @staticmethod
+    def size(network: Network):
+        return int(network.pool_end) - int(network.pool_start) + 1
+
+    @staticmethod
+    def position(network: Network, ip_address):
+        position = int(ip_address) - int(network.pool_start)
+        if 0 <= position < NetworkIPAM.size(network):
+            return position
+        return None
+
+    def reserved_positions(self, network: Network):
+        positions = set()
+        for ip_address in [network.gateway] + list(network.dns_servers):
+            position = self.position(network, ip_address)
+            if position is not None:
+                positions.add(position)
+
+        now = time.monotonic()
+        pending = self.pending.get(network.name, {})
+        for position, allocated_at in list(pending.items()):
+            if allocated_at + self.pending_seconds <= now:
+                del pending[position]
+            else:
+                positions.add(position)
+
+        return positions
+
+    @with_defer
+    def rebuild(self, network: Network, network_ports):
+        lock = self.lock(network.name)
+        lock.acquire()
+        defer(lock.release)
+
+        positions = self.reserved_positions(network)
+        for network_port in network_ports:
+            if network_port.ip_address is None:
+                continue
+            position = self.position(network, network_port.ip_address)
+            if position is not None:
+                positions.add(position)
+
+        cache_client.bitmap_rebuild(self.key(network.name), self.size(network), positions)
+
+    @with_defer
+    def allocate(self, network: Network, network_ports_func):
+        """
+        Returns a free address from the network's pool or None if it is full
+
+        network_ports_func lists the network's ports in case the bitmap needs to be built
+        """
+        lock = self.lock(network.name)
+        lock.acquire()
+        defer(lock.release)
+
+        position = cache_client.bitmap_allocate(self.key(network.name), self.size(network))
+        if position is None:
+            self.rebuild(network, network_ports_func())
+            position = cache_client.bitmap_allocate(self.key(network.name), self.size(network))
+        if position is None or position < 0:
+            return None
+
+        self.pending.setdefault(network.name, {})[position] = time.monotonic()
+        return ipaddress.IPv4Address(int(network.pool_start) + position)
+
+    @with_defer
+    def release(self, network: Network, ip_address):
+        lock = self.lock(network.name)
+        lock.acquire()
+        defer(lock.release)
+
+        position = self.position(network, ip_address)
+        if position is None:
+            return
+        self.pending.get(network.name, {}).pop(position, None)
+        cache_client.bitmap_release(self.key(network.name), position)
@@ -1,14 +1,209 @@
+import threading
+from functools import partial
+
+from go_defer import with_defer, defer
+from k8scontroller.informer.informer import Informer
+from kubernetes import client
+from redis import RedisError
+
 from deli.kubernetes.controller import ModelController
 from deli.kubernetes.resources.model import ResourceState
 from deli.kubernetes.resources.project import Project
 from deli.kubernetes.resources.v1alpha1.instance.model import Instance
 from deli.kubernetes.resources.v1alpha1.project_quota.model import ProjectQuota
-from deli.kubernetes.resources.v1alpha1.volume.model import Volume
+from deli.kubernetes.resources.v1alpha1.volume.model import Volume, VolumeTask
+from deli.kubernetes.store.store import informer_key
 
 
 class ProjectQuotaController(ModelController):
-    def __init__(self, worker_count, resync_seconds):
-        super().__init__(worker_count, resync_seconds, ProjectQuota, None)
+    def __init__(self, worker_count, resync_seconds, index_resync_seconds=600):
+        super().__init__(worker_count, resync_seconds, ProjectQuota, None, index_resync_seconds=index_resync_seconds)
+
+        # Usage is kept up to date from instance and volume events instead of listing
+        # everything in the project on every sync
+        # project name -> [vcpu, ram, disk]
+        self.usage = {}
+        # (kind, cache key) -> (project name, vcpu, ram, disk)
+        self.usage_items = {}
+        # (kind, cache key) -> resource version, the informers keep deleted objects until they relist
+        self.usage_deleted = {}
+        self.usage_lock = threading.Lock()
+        self.usage_counted = False
+        # Projects whose usage has been stored for the api to reserve against
+        self.usage_stored = set()
+        # (kind, cache key) -> the last quota reservation recorded on the object
+        self.usage_reservations = {}
+        # project name -> reservations that are counted and can be released with the next stored usage
+        self.usage_releases = {}
+
+        self.usage_informers = []
+        crd_api = client.CustomObjectsApi()
+        for model_cls in [Instance, Volume]:
+            list_args, list_kwargs = model_cls.list_sig()
+            # The relist is a safety net for missed events so it doesn't need to happen often
+            informer = Informer(model_cls.__name__ + "Usage", index_resync_seconds,
+                                crd_api.list_cluster_custom_object, *list_args, **list_kwargs)
+            informer.add_event_funcs(partial(self.__usage_add_func, model_cls),
+                                     partial(self.__usage_update_func, model_cls),
+                                     partial(self.__usage_delete_func, model_cls))
+            self.usage_informers.append((model_cls, informer))
+
+    def start(self):
+        for _, informer in self.usage_informers:
+            informer.start()
+        super().start()
+
+    def stop(self):
+        for _, informer in self.usage_informers:
+            informer.stop()
+        super().stop()
+
+    @staticmethod
+    def usage_of(model):
+        if isinstance(model, Instance):
+            return model.project_name, model.vcpus, model.ram, model.disk
+        size = model.size
+        if model.task == VolumeTask.GROWING:
+            # Count the size it is growing to so the grow's reservation can be released right away
+            size = max(size, model.task_kwargs.get('size', 0))
+        return model.project_name, 0, 0, size
+
+    def _add_usage(self, project_name, vcpu, ram, disk, sign=1):
+        used = self.usage.setdefault(project_name, [0, 0, 0])
+        used[0] += sign * vcpu
+        used[1] += sign * ram
+        used[2] += sign * disk
+
+    def _set_usage_item(self, item_key, item_usage):
+        """
+        Returns the projects whose usage changed
+        """
+        old_usage = self.usage_items.pop(item_key, None)
+        if item_usage is not None:
+            self.usage_items[item_key] = item_usage
+        if old_usage == item_usage:
+            return set()
+
+        changed = set()
+        if old_usage is not None:
+            self._add_usage(*old_usage, sign=-1)
+            changed.add(old_usage[0])
+        if item_usage is not None:
+            self._add_usage(*item_usage)
+            changed.add(item_usage[0])
+        return changed
+
+    def _store_usage(self, project_name):
+        # Let the reservations the api made be checked against the new usage
+        # and drop the ones that are now counted
+        release_ids = self.usage_releases.pop(project_name, set())
+        try:
+            ProjectQuota.set_usage(project_name, *self.usage.get(project_name, [0, 0, 0]),
+                                   release_ids=list(release_ids))
+            self.usage_stored.add(project_name)
+        except RedisError:
+            self.usage_releases.setdefault(project_name, set()).update(release_ids)
+            self.logger.exception("Error storing quota usage for project " + project_name)
+
+    def _usage_changed(self, project_names):
+        for project_name in project_names:
+            if self.usage_ready:
+                self._store_usage(project_name)
+
+            # The quota is named after its project
+            if self.shutdown is False:
+                self.workqueue.add(project_name)
+
+    @with_defer
+    def __usage_add_func(self, model_cls, obj):
+        item_key = (model_cls.__name__, informer_key(obj))
+        self.usage_lock.acquire()
+        defer(self.usage_lock.release)
+        self.usage_deleted.pop(item_key, None)
+        model = model_cls(obj)
+        item_usage = self.usage_of(model)
+        changed = self._set_usage_item(item_key, item_usage)
+
+        # The object is counted now so whatever it reserved can go, even if the totals didn't change.
+        # Until usage is ready to be stored this waits for the first store.
+        reservation_id = model.quota_reservation
+        if reservation_id is not None and self.usage_reservations.get(item_key) != reservation_id:
+            self.usage_reservations[item_key] = reservation_id
+            self.usage_releases.setdefault(item_usage[0], set()).add(reservation_id)
+            changed.add(item_usage[0])
+
+        self._usage_changed(changed)
+
+    def __usage_update_func(self, model_cls, _, obj):
+        return self.__usage_add_func(model_cls, obj)
+
+    @with_defer
+    def __usage_delete_func(self, model_cls, obj):
+        item_key = (model_cls.__name__, informer_key(obj))
+        self.usage_lock.acquire()
+        defer(self.usage_lock.release)
+        self.usage_deleted[item_key] = obj['metadata']['resourceVersion']
+        self.usage_reservations.pop(item_key, None)
+        changed = self._set_usage_item(item_key, None)
+        self._usage_changed(changed)
+
+    @property
+    def usage_ready(self):
+        if self.usage_counted is False:
+            for _, informer in self.usage_informers:
+                if informer.lister is None or informer.lister.first_run or informer.queue.unfinished_tasks > 0:
+                    return False
+            # Every object from the first list has been counted
+            self.usage_counted = True
+        return True
+
+    def reconcile_index(self):
+        super().reconcile_index()
+        self.reconcile_usage()
+
+    @with_defer
+    def reconcile_usage(self):
+        """
+        Recount usage from everything the informers have to fix any drift from missed events
+        """
+        if self.usage_ready is False:
+            return
+
+        items = {}
+        for model_cls, informer in self.usage_informers:
+            with informer.cache.lock:
+                objs = list(informer.cache.cache.values())
+            for obj in objs:
+                items[(model_cls.__name__, informer_key(obj))] = (model_cls, obj)
+
+        self.usage_lock.acquire()
+        defer(self.usage_lock.release)
+
+        # Anything deleted that the informers still have will be dropped on their next relist
+        self.usage_deleted = dict([(item_key, resource_version)
+                                   for item_key, resource_version in self.usage_deleted.items()
+                                   if item_key in items])
+
+        usage_items = {}
+        for item_key, (model_cls, obj) in items.items():
+            if self.usage_deleted.get(item_key) == obj['metadata']['resourceVersion']:
+                continue
+            usage_items[item_key] = self.usage_of(model_cls(obj))
+
+        old_usage = self.usage
+        self.usage = {}
+        self.usage_items = usage_items
+        self.usage_reservations = dict([(item_key, reservation_id)
+                                        for item_key, reservation_id in self.usage_reservations.items()
+                                        if item_key in usage_items])
+        for item_usage in usage_items.values():
+            self._add_usage(*item_usage)
+
+        changed = set()
+        for project_name in set(old_usage.keys()) | set(self.usage.keys()):
+            if old_usage.get(project_name, [0, 0, 0]) != self.usage.get(project_name, [0, 0, 0]):
+                changed.add(project_name)
+        self._usage_changed(changed)
 
     def sync_model_handler(self, model):
         state_funcs = {
@@ -43,21 +238,25 @@ class ProjectQuotaController(ModelController):
             model.delete()
             return
 
-        instances = Instance.list(project)
-        for instance in instances:
-            used_vcpu += instance.vcpus
-            used_ram += instance.ram
-            used_disk += instance.disk
-
-        volumes = Volume.list(project)
-        for volume in volumes:
-            used_disk += volume.size
+        if self.usage_ready:
+            with self.usage_lock:
+                used_vcpu, used_ram, used_disk = self.usage.get(project.name, [0, 0, 0])
+                if project.name not in self.usage_stored:
+                    self._store_usage(project.name)
+        else:
+            # Usage hasn't been counted yet so count it the slow way
+            for model_cls in [Instance, Volume]:
+                for item in model_cls.list(project):
+                    _, vcpu, ram, disk = self.usage_of(item)
+                    used_vcpu += vcpu
+                    used_ram += ram
+                    used_disk += disk
 
         if used_vcpu != model.used_vcpu or used_ram != model.used_ram or used_disk != model.used_disk:
             model.used_vcpu = used_vcpu
             model.used_ram = used_ram
             model.used_disk = used_disk
-            model.save(ignore=True)
+            model.save_with_retry()
 
     def to_delete(self, model):
         model.state = ResourceState.Deleting
@@ -69,3 +268,4 @@ class ProjectQuotaController(ModelController):
 
     def deleted(self, model: ProjectQuota):
         model.delete(force=True)
+        ProjectQuota.delete_usage(model.name)
@@ -1,7 +1,13 @@
+import uuid
+
+from deli.cache import cache_client
 from deli.kubernetes.resources.model import SystemResourceModel
 
 
 class ProjectQuota(SystemResourceModel):
+    # Reservations are dropped once the manager counts the object they are recorded on,
+    # this is only how long to hold them if that never happens
+    reservation_seconds = 600
 
     def __init__(self, raw=None):
         super().__init__(raw)
@@ -64,3 +70,64 @@ class ProjectQuota(SystemResourceModel):
     @used_disk.setter
     def used_disk(self, value):
         self._raw['status']['usedDisk'] = value
+
+    @staticmethod
+    def usage_key(project_name):
+        return "quota_usage_" + str(project_name)
+
+    @staticmethod
+    def reservations_key(project_name):
+        return "quota_reservations_" + str(project_name)
+
+    @staticmethod
+    def reservation_expires_key(project_name):
+        return "quota_reservation_expires_" + str(project_name)
+
+    @staticmethod
+    def new_reservation_id():
+        # Unique per request so requests for the same name can't release each other's reservations
+        return str(uuid.uuid4())
+
+    def reserve(self, reservation_id, vcpu=0, ram=0, disk=0):
+        """
+        Atomically check the requested amounts against the quota and hold them until the manager counts them
+
+        Returns None if they were reserved otherwise the name of the resource that is over quota and how
+        much of it is used
+        """
+        project_name = self.name
+        index, used = cache_client.quota_reserve(self.usage_key(project_name), self.reservations_key(project_name),
+                                                 self.reservation_expires_key(project_name), reservation_id,
+                                                 self.reservation_seconds,
+                                                 [self.used_vcpu, self.used_ram, self.used_disk],
+                                                 [self.vcpu, self.ram, self.disk],
+                                                 [vcpu, ram, disk])
+        if index == 0:
+            return None
+        return ["VCPU", "Ram", "Disk"][index - 1], used
+
+    @classmethod
+    def release(cls, project_name, *reservation_ids):
+        if len(reservation_ids) == 0:
+            return
+        pipe = cache_client.pipeline()
+        pipe.hdel(cls.reservations_key(project_name), *reservation_ids)
+        pipe.zrem(cls.reservation_expires_key(project_name), *reservation_ids)
+        pipe.execute()
+
+    @classmethod
+    def set_usage(cls, project_name, vcpu, ram, disk, release_ids=()):
+        """
+        Store the counted usage for reservations to check against and drop the reservations it now includes
+        """
+        pipe = cache_client.pipeline()
+        pipe.hmset(cls.usage_key(project_name), {'vcpu': vcpu, 'ram': ram, 'disk': disk})
+        if len(release_ids) > 0:
+            pipe.hdel(cls.reservations_key(project_name), *release_ids)
+            pipe.zrem(cls.reservation_expires_key(project_name), *release_ids)
+        pipe.execute()
+
+    @classmethod
+    def delete_usage(cls, project_name):
+        cache_client.delete_many(cls.usage_key(project_name), cls.reservations_key(project_name),
+                                 cls.reservation_expires_key(project_name))
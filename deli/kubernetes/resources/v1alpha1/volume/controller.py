@@ -31,18 +31,43 @@ class VolumeController(ModelController):
         model.state = ResourceState.Creating
         model.save()
 
+    def run_task(self, vmware_client, model, start_task, ignore_not_found=False):
+        """
+        Start the vCenter task for the model if it hasn't been started yet otherwise check on it
+
+        Returns if the task is done, any error it had and the task itself
+        """
+        if 'task_key' not in model.task_kwargs:
+            task = start_task()
+            model.task_kwargs = {**model.task_kwargs, 'task_key': task.info.key}
+            return False, None, task
+
+        task = self.vmware.get_task(vmware_client, model.task_kwargs['task_key'])
+        done, error = self.vmware.is_task_done(task, ignore_not_found=ignore_not_found)
+        if done is False:
+            self.watch_task(model, model.task_kwargs['task_key'])
+        return done, error, task
+
     @with_defer
     def creating(self, model: Volume):
-        defer(model.save)
+        needs_save = False
+
+        def save():
+            if needs_save:
+                model.save()
+
+        defer(save)
 
         region: Region = model.region
         if region.schedulable is False:
             model.error_message = "Region is not currently schedulable"
+            needs_save = True
             return
 
         zone: Zone = model.zone
         if zone.schedulable is False:
             model.error_message = "Zone is not currently schedulable"
+            needs_save = True
             return
 
         with self.vmware.client_session() as vmware_client:
@@ -52,27 +77,26 @@ class VolumeController(ModelController):
             if cloned_from is None:
                 if model.cloned_from_name:
                     model.error_message = "Could not clone volume, parent diapered."
+                    needs_save = True
                     return
-                model.backing_id = self.vmware.create_disk(vmware_client, model.name, model.size, datastore)
-                model.task = None
-                model.state = ResourceState.Created
-                return
+
+                def start_task():
+                    return self.vmware.create_disk(vmware_client, model.name, model.size, datastore)
             else:
-                if 'task_key' not in model.task_kwargs:
-                    task = self.vmware.clone_disk(vmware_client, model.name, str(cloned_from.backing_id),
-                                                  datastore)
-                    model.task_kwargs = {"task_key": task.info.key}
-                else:
-                    task = self.vmware.get_task(vmware_client, model.task_kwargs['task_key'])
-                    done, error = self.vmware.is_task_done(task)
-                    if done:
-                        if error is not None:
-                            model.error_message = error
-                            return
+                def start_task():
+                    return self.vmware.clone_disk(vmware_client, model.name, str(cloned_from.backing_id), datastore)
 
-                        model.backing_id = task.info.result.config.name.name
-                        model.task = None
-                        model.state = ResourceState.Created
+            started = 'task_key' not in model.task_kwargs
+            done, error, task = self.run_task(vmware_client, model, start_task)
+            needs_save = started or done
+            if done:
+                if error is not None:
+                    model.error_message = error
+                    return
+
+                model.backing_id = task.info.result.config.name.name
+                model.task = None
+                model.state = ResourceState.Created
 
     @with_defer
     def created(self, model: Volume):
@@ -82,50 +106,55 @@ class VolumeController(ModelController):
 
         def save():
             if needs_save:
-                model.save(ignore=True)
+                model.save_with_retry()
 
         defer(save)
 
         if model.task is not None:
-            needs_save = True
             with self.vmware.client_session() as vmware_client:
                 datacenter = self.vmware.get_datacenter(vmware_client, model.region.datacenter)
                 datastore = self.vmware.get_datastore(vmware_client, zone.vm_datastore, datacenter)
+                started = 'task_key' not in model.task_kwargs
                 if model.task == VolumeTask.ATTACHING:
-                    instance = Instance.get(model.project, model.task_kwargs['to'])
-                    if instance is None:
-                        # Attaching to instance doesn't exist
-                        model.task = None
-                        return
-                    if instance.state in [ResourceState.ToDelete, ResourceState.Deleting, ResourceState.Deleted,
-                                          ResourceState.Error]:
-                        # Attaching to instance is deleting or errored.
-                        model.task = None
-                        return
-                    vm = self.vmware.get_vm(vmware_client, str(instance.name), datacenter)
-                    if vm is None:
-                        # VM doesn't exist
-                        model.task = None
-                        return
-                    self.vmware.attach_disk(vmware_client, model.backing_id, datastore, vm)
-                    model.attached_to = instance
-                    model.task = None
+                    vm = None
+                    if started:
+                        vm = self.get_attach_vm(vmware_client, datacenter, model)
+                        if vm is None:
+                            model.task = None
+                            needs_save = True
+                            return
+
+                    done, error, _ = self.run_task(
+                        vmware_client, model,
+                        lambda: self.vmware.attach_disk(vmware_client, model.backing_id, datastore, vm))
+                    if done and error is None:
+                        model.attached_to = Instance.get(model.project, model.task_kwargs['to'])
                 elif model.task == VolumeTask.DETACHING:
-                    self.detach_disk(vmware_client, datacenter, model)
-                    model.attached_to = None
-                    model.task = None
+                    done, error = self.detach_disk(vmware_client, datacenter, model)
                 elif model.task == VolumeTask.GROWING:
-                    self.vmware.grow_disk(vmware_client, model.backing_id, model.task_kwargs['size'], datastore)
-                    model.size = model.task_kwargs['size']
-                    model.task = None
+                    done, error, _ = self.run_task(
+                        vmware_client, model,
+                        lambda: self.vmware.grow_disk(vmware_client, model.backing_id, model.task_kwargs['size'],
+                                                      datastore))
+                    if done and error is None:
+                        model.size = model.task_kwargs['size']
                 elif model.task == VolumeTask.CLONING:
                     # Check new volume
                     # If it's none, created or errored then we are done cloning
+                    started = False
+                    done, error = False, None
                     new_volume = Volume.get(model.project, model.task_kwargs['volume_name'])
                     if new_volume is None or new_volume.state in [ResourceState.Created, ResourceState.Error]:
-                        model.task = None
+                        done = True
+
+                if done:
+                    if error is not None:
+                        self.logger.error("Volume %s/%s task %s failed: %s" % (model.project_name, model.name,
+                                                                               model.task.value, error))
+                    model.task = None
+                needs_save = started or done
 
-        if zone.state == ResourceState.Deleting:
+        if zone.state == ResourceState.Deleting and model.task is None:
             model.state = ResourceState.ToDelete
             needs_save = True
 
@@ -139,30 +168,104 @@ class VolumeController(ModelController):
                 model.cloned_from = None
                 needs_save = True
 
+    def get_attach_vm(self, vmware_client, datacenter, model):
+        instance = Instance.get(model.project, model.task_kwargs['to'])
+        if instance is None:
+            # Attaching to instance doesn't exist
+            return None
+        if instance.state in [ResourceState.ToDelete, ResourceState.Deleting, ResourceState.Deleted,
+                              ResourceState.Error]:
+            # Attaching to instance is deleting or errored.
+            return None
+        # None if the VM doesn't exist
+        return self.vmware.get_vm(vmware_client, str(instance.name), datacenter)
+
     def detach_disk(self, vmware_client, datacenter, model):
-        vm = self.vmware.get_vm(vmware_client, str(model.attached_to_name), datacenter)
-        if vm is not None:
-            self.vmware.detach_disk(vmware_client, model.backing_id, vm)
-        model.attached_to = None
+        """
+        Start or check on detaching the volume, returns if it is done and any error
+        """
+        if 'task_key' not in model.task_kwargs:
+            vm = self.vmware.get_vm(vmware_client, str(model.attached_to_name), datacenter)
+            if vm is None:
+                model.attached_to = None
+                return True, None
+        else:
+            vm = None
+
+        # Ignore not found errors if the disk is already detached
+        done, error, _ = self.run_task(vmware_client, model,
+                                       lambda: self.vmware.detach_disk(vmware_client, model.backing_id, vm),
+                                       ignore_not_found=True)
+        if done and error is None:
+            model.attached_to = None
+        return done, error
 
+    @with_defer
     def to_delete(self, model):
+        needs_save = False
+
+        def save():
+            if needs_save:
+                model.save()
+
+        defer(save)
+
         if model.attached_to is not None:
             # If we are still attached so we need to detach before deleting
+            if model.task != VolumeTask.DETACHING:
+                # Anything else the volume was doing doesn't matter anymore
+                model.task = VolumeTask.DETACHING
+            started = 'task_key' not in model.task_kwargs
             with self.vmware.client_session() as vmware_client:
                 datacenter = self.vmware.get_datacenter(vmware_client, model.region.datacenter)
-                self.detach_disk(vmware_client, datacenter, model)
+                done, error = self.detach_disk(vmware_client, datacenter, model)
+            if done is False:
+                needs_save = started
+                return
+            if error is not None:
+                # Try again on the next sync
+                self.logger.error("Volume %s/%s could not be detached: %s" % (model.project_name, model.name, error))
+                model.task_kwargs = {}
+                needs_save = True
+                return
+
+        model.task = None
         model.state = ResourceState.Deleting
-        model.save()
+        needs_save = True
 
     @with_defer
     def deleting(self, model: Volume):
-        defer(model.save)
+        needs_save = False
+
+        def save():
+            if needs_save:
+                model.save()
+
+        defer(save)
+
         if model.backing_id is not None:
             with self.vmware.client_session() as vmware_client:
                 datacenter = self.vmware.get_datacenter(vmware_client, model.region.datacenter)
                 datastore = self.vmware.get_datastore(vmware_client, model.zone.vm_datastore, datacenter)
-                self.vmware.delete_disk(vmware_client, model.backing_id, datastore)
+                started = 'task_key' not in model.task_kwargs
+                done, error, _ = self.run_task(
+                    vmware_client, model,
+                    lambda: self.vmware.delete_disk(vmware_client, model.backing_id, datastore),
+                    ignore_not_found=True)
+                if done is False:
+                    needs_save = started
+                    return
+                if error is not None:
+                    # Try again on the next sync
+                    self.logger.error("Volume %s/%s could not be deleted: %s" % (model.project_name, model.name,
+                                                                                 error))
+                    model.task_kwargs = {}
+                    needs_save = True
+                    return
+
+        model.task = None
         model.state = ResourceState.Deleted
+        needs_save = True
 
     def deleted(self, model):
         model.delete(force=True)
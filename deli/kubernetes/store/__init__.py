@@ -0,0 +1,3 @@
+from deli.kubernetes.store.store import ResourceStore
+
+resource_store = ResourceStore()
@@ -0,0 +1,192 @@
+import copy
+import logging
+from threading import RLock
+
+from go_defer import with_defer, defer
+from k8scontroller.informer.informer import Informer
+from kubernetes import client
+
+
+def informer_key(raw):
+    """
+    The key informers use for the object in their cache
+    """
+    metadata = raw['metadata']
+    return _informer_key(metadata.get('namespace'), metadata['name'])
+
+
+def _informer_key(namespace, name):
+    # Must match the keys the informer uses for its cache
+    if namespace is None or namespace == "":
+        return name
+    return namespace + "/" + name
+
+
+class ResourceStore(object):
+    """
+    An in-memory copy of custom resources kept up to date by one informer per kind.
+
+    Reads are only served once the informer has finished its first list, until then
+    (and for anything the store can't answer) callers should go to the Kubernetes API.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
+        self.informers = {}
+        self.lock = RLock()
+
+    @with_defer
+    def start(self, model_cls, resync_seconds):
+        self.lock.acquire()
+        defer(self.lock.release)
+
+        if model_cls.name_plural() in self.informers:
+            return
+
+        # We use this to query all namespaces
+        crd_api = client.CustomObjectsApi()
+        list_args, list_kwargs = model_cls.list_sig()
+        informer = Informer(model_cls.kind(), resync_seconds, crd_api.list_cluster_custom_object, *list_args,
+                            **list_kwargs)
+        informer.add_event_funcs(None, None, lambda obj: self._on_delete(informer, obj))
+        informer.start()
+
+        self.informers[model_cls.name_plural()] = informer
+
+    @with_defer
+    def stop(self):
+        self.lock.acquire()
+        defer(self.lock.release)
+
+        for informer in self.informers.values():
+            informer.stop()
+        self.informers = {}
+
+    def _informer(self, model_cls):
+        informer = self.informers.get(model_cls.name_plural())
+        if informer is None:
+            return None
+        if informer.lister is None or informer.lister.first_run:
+            # The initial list hasn't finished so we can't trust the cache yet
+            return None
+        return informer
+
+    @staticmethod
+    def _newer(raw, current):
+        if current is None:
+            return True
+        new_version = raw['metadata'].get('resourceVersion', '')
+        current_version = current['metadata'].get('resourceVersion', '')
+        if new_version.isdigit() and current_version.isdigit():
+            return int(new_version) > int(current_version)
+        return new_version != current_version
+
+    def _on_delete(self, informer, obj):
+        metadata = obj['metadata']
+        key = informer_key(obj)
+        current = informer.cache.get(key)
+        # Only drop the object if it hasn't been recreated since the delete event
+        if current is not None and current['metadata'].get('resourceVersion') == metadata.get('resourceVersion'):
+            informer.cache.delete(key)
+
+    def is_synced(self, model_cls):
+        return self._informer(model_cls) is not None
+
+    def get(self, model_cls, name, namespace=None):
+        informer = self._informer(model_cls)
+        if informer is None:
+            return None
+
+        raw = informer.cache.get(_informer_key(namespace, name))
+        if raw is None:
+            return None
+        return copy.deepcopy(raw)
+
+    def list(self, model_cls, namespace=None, label_selector=None, **kwargs):
+        """
+        Returns None when the request can't be answered from memory
+        """
+        if len(kwargs) > 0:
+            return None
+
+        informer = self._informer(model_cls)
+        if informer is None:
+            return None
+
+        requirements = self._parse_label_selector(label_selector)
+        if requirements is None:
+            return None
+
+        with informer.cache.lock:
+            objs = list(informer.cache.cache.values())
+
+        items = []
+        for obj in objs:
+            metadata = obj['metadata']
+            if namespace is not None and metadata.get('namespace') != namespace:
+                continue
+            if self._match_labels(metadata.get('labels') or {}, requirements) is False:
+                continue
+            items.append(copy.deepcopy(obj))
+
+        items.sort(key=lambda item: (item['metadata'].get('namespace') or '', item['metadata']['name']))
+        return items
+
+    def update(self, model_cls, raw):
+        """
+        Record an object we just wrote so reads after a write don't wait for the watch
+        """
+        informer = self.informers.get(model_cls.name_plural())
+        if informer is None:
+            return
+
+        key = informer_key(raw)
+        with informer.cache.lock:
+            if self._newer(raw, informer.cache.cache.get(key)):
+                informer.cache.cache[key] = copy.deepcopy(raw)
+
+    @staticmethod
+    def _parse_label_selector(label_selector):
+        requirements = []
+        if label_selector is None:
+            return requirements
+
+        for requirement in label_selector.split(","):
+            requirement = requirement.strip()
+            if requirement == "":
+                continue
+            if "(" in requirement or " in " in requirement or " notin " in requirement:
+                # Set based selectors are left to the API server
+                return None
+            if "!=" in requirement:
+                key, value = requirement.split("!=", 1)
+                requirements.append(("!=", key.strip(), value.strip()))
+            elif "==" in requirement:
+                key, value = requirement.split("==", 1)
+                requirements.append(("=", key.strip(), value.strip()))
+            elif "=" in requirement:
+                key, value = requirement.split("=", 1)
+                requirements.append(("=", key.strip(), value.strip()))
+            elif requirement.startswith("!"):
+                requirements.append(("!", requirement[1:].strip(), None))
+            else:
+                requirements.append(("exists", requirement, None))
+
+        return requirements
+
+    @staticmethod
+    def _match_labels(labels, requirements):
+        for operator, key, value in requirements:
+            if operator == "=":
+                if labels.get(key) != value:
+                    return False
+            elif operator == "!=":
+                if key in labels and labels[key] == value:
+                    return False
+            elif operator == "!":
+                if key in labels:
+                    return False
+            elif operator == "exists":
+                if key not in labels:
+                    return False
+        return True
@@ -6,7 +6,7 @@ import json
 import os
 import time
 import uuid
-from threading import RLock
+from threading import RLock, Event, Thread
 
 import arrow
 import urllib3
@@ -43,7 +43,9 @@ from deli.kubernetes.resources.v1alpha1.volume.controller import VolumeControlle
 from deli.kubernetes.resources.v1alpha1.volume.model import Volume
 from deli.kubernetes.resources.v1alpha1.zone.controller import ZoneController
 from deli.kubernetes.resources.v1alpha1.zone.model import Zone
+from deli.manager.scheduler import PlacementStrategy
 from deli.manager.vmware import VMWare
+from deli.metrics import metrics
 
 
 class EnvDefault(argparse.Action):
@@ -68,10 +70,13 @@ class RunManager(Daemon):
     def __init__(self):
         super().__init__('run', 'Run the Sandwich Cloud Manager')
         self.menu_url = None
+        self.scheduler_strategy = None
         self.vmware = None
         self.leader_elector = None
         self.controllers = []
         self.lock = RLock()
+        self.metrics_interval = 300
+        self.metrics_stop = Event()
 
     def setup_arguments(self, parser):
         load_dotenv(os.path.join(os.getcwd(), '.env'))
@@ -91,6 +96,17 @@ class RunManager(Daemon):
         required_group.add_argument("--vcenter-password", action=EnvDefault, envvar="VCENTER_PASSWORD", required=True,
                                     help="The password to use to connect to VCenter")
 
+        parser.add_argument("--vcenter-pool-size", action=EnvDefault, envvar="VCENTER_POOL_SIZE", required=False,
+                            default=10, type=int, help="Max number of vCenter sessions to keep open")
+        parser.add_argument("--vcenter-keepalive", action=EnvDefault, envvar="VCENTER_KEEPALIVE", required=False,
+                            default=300, type=int,
+                            help="How often (in seconds) to touch idle vCenter sessions so they don't expire")
+
+        parser.add_argument("--scheduler-strategy", action=EnvDefault, envvar="SCHEDULER_STRATEGY", required=False,
+                            default=PlacementStrategy.SPREAD.value,
+                            choices=[strategy.value for strategy in PlacementStrategy],
+                            help="How to pick the host to place new instances on")
+
         required_group.add_argument("--menu-url", action=EnvDefault, envvar="MENU_URL", required=True,
                                     help="Telnet URL to the menu server")
 
@@ -182,7 +198,15 @@ class RunManager(Daemon):
         self.logger.info("CRDs have been created")
 
         self.menu_url = args.menu_url
-        self.vmware = VMWare(args.vcenter_host, args.vcenter_port, args.vcenter_username, args.vcenter_password)
+        self.scheduler_strategy = PlacementStrategy(args.scheduler_strategy)
+        self.vmware = VMWare(args.vcenter_host, args.vcenter_port, args.vcenter_username, args.vcenter_password,
+                             pool_size=int(args.vcenter_pool_size), keepalive_seconds=int(args.vcenter_keepalive))
+        self.vmware.start_keepalive()
+        self.vmware.start_inventory()
+        self.vmware.start_task_watcher()
+        self.vmware.start_power_watcher()
+
+        Thread(target=self.log_metrics, daemon=True).start()
 
         self.leader_elector = LeaderElector("sandwich-controller", "kube-system", self.on_started_leading,
                                             self.on_stopped_leading)
@@ -190,6 +214,10 @@ class RunManager(Daemon):
 
         return 0
 
+    def log_metrics(self):
+        while self.metrics_stop.wait(self.metrics_interval) is False:
+            self.logger.info("Metrics: " + json.dumps(metrics.snapshot(), sort_keys=True))
+
     def launch_controller(self, controller):
         self.controllers.append(controller)
         controller.start()
@@ -214,7 +242,8 @@ class RunManager(Daemon):
         self.launch_controller(ProjectServiceAccountController(1, 30))
         self.launch_controller(FlavorController(1, 30))
         self.launch_controller(VolumeController(4, 30, self.vmware))
-        self.launch_controller(InstanceController(4, 30, self.vmware, self.menu_url))
+        self.launch_controller(InstanceController(4, 30, self.vmware, self.menu_url,
+                                                  scheduler_strategy=self.scheduler_strategy))
         self.launch_controller(KeypairController(4, 30))
 
     @with_defer
@@ -228,5 +257,8 @@ class RunManager(Daemon):
 
     def on_shutdown(self, signum=None, frame=None):
         self.logger.info("Shutting down the Manager")
+        self.metrics_stop.set()
         if self.leader_elector is not None:
             self.leader_elector.shutdown()
+        if self.vmware is not None:
+            self.vmware.close()
@@ -0,0 +1,159 @@
+import logging
+import threading
+
+from go_defer import with_defer, defer
+from pyVmomi import vim, vmodl
+
+
+class VMWareInventory(object):
+    """
+    An in-memory index of vCenter inventory objects by type and name.
+
+    It is kept up to date with a PropertyCollector subscription on its own session so
+    looking up an object doesn't need to walk the inventory.
+    """
+
+    TYPES = [vim.Datacenter, vim.Folder, vim.VirtualMachine, vim.ClusterComputeResource, vim.Datastore,
+             vim.dvs.DistributedVirtualPortgroup]
+
+    def __init__(self, vmware, max_wait_seconds=60):
+        self.logger = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
+        self.vmware = vmware
+        self.max_wait_seconds = max_wait_seconds
+
+        self.lock = threading.RLock()
+        # moid -> {'type': ..., 'name': ..., 'parent': moid}
+        self.objects = {}
+        # (type, name) -> set of moids
+        self.names = {}
+        self.ready = False
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while self.stop_event.is_set() is False:
+            vmware_client = None
+            try:
+                vmware_client = self.vmware.connect()
+                self.watch(vmware_client)
+            except Exception:
+                self.logger.exception("Error watching the vCenter inventory. Trying again in 5 seconds.")
+            finally:
+                self.reset()
+                if vmware_client is not None:
+                    self.vmware._disconnect(vmware_client)
+            self.stop_event.wait(5)
+
+    def watch(self, vmware_client):
+        content = vmware_client.RetrieveContent()
+        view = content.viewManager.CreateContainerView(content.rootFolder, self.TYPES, True)
+
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(name="traverseView", path="view", skip=False,
+                                                                     type=vim.view.ContainerView)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True,
+                                                                          selectSet=[traversal_spec])]
+        filter_spec.propSet = [vmodl.query.PropertyCollector.PropertySpec(type=vimtype, pathSet=["name", "parent"],
+                                                                          all=False)
+                               for vimtype in self.TYPES]
+
+        property_collector = content.propertyCollector.CreatePropertyCollector()
+        property_collector.CreateFilter(filter_spec, True)
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=self.max_wait_seconds)
+        try:
+            version = ""
+            while self.stop_event.is_set() is False:
+                update = property_collector.WaitForUpdatesEx(version, options)
+                if update is None:
+                    # Nothing changed
+                    continue
+                self.apply(update)
+                version = update.version
+                if update.truncated is not True:
+                    self.ready = True
+        finally:
+            property_collector.Destroy()
+            view.Destroy()
+
+    @with_defer
+    def apply(self, update):
+        self.lock.acquire()
+        defer(self.lock.release)
+
+        for filter_set in update.filterSet:
+            for obj_set in filter_set.objectSet:
+                moid = obj_set.obj._moId
+                if obj_set.kind == "leave":
+                    self._remove(moid)
+                    continue
+
+                current = self.objects.get(moid, {'type': obj_set.obj._wsdlName, 'name': None, 'parent': None})
+                name = current['name']
+                parent = current['parent']
+                for change in obj_set.changeSet:
+                    if change.name == "name":
+                        name = change.val if change.op != "remove" else None
+                    elif change.name == "parent":
+                        parent = change.val._moId if change.op != "remove" and change.val is not None else None
+
+                self._remove(moid)
+                self.objects[moid] = {'type': current['type'], 'name': name, 'parent': parent}
+                self.names.setdefault((current['type'], name), set()).add(moid)
+
+    def _remove(self, moid):
+        obj = self.objects.pop(moid, None)
+        if obj is None:
+            return
+        moids = self.names.get((obj['type'], obj['name']))
+        if moids is not None:
+            moids.discard(moid)
+            if len(moids) == 0:
+                del self.names[(obj['type'], obj['name'])]
+
+    @with_defer
+    def reset(self):
+        self.lock.acquire()
+        defer(self.lock.release)
+        self.ready = False
+        self.objects = {}
+        self.names = {}
+
+    def _is_under(self, moid, folder_moid):
+        # Objects are never nested very deep so walking up the parents is cheap
+        seen = set()
+        while moid is not None and moid not in seen:
+            if moid == folder_moid:
+                return True
+            seen.add(moid)
+            obj = self.objects.get(moid)
+            if obj is None:
+                return False
+            moid = obj['parent']
+        return False
+
+    @with_defer
+    def find(self, vimtype, name, folder=None):
+        """
+        Returns the moid of an object with the type and name that is inside folder
+
+        Returns None if the inventory isn't ready or doesn't know about the object
+        """
+        if self.ready is False:
+            return None
+
+        self.lock.acquire()
+        defer(self.lock.release)
+
+        for moid in self.names.get((vimtype._wsdlName, name), []):
+            if folder is None or self._is_under(moid, folder._moId):
+                return moid
+        return None
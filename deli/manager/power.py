@@ -0,0 +1,164 @@
+import logging
+import threading
+
+from go_defer import with_defer, defer
+from pyVmomi import vim, vmodl
+
+
+class VMWarePowerWatcher(object):
+    """
+    Follows the power state of every VM with a PropertyCollector subscription on its own
+    session and calls back as soon as one changes.
+    """
+
+    def __init__(self, vmware, max_wait_seconds=60):
+        self.logger = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
+        self.vmware = vmware
+        self.max_wait_seconds = max_wait_seconds
+
+        self.lock = threading.RLock()
+        # moid -> (instance uuid, power state)
+        self.vms = {}
+        self.callbacks = []
+        # Called once every VM has been reported after (re)connecting
+        self.sync_callbacks = []
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    @with_defer
+    def add_callback(self, callback):
+        """
+        Call callback(vm_uuid, power_state) whenever a VM changes power state
+
+        power_state is the str of the vim.VirtualMachine.PowerState or None if the VM is gone
+        """
+        self.lock.acquire()
+        defer(self.lock.release)
+        if callback not in self.callbacks:
+            self.callbacks.append(callback)
+
+    @with_defer
+    def remove_callback(self, callback):
+        self.lock.acquire()
+        defer(self.lock.release)
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    @with_defer
+    def add_sync_callback(self, callback):
+        """
+        Call callback() after the watcher (re)connects and has reported every VM
+
+        Changes made while the watcher wasn't connected may not show up as changes so
+        this is the time to double check
+        """
+        self.lock.acquire()
+        defer(self.lock.release)
+        if callback not in self.sync_callbacks:
+            self.sync_callbacks.append(callback)
+
+    @with_defer
+    def remove_sync_callback(self, callback):
+        self.lock.acquire()
+        defer(self.lock.release)
+        if callback in self.sync_callbacks:
+            self.sync_callbacks.remove(callback)
+
+    def run(self):
+        while self.stop_event.is_set() is False:
+            vmware_client = None
+            try:
+                vmware_client = self.vmware.connect()
+                self.watch(vmware_client)
+            except Exception:
+                self.logger.exception("Error watching VM power states. Trying again in 5 seconds.")
+            finally:
+                if vmware_client is not None:
+                    self.vmware._disconnect(vmware_client)
+            self.stop_event.wait(5)
+
+    def watch(self, vmware_client):
+        content = vmware_client.RetrieveContent()
+        view = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine], True)
+
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(name="traverseView", path="view", skip=False,
+                                                                     type=vim.view.ContainerView)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True,
+                                                                          selectSet=[traversal_spec])]
+        filter_spec.propSet = [vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine,
+                                                                          pathSet=["config.instanceUuid",
+                                                                                   "runtime.powerState"],
+                                                                          all=False)]
+
+        property_collector = content.propertyCollector.CreatePropertyCollector()
+        property_collector.CreateFilter(filter_spec, True)
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=self.max_wait_seconds)
+        try:
+            version = ""
+            while self.stop_event.is_set() is False:
+                update = property_collector.WaitForUpdatesEx(version, options)
+                if update is None:
+                    # Nothing changed
+                    continue
+                # The first update has every VM, callbacks compare against what they have
+                # so it also catches anything that changed while we weren't watching
+                self.apply(update)
+                if version == "":
+                    self.synced()
+                version = update.version
+        finally:
+            property_collector.Destroy()
+            view.Destroy()
+
+    def synced(self):
+        with self.lock:
+            callbacks = list(self.sync_callbacks)
+        for callback in callbacks:
+            # noinspection PyBroadException
+            try:
+                callback()
+            except Exception:
+                self.logger.exception("Error calling power state sync callback")
+
+    def apply(self, update):
+        changes = []
+        with self.lock:
+            for filter_set in update.filterSet:
+                for obj_set in filter_set.objectSet:
+                    moid = obj_set.obj._moId
+                    if obj_set.kind == "leave":
+                        vm_uuid, _ = self.vms.pop(moid, (None, None))
+                        if vm_uuid is not None:
+                            changes.append((vm_uuid, None))
+                        continue
+
+                    vm_uuid, power_state = self.vms.get(moid, (None, None))
+                    for change in obj_set.changeSet:
+                        value = change.val if change.op != "remove" else None
+                        if change.name == "config.instanceUuid":
+                            vm_uuid = value
+                        elif change.name == "runtime.powerState":
+                            power_state = str(value) if value is not None else None
+
+                    self.vms[moid] = (vm_uuid, power_state)
+                    if vm_uuid is not None:
+                        changes.append((vm_uuid, power_state))
+            callbacks = list(self.callbacks)
+
+        for vm_uuid, power_state in changes:
+            for callback in callbacks:
+                # noinspection PyBroadException
+                try:
+                    callback(vm_uuid, power_state)
+                except Exception:
+                    self.logger.exception("Error calling power state callback for VM " + vm_uuid)
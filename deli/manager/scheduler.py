@@ -0,0 +1,219 @@
+import enum
+import logging
+import math
+import threading
+import time
+
+from go_defer import with_defer, defer
+from pyVmomi import vim
+
+from deli.kubernetes.resources.model import ResourceState
+
+
+class PlacementStrategy(enum.Enum):
+    SPREAD = 'spread'  # Host running the fewest instances
+    BINPACK = 'binpack'  # Host with the least room left that still fits
+    LEAST_LOADED = 'least-loaded'  # Host with the lowest cpu or ram usage
+
+
+class HostCapacity(object):
+
+    def __init__(self, moid, name, total_cores, total_ram):
+        self.moid = moid
+        self.name = name
+        self.total_cores = total_cores
+        self.total_ram = total_ram
+
+
+class ZoneCapacity(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.hosts = {}
+        # vm id -> host name as last seen in vCenter
+        self.vm_hosts = {}
+        # host name -> [cores, ram, instances], None is reserved on every host
+        self.used = {}
+        self.expires_at = 0
+
+    def add_usage(self, host, vcpus, ram, count=1):
+        used = self.used.setdefault(host, [0, 0, 0])
+        used[0] += vcpus
+        used[1] += ram
+        used[2] += count
+        if used[2] == 0:
+            del self.used[host]
+
+    def free(self, host: HostCapacity):
+        used_cores, used_ram, instances = self.used.get(host.name, [0, 0, 0])
+        if None in self.used:
+            used_cores += self.used[None][0]
+            used_ram += self.used[None][1]
+            instances += self.used[None][2]
+        return host.total_cores - used_cores, host.total_ram - used_ram, instances
+
+
+class Scheduler(object):
+    """
+    Places instances on hosts using an in-memory model of how much each host has in use.
+
+    Usage is kept up to date from instance events and the hosts VMs are running on are
+    refreshed from vCenter every so often. Placing an instance reserves its capacity right away
+    so workers scheduling at the same time don't pick the same free space.
+    """
+
+    def __init__(self, vmware, strategy=PlacementStrategy.SPREAD, refresh_seconds=60):
+        self.logger = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
+        self.vmware = vmware
+        self.strategy = strategy
+        self.refresh_seconds = refresh_seconds
+
+        self.lock = threading.RLock()
+        self.zones = {}
+        # instance key -> (zone name, vm id, reserved host name, vcpus, ram)
+        self.placements = {}
+
+    @staticmethod
+    def instance_key(instance):
+        return instance.project_name + "/" + str(instance.name)
+
+    def _zone(self, zone_name):
+        zone_capacity = self.zones.get(zone_name)
+        if zone_capacity is None:
+            zone_capacity = ZoneCapacity(zone_name)
+            self.zones[zone_name] = zone_capacity
+        return zone_capacity
+
+    def _placement_host(self, zone_capacity, placement):
+        """
+        Returns if the placement uses any capacity and the host it is using it on
+        """
+        _, vm_id, reserved_host, _, _ = placement
+        if vm_id is not None and vm_id in zone_capacity.vm_hosts:
+            return True, zone_capacity.vm_hosts[vm_id]
+        if vm_id is None or reserved_host is not None:
+            # Not built yet or built since we last looked so hold what we reserved for it
+            return True, reserved_host
+        # The VM doesn't exist
+        return False, None
+
+    def _add_placement(self, key, placement):
+        self._remove_placement(key)
+        self.placements[key] = placement
+        zone_capacity = self._zone(placement[0])
+        counted, host = self._placement_host(zone_capacity, placement)
+        if counted:
+            zone_capacity.add_usage(host, placement[3], placement[4])
+
+    def _remove_placement(self, key):
+        placement = self.placements.pop(key, None)
+        if placement is None:
+            return
+        zone_capacity = self._zone(placement[0])
+        counted, host = self._placement_host(zone_capacity, placement)
+        if counted:
+            zone_capacity.add_usage(host, -placement[3], -placement[4], count=-1)
+
+    @with_defer
+    def instance_updated(self, instance):
+        self.lock.acquire()
+        defer(self.lock.release)
+
+        key = self.instance_key(instance)
+        vm_id = str(instance.vm_id) if instance.vm_id is not None else None
+        if instance.zone_name is None or instance.state == ResourceState.Deleted or \
+                (vm_id is None and instance.state == ResourceState.Error):
+            self._remove_placement(key)
+            return
+
+        reserved_host = None
+        placement = self.placements.get(key)
+        if placement is not None and placement[0] == instance.zone_name:
+            reserved_host = placement[2]
+
+        placement = (instance.zone_name, vm_id, reserved_host, instance.vcpus, instance.ram)
+        if self.placements.get(key) != placement:
+            self._add_placement(key, placement)
+
+    @with_defer
+    def instance_deleted(self, instance):
+        self.lock.acquire()
+        defer(self.lock.release)
+        self._remove_placement(self.instance_key(instance))
+
+    def refresh_zone(self, vmware_client, datacenter, zone):
+        cluster = self.vmware.get_cluster(vmware_client, zone.vm_cluster, datacenter)
+        hosts = {}
+        for host in cluster.host:
+            total_cores = math.floor(host.hardware.cpuInfo.numCpuThreads * (zone.core_provision_percent / 100))
+            total_ram = math.floor(host.hardware.memorySize * (zone.ram_provision_percent / 100))
+            hosts[host.name] = HostCapacity(host._moId, host.name, total_cores, total_ram)
+        vm_runtimes = self.vmware.get_cluster_vm_runtimes(vmware_client, cluster)
+
+        with self.lock:
+            zone_capacity = self._zone(zone.name)
+            placements = [(key, placement) for key, placement in self.placements.items()
+                          if placement[0] == zone.name]
+            for key, _ in placements:
+                self._remove_placement(key)
+
+            zone_capacity.hosts = hosts
+            zone_capacity.vm_hosts = dict([(vm_id, vm_runtime['host']) for vm_id, vm_runtime in vm_runtimes.items()])
+            zone_capacity.expires_at = time.monotonic() + self.refresh_seconds
+
+            for key, placement in placements:
+                self._add_placement(key, placement)
+
+    def _score(self, zone_capacity, host, vcpus, ram):
+        """
+        Lower is better, None if the host can't fit the instance
+        """
+        free_cores, free_ram, instances = zone_capacity.free(host)
+        if free_cores < vcpus or free_ram < ram:
+            return None
+
+        if self.strategy == PlacementStrategy.BINPACK:
+            return (free_cores - vcpus) / max(host.total_cores, 1) + (free_ram - ram) / max(host.total_ram, 1)
+        if self.strategy == PlacementStrategy.LEAST_LOADED:
+            return max(1 - free_cores / max(host.total_cores, 1), 1 - free_ram / max(host.total_ram, 1))
+        return instances
+
+    @with_defer
+    def schedule(self, vmware_client, datacenter, zones, instance):
+        """
+        Pick the best host for the instance out of the given zones and reserve room for it
+
+        Returns the zone and the vim.HostSystem to place the instance on or (None, None)
+        if nothing has room
+        """
+        now = time.monotonic()
+        for zone in zones:
+            zone_capacity = self.zones.get(zone.name)
+            if zone_capacity is None or zone_capacity.expires_at <= now:
+                self.refresh_zone(vmware_client, datacenter, zone)
+
+        self.lock.acquire()
+        defer(self.lock.release)
+
+        key = self.instance_key(instance)
+        # If we are trying again forget about where we tried last time
+        self._remove_placement(key)
+
+        best = None
+        for zone in zones:
+            zone_capacity = self._zone(zone.name)
+            for host in zone_capacity.hosts.values():
+                score = self._score(zone_capacity, host, instance.vcpus, instance.ram)
+                if score is None:
+                    continue
+                if best is None or score < best[0]:
+                    best = (score, zone, host)
+
+        if best is None:
+            return None, None
+
+        _, zone, host = best
+        self._add_placement(key, (zone.name, None, host.name, instance.vcpus, instance.ram))
+
+        # Bind the reference to the caller's session
+        return zone, vim.HostSystem(host.moid, vmware_client._stub)
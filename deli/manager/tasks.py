@@ -0,0 +1,140 @@
+import logging
+import threading
+
+from go_defer import with_defer, defer
+from pyVmomi import vim, vmodl
+
+
+class VMWareTaskWatcher(object):
+    """
+    Follows every outstanding vCenter task with one PropertyCollector and calls back
+    as soon as a task finishes.
+
+    Tasks are added to a ListView so a single filter covers all of them.
+    """
+
+    def __init__(self, vmware, max_wait_seconds=2):
+        self.logger = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
+        self.vmware = vmware
+        # How long to wait for updates before checking for new tasks to watch
+        self.max_wait_seconds = max_wait_seconds
+
+        self.lock = threading.RLock()
+        # task key -> callbacks to call once it's done
+        self.callbacks = {}
+        # Task keys that need adding to the view
+        self.pending = set()
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.stop_event.is_set() is False
+
+    @with_defer
+    def watch(self, task_key, callback):
+        """
+        Call callback(task_key, state) once the task is done
+
+        state is the final vim.TaskInfo.State or None if vCenter doesn't know about the task
+        """
+        self.lock.acquire()
+        defer(self.lock.release)
+        callbacks = self.callbacks.setdefault(task_key, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+        self.pending.add(task_key)
+
+    def _finish(self, task_key, state):
+        self.lock.acquire()
+        callbacks = self.callbacks.pop(task_key, [])
+        self.pending.discard(task_key)
+        self.lock.release()
+
+        for callback in callbacks:
+            # noinspection PyBroadException
+            try:
+                callback(task_key, state)
+            except Exception:
+                self.logger.exception("Error calling back for task " + task_key)
+
+    def run(self):
+        while self.stop_event.is_set() is False:
+            vmware_client = None
+            try:
+                vmware_client = self.vmware.connect()
+                self._watch(vmware_client)
+            except Exception:
+                self.logger.exception("Error watching vCenter tasks. Trying again in 5 seconds.")
+            finally:
+                if vmware_client is not None:
+                    self.vmware._disconnect(vmware_client)
+            # Everything needs to be added to the new view
+            self.lock.acquire()
+            self.pending = set(self.callbacks.keys())
+            self.lock.release()
+            self.stop_event.wait(5)
+
+    def _task(self, vmware_client, task_key):
+        return vim.Task(task_key, vmware_client._stub)
+
+    def _watch(self, vmware_client):
+        content = vmware_client.RetrieveContent()
+        view = content.viewManager.CreateListView([])
+
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(name="traverseView", path="view", skip=False,
+                                                                     type=vim.view.ListView)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True,
+                                                                          selectSet=[traversal_spec])]
+        filter_spec.propSet = [vmodl.query.PropertyCollector.PropertySpec(type=vim.Task, pathSet=["info.state"],
+                                                                          all=False)]
+
+        property_collector = content.propertyCollector.CreatePropertyCollector()
+        property_collector.CreateFilter(filter_spec, True)
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=self.max_wait_seconds)
+        try:
+            version = ""
+            while self.stop_event.is_set() is False:
+                self.lock.acquire()
+                to_add, self.pending = self.pending, set()
+                self.lock.release()
+
+                if len(to_add) > 0:
+                    unresolved = view.ModifyListView(add=[self._task(vmware_client, key) for key in to_add])
+                    for task in unresolved or []:
+                        # vCenter has forgotten about the task
+                        self._finish(task._moId, None)
+
+                update = property_collector.WaitForUpdatesEx(version, options)
+                if update is None:
+                    continue
+                version = update.version
+
+                done = []
+                for filter_set in update.filterSet:
+                    for obj_set in filter_set.objectSet:
+                        if obj_set.kind == "leave":
+                            continue
+                        for change in obj_set.changeSet:
+                            if change.name != "info.state":
+                                continue
+                            if change.val in [vim.TaskInfo.State.success, vim.TaskInfo.State.error]:
+                                done.append((obj_set.obj, change.val))
+
+                if len(done) > 0:
+                    view.ModifyListView(remove=[task for task, _ in done])
+                    for task, state in done:
+                        self._finish(task._moId, state)
+        finally:
+            property_collector.Destroy()
+            view.Destroy()
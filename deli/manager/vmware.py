@@ -1,24 +1,65 @@
+import http.client
+import logging
+import queue
+import ssl
+import threading
+import time
 import uuid
 from contextlib import contextmanager
 
+from go_defer import with_defer, defer
 from pyVim import connect
 from pyVmomi import vim, vmodl
 
+from deli.manager.inventory import VMWareInventory
+from deli.manager.power import VMWarePowerWatcher
+from deli.manager.tasks import VMWareTaskWatcher
+
+# Errors that mean the session can't be used anymore
+SESSION_ERRORS = (vim.fault.NotAuthenticated, http.client.HTTPException, OSError)
+
 
 class VMWare(object):
-    def __init__(self, host, port, username, password):
+    def __init__(self, host, port, username, password, pool_size=10, keepalive_seconds=300, health_check_seconds=60):
+        self.logger = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
         self.host = host
         self.port = port
         self.username = username
         self.password = password
 
+        # Logged in sessions that aren't being used, (client, last time it was known to be good)
+        self.pool_size = pool_size
+        self.keepalive_seconds = keepalive_seconds
+        self.health_check_seconds = health_check_seconds
+        self.idle_sessions = queue.LifoQueue()
+        self.session_count = 0
+        self.pool_lock = threading.Lock()
+        self.keepalive_stop = threading.Event()
+        self.keepalive_thread = None
+
+        self.inventory = None
+        self.task_watcher = None
+        self.power_watcher = None
+
+        # cluster moid -> (expires at, vm runtimes)
+        self.vm_runtime_cache_seconds = 5
+        self.vm_runtimes = {}
+        self.vm_runtimes_lock = threading.Lock()
+
     def connect(self):
-        return connect.SmartConnectNoSSL(
+        stub = connect.SmartStubAdapter(
             host=self.host,
-            user=self.username,
-            pwd=self.password,
-            port=self.port
+            port=self.port,
+            sslContext=ssl._create_unverified_context()
         )
+        # If the session expires while it is being used log in again and retry the call once,
+        # the body of a client_session can't be run again so this has to happen per call
+        login_method = connect.VimSessionOrientedStub.makeUserLoginMethod(self.username, self.password)
+        session_stub = connect.VimSessionOrientedStub(stub, login_method, retryCount=2)
+        vmware_client = vim.ServiceInstance("ServiceInstance", session_stub)
+        # The stub logs in on the first call, make it now so bad credentials fail here instead of on first use
+        vmware_client.RetrieveContent()
+        return vmware_client
 
     def get_datacenter(self, vmware_client, datacenter_name):
         return self.get_obj(vmware_client, vim.Datacenter, datacenter_name)
@@ -33,6 +74,68 @@ class VMWare(object):
     def get_vm(self, vmware_client, vm_uuid, datacenter):
         return vmware_client.content.searchIndex.FindByUuid(datacenter, vm_uuid, vmSearch=True, instanceUuid=True)
 
+    def get_cluster_vm_runtimes(self, vmware_client, cluster):
+        """
+        Returns get_vm_runtimes for the cluster
+
+        The result is kept for a few seconds so scheduling many instances doesn't look up each VM over and over
+        """
+        now = time.monotonic()
+        with self.vm_runtimes_lock:
+            cached = self.vm_runtimes.get(cluster._moId)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        runtimes = self.get_vm_runtimes(vmware_client, cluster)
+
+        with self.vm_runtimes_lock:
+            self.vm_runtimes[cluster._moId] = (now + self.vm_runtime_cache_seconds, runtimes)
+        return runtimes
+
+    def get_vm_runtimes(self, vmware_client, container):
+        """
+        Returns the host name and power state of every VM under container (ex: a cluster or datacenter)
+        keyed by instance uuid with one RetrieveContents call
+        """
+        content = vmware_client.RetrieveContent()
+        view = content.viewManager.CreateContainerView(container, [vim.VirtualMachine, vim.HostSystem], True)
+        try:
+            traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(name="traverseView", path="view",
+                                                                         skip=False, type=vim.view.ContainerView)
+            filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+            filter_spec.objectSet = [vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True,
+                                                                              selectSet=[traversal_spec])]
+            filter_spec.propSet = [
+                vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine,
+                                                           pathSet=["config.instanceUuid", "runtime.host",
+                                                                    "runtime.powerState"],
+                                                           all=False),
+                vmodl.query.PropertyCollector.PropertySpec(type=vim.HostSystem, pathSet=["name"], all=False)
+            ]
+            obj_contents = content.propertyCollector.RetrieveContents([filter_spec])
+        finally:
+            view.Destroy()
+
+        host_names = {}
+        vms = []
+        for obj_content in obj_contents:
+            props = dict([(prop.name, prop.val) for prop in obj_content.propSet or []])
+            if isinstance(obj_content.obj, vim.HostSystem):
+                host_names[obj_content.obj._moId] = props.get("name")
+            elif props.get("config.instanceUuid") is not None:
+                vms.append(props)
+
+        runtimes = {}
+        for props in vms:
+            host = props.get("runtime.host")
+            runtimes[props["config.instanceUuid"]] = {
+                # None if the VM doesn't have a host
+                'host': host_names.get(host._moId) if host is not None else None,
+                'power_state': str(props.get("runtime.powerState"))
+            }
+
+        return runtimes
+
     def get_cluster(self, vmware_client, cluster_name, datacenter):
         return self.get_obj(vmware_client, vim.ClusterComputeResource, cluster_name, folder=datacenter.hostFolder)
 
@@ -58,10 +161,7 @@ class VMWare(object):
         spec.backingSpec.datastore = datastore
 
         task = vStorageManager.CreateDisk_Task(spec)
-        self.wait_for_tasks(vmware_client, [task])
-        vStorageObject = task.info.result
-
-        return vStorageObject.config.name.name
+        return task
 
     def clone_disk(self, vmware_client, disk_name, disk_id, datastore):
         vStorageManager = vmware_client.RetrieveContent().vStorageObjectManager
@@ -77,31 +177,30 @@ class VMWare(object):
     def delete_disk(self, vmware_client, disk_id, datastore):
         vStorageManager = vmware_client.RetrieveContent().vStorageObjectManager
         task = vStorageManager.DeleteVStorageObject_Task(id=vim.vslm.ID(id=disk_id), datastore=datastore)
-        self.wait_for_tasks(vmware_client, [task])
+        return task
 
     def grow_disk(self, vmware_client, disk_id, size, datastore):
         vStorageManager = vmware_client.RetrieveContent().vStorageObjectManager
         task = vStorageManager.ExtendDisk_Task(id=vim.vslm.ID(id=disk_id), datastore=datastore,
                                                newCapacityInMB=size * 1024)
-        self.wait_for_tasks(vmware_client, [task])
+        return task
 
     def attach_disk(self, vmware_client, disk_id, datastore, vm):
         task = vm.AttachDisk_Task(diskId=vim.vslm.ID(id=disk_id), datastore=datastore)
-        self.wait_for_tasks(vmware_client, [task])
+        return task
 
     def detach_disk(self, vmware_client, disk_id, vm):
         task = vm.DetachDisk_Task(diskId=vim.vslm.ID(id=disk_id))
-        try:
-            self.wait_for_tasks(vmware_client, [task])
-        except vim.fault.NotFound:
-            # Ignore error if the disk is already detached
-            pass
+        return task
 
-    def create_vm_from_image(self, vm_name, image, datacenter, cluster, datastore, folder, port_group, vcpus, ram):
+    def create_vm_from_image(self, vm_name, image, datacenter, cluster, datastore, folder, port_group, vcpus, ram,
+                             host=None):
 
         relospec = vim.vm.RelocateSpec()
         relospec.datastore = datastore
         relospec.pool = cluster.resourcePool
+        if host is not None:
+            relospec.host = host
 
         clonespec = vim.vm.CloneSpec()
         clonespec.location = relospec
@@ -266,11 +365,64 @@ class VMWare(object):
         task = vm.Clone(folder=folder, name=file_name, spec=clonespec)
         return task, file_name
 
+    def start_inventory(self):
+        if self.inventory is None:
+            self.inventory = VMWareInventory(self)
+            self.inventory.start()
+
+    def start_power_watcher(self):
+        if self.power_watcher is None:
+            self.power_watcher = VMWarePowerWatcher(self)
+            self.power_watcher.start()
+
+    def watch_power(self, callback, sync_callback=None):
+        """
+        Call callback(vm_uuid, power_state) whenever a VM changes power state
+        and sync_callback() every time the watcher (re)connects and has reported every VM
+
+        Returns False if there is no power watcher running
+        """
+        if self.power_watcher is None:
+            return False
+        self.power_watcher.add_callback(callback)
+        if sync_callback is not None:
+            self.power_watcher.add_sync_callback(sync_callback)
+        return True
+
+    def unwatch_power(self, callback, sync_callback=None):
+        if self.power_watcher is not None:
+            self.power_watcher.remove_callback(callback)
+            if sync_callback is not None:
+                self.power_watcher.remove_sync_callback(sync_callback)
+
+    def start_task_watcher(self):
+        if self.task_watcher is None:
+            self.task_watcher = VMWareTaskWatcher(self)
+            self.task_watcher.start()
+
+    def watch_task(self, task_key, callback):
+        """
+        Call callback(task_key, state) once the task is done
+
+        Returns False if there is no task watcher running
+        """
+        if self.task_watcher is None or self.task_watcher.running is False:
+            return False
+        self.task_watcher.watch(task_key, callback)
+        return True
+
     def get_obj(self, vmware_client, vimtype, name, folder=None):
         """
         Return an object by name, if name is None the
         first found object is returned
         """
+        if self.inventory is not None and name is not None:
+            moid = self.inventory.find(vimtype, name, folder=folder)
+            if moid is not None:
+                # Bind the reference to the caller's session
+                return vimtype(moid, vmware_client._stub)
+
+        # The inventory isn't ready or doesn't know about it yet so look for it the slow way
         obj = None
         content = vmware_client.RetrieveContent()
 
@@ -287,16 +439,17 @@ class VMWare(object):
         return obj
 
     def get_task(self, vmware_client, task_key):
-        task = vim.Task(task_key)
-        task._stub = vmware_client._stub
-        return task
+        return vim.Task(task_key, vmware_client._stub)
 
-    def is_task_done(self, task):
+    def is_task_done(self, task, ignore_not_found=False):
         state = task.info.state
         if state == vim.TaskInfo.State.success:
             return True, None
 
         if state == vim.TaskInfo.State.error:
+            if ignore_not_found and isinstance(task.info.error, vim.fault.NotFound):
+                # Ex: detaching a disk that is already detached
+                return True, None
             return True, str(task.info.error.msg)
 
         return False, None
@@ -305,6 +458,33 @@ class VMWare(object):
         """Given the service instance si and tasks, it returns after all the
        tasks are complete
        """
+        if self.task_watcher is not None and self.task_watcher.running:
+            remaining = set([task._moId for task in tasks])
+            states = {}
+            done = threading.Event()
+            lock = threading.Lock()
+
+            def callback(task_key, state):
+                with lock:
+                    states[task_key] = state
+                    remaining.discard(task_key)
+                    if len(remaining) == 0:
+                        done.set()
+
+            for task in tasks:
+                self.task_watcher.watch(task._moId, callback)
+            while done.wait(5) is False and self.task_watcher.running:
+                pass
+
+            if done.is_set():
+                for task in tasks:
+                    if states[task._moId] != vim.TaskInfo.State.success:
+                        # Errored or vCenter forgot about it, either way the task has the details
+                        if task.info.state == vim.TaskInfo.State.error:
+                            raise task.info.error
+                return
+            # The watcher was stopped so wait the old way
+
         property_collector = vmware_client.RetrieveContent().propertyCollector
         task_list = [str(task) for task in tasks]
         # Create filter
@@ -347,10 +527,119 @@ class VMWare(object):
             if pcfilter:
                 pcfilter.Destroy()
 
+    def _disconnect(self, vmware_client):
+        try:
+            connect.Disconnect(vmware_client)
+        except Exception:
+            # The session is probably already gone
+            pass
+
+    def _is_alive(self, vmware_client):
+        try:
+            return vmware_client.content.sessionManager.currentSession is not None
+        except SESSION_ERRORS:
+            return False
+
+    def _borrow(self):
+        while True:
+            try:
+                vmware_client, checked_at = self.idle_sessions.get_nowait()
+                break
+            except queue.Empty:
+                pass
+
+            self.pool_lock.acquire()
+            can_create = self.session_count < self.pool_size
+            if can_create:
+                self.session_count += 1
+            self.pool_lock.release()
+
+            if can_create:
+                try:
+                    return self.connect()
+                except Exception:
+                    self._forget()
+                    raise
+
+            # Pool is full so wait for someone to give a session back
+            # and check again every so often in case a broken one was thrown away
+            try:
+                vmware_client, checked_at = self.idle_sessions.get(timeout=1)
+                break
+            except queue.Empty:
+                pass
+
+        if checked_at + self.health_check_seconds <= time.monotonic() and self._is_alive(vmware_client) is False:
+            # The session expired while it was sitting in the pool, log in again
+            self.logger.info("vCenter session expired, logging in again")
+            self._disconnect(vmware_client)
+            try:
+                return self.connect()
+            except Exception:
+                self._forget()
+                raise
+
+        return vmware_client
+
+    def _return(self, vmware_client):
+        self.idle_sessions.put((vmware_client, time.monotonic()))
+
+    @with_defer
+    def _forget(self):
+        self.pool_lock.acquire()
+        defer(self.pool_lock.release)
+        self.session_count -= 1
+
+    def _discard(self, vmware_client):
+        self._disconnect(vmware_client)
+        self._forget()
+
+    def start_keepalive(self):
+        if self.keepalive_thread is None:
+            self.keepalive_thread = threading.Thread(target=self._run_keepalive, daemon=True)
+            self.keepalive_thread.start()
+
+    def _run_keepalive(self):
+        # Touch idle sessions every so often so vCenter doesn't expire them
+        while self.keepalive_stop.wait(self.keepalive_seconds) is False:
+            sessions = []
+            while True:
+                try:
+                    sessions.append(self.idle_sessions.get_nowait())
+                except queue.Empty:
+                    break
+
+            for vmware_client, checked_at in sessions:
+                if self._is_alive(vmware_client):
+                    self._return(vmware_client)
+                else:
+                    self._discard(vmware_client)
+
+    def close(self):
+        self.keepalive_stop.set()
+        if self.inventory is not None:
+            self.inventory.stop()
+        if self.task_watcher is not None:
+            self.task_watcher.stop()
+        if self.power_watcher is not None:
+            self.power_watcher.stop()
+        while True:
+            try:
+                vmware_client, _ = self.idle_sessions.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(vmware_client)
+
     @contextmanager
     def client_session(self):
-        vmware_client = self.connect()
+        vmware_client = self._borrow()
         try:
             yield vmware_client
+        except SESSION_ERRORS:
+            # Don't give a broken session back to the pool
+            self._discard(vmware_client)
+            vmware_client = None
+            raise
         finally:
-            connect.Disconnect(vmware_client)
+            if vmware_client is not None:
+                self._return(vmware_client)
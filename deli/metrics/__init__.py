@@ -0,0 +1,3 @@
+from deli.metrics.counters import Counters
+
+metrics = Counters()
@@ -0,0 +1,35 @@
+import threading
+
+from go_defer import with_defer, defer
+
+
+class Counters(object):
+    """
+    Process wide counters, ex: how many saves were skipped for each kind of resource.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, label) -> count
+        self.counts = {}
+
+    @with_defer
+    def increment(self, name, label=None, amount=1):
+        self.lock.acquire()
+        defer(self.lock.release)
+        self.counts[(name, label)] = self.counts.get((name, label), 0) + amount
+
+    def get(self, name, label=None):
+        return self.counts.get((name, label), 0)
+
+    @with_defer
+    def snapshot(self):
+        """
+        Returns {name: {label: count}}
+        """
+        self.lock.acquire()
+        defer(self.lock.release)
+        snapshot = {}
+        for (name, label), count in self.counts.items():
+            snapshot.setdefault(name, {})[label] = count
+        return snapshot